@@ -5,17 +5,79 @@ load_dotenv()
 
 class Settings:
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-    DATA_DIR = os.path.join(os.getcwd(), "data")
+    DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.getcwd(), "data"))
     RAW_DATA_DIR = os.path.join(DATA_DIR, "raw")
     VECTOR_DB_DIR = os.path.join(DATA_DIR, "vectordb")
+    CACHE_DIR = os.path.join(DATA_DIR, "cache")
+    SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshots")
+    JOBS_DIR = os.path.join(DATA_DIR, "jobs")
     QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
     QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
+    # Embedded Qdrant (no server): a local directory, or ":memory:". Overrides host/port when set.
+    QDRANT_LOCAL_PATH = os.getenv("QDRANT_LOCAL_PATH")
+    # Sitemap index listing the per-service documentation sitemaps (a local copy for load tests)
+    AWS_DOCS_SITEMAP_INDEX_URL = os.getenv("AWS_DOCS_SITEMAP_INDEX_URL", "https://docs.aws.amazon.com/sitemap_index.xml")
     
     # Model Configuration
     GEMINI_MODEL_ID = os.getenv("GEMINI_MODEL_ID", "gemini-2.0-flash")
     GEMINI_RAG_MODEL_ID = os.getenv("GEMINI_RAG_MODEL_ID", "gemini-2.0-flash")
     GEMINI_AGENT_MODEL_ID = os.getenv("GEMINI_AGENT_MODEL_ID", "gemini-2.0-flash")
     GEMINI_EMBEDDING_MODEL_ID = os.getenv("GEMINI_EMBEDDING_MODEL_ID", "text-embedding-004")
+    # "gemini", or "fake": deterministic local vectors with no network calls (benchmarks, load tests)
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini").lower()
+    FAKE_EMBEDDING_DIMENSION = int(os.getenv("FAKE_EMBEDDING_DIMENSION", 768))
+    # "gemini", or "fake": a local model that streams canned answers with a simulated latency (load tests)
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+    FAKE_LLM_FIRST_TOKEN_MS = float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "400")) # Per model call
+    FAKE_LLM_TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", "20")) # Between streamed tokens
+    FAKE_LLM_OUTPUT_TOKENS = int(os.getenv("FAKE_LLM_OUTPUT_TOKENS", 100))
+    WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "10"))
+    # Warm-up runs in the background after startup; failed components are retried this often
+    WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "30"))
+
+    # Shared cache backend for the caches below and for sessions: "memory" (per worker process),
+    # "sqlite" (a local file shared by all workers on the host and kept across restarts) or
+    # "redis" (any Redis-compatible server; needs the `redis` package)
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+    CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(CACHE_DIR, "shared.sqlite"))
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    # AWS service -> sitemap URL map from the sitemap index
+    AWS_SERVICES_CACHE_TTL_SECONDS = int(os.getenv("AWS_SERVICES_CACHE_TTL_SECONDS", 86400))
+
+    # Service Catalog / Topic Cache (invalidated on build and delete; the TTL covers external changes)
+    CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", 512))
+    CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", 600))
+    # Put the indexed service list in the agent system prompt, saving a tool round-trip
+    AGENT_INJECT_CATALOG = os.getenv("AGENT_INJECT_CATALOG", "true").lower() == "true"
+
+    # Agent Loop Limits
+    AGENT_MAX_TOOL_ITERATIONS = int(os.getenv("AGENT_MAX_TOOL_ITERATIONS", 8)) # Model turns that may call tools per run
+    AGENT_TOOL_OUTPUT_TOKEN_BUDGET = int(os.getenv("AGENT_TOOL_OUTPUT_TOKEN_BUDGET", 2000)) # Per search tool call
+    AGENT_SEARCH_RESULTS = int(os.getenv("AGENT_SEARCH_RESULTS", 5)) # Results fetched per search tool call
+
+    # RAG Prompt Budget (tokens)
+    RAG_PROMPT_TOKEN_BUDGET = int(os.getenv("RAG_PROMPT_TOKEN_BUDGET", 8000))
+    RAG_HISTORY_TOKEN_BUDGET = int(os.getenv("RAG_HISTORY_TOKEN_BUDGET", 2000))
+    RAG_RECENT_TURNS = int(os.getenv("RAG_RECENT_TURNS", 4)) # Turns kept verbatim; older ones are condensed
+    RAG_SUMMARY_TURN_CHARS = int(os.getenv("RAG_SUMMARY_TURN_CHARS", 200))
+    RAG_SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("RAG_SUMMARY_CACHE_MAX_ENTRIES", 1024))
+    RAG_SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("RAG_SUMMARY_CACHE_TTL_SECONDS", 3600))
+
+    # Conversation Sessions
+    SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 3600))
+    SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", 1000))
+    SESSION_MAX_HISTORY_MESSAGES = int(os.getenv("SESSION_MAX_HISTORY_MESSAGES", 50))
+
+    # Embedding API Rate Limiting (adaptive, shared by queries and indexing)
+    EMBEDDING_RATE_LIMIT = float(os.getenv("EMBEDDING_RATE_LIMIT", "5")) # Initial requests per second
+    EMBEDDING_MAX_RATE = float(os.getenv("EMBEDDING_MAX_RATE", "50"))
+    EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 8))
+    EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 6))
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 50)) # Texts per embed_content request
+    # Query embeddings, keyed by model and text (indexing does not use this cache)
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 1024))
+    EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 86400))
 
     LANGFUSE_PUBLIC_KEY = os.getenv("LANGFUSE_PUBLIC_KEY")
     LANGFUSE_SECRET_KEY = os.getenv("LANGFUSE_SECRET_KEY")
@@ -25,9 +87,68 @@ class Settings:
     OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("LANGFUSE_HOST", "http://localhost:3000") + "/api/public/otel"
     OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "aws-doc-agent")
     OTEL_TRACE_SAMPLING_RATIO = float(os.getenv("OTEL_TRACE_SAMPLING_RATIO", "1.0"))
+    # Below a ratio of 1, traces that were not sampled are still exported if they were slow or failed
+    TRACE_KEEP_SLOW_MS = float(os.getenv("TRACE_KEEP_SLOW_MS", "10000")) # 0 disables
+    TRACE_KEEP_ERRORS = os.getenv("TRACE_KEEP_ERRORS", "true").lower() == "true"
+    TRACE_BUFFER_MAX_SPANS = int(os.getenv("TRACE_BUFFER_MAX_SPANS", 20000)) # Spans held while waiting for their trace to finish
+    # Span inputs/outputs: "full", "truncated" (to TRACE_PAYLOAD_MAX_CHARS per string) or "none"
+    TRACE_PAYLOADS = os.getenv("TRACE_PAYLOADS", "full").lower()
+    TRACE_PAYLOAD_MAX_CHARS = int(os.getenv("TRACE_PAYLOAD_MAX_CHARS", 1000))
+
+    # Answer Cache Configuration
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 500)) # Per service
+    ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 86400))
+    # With a shared CACHE_BACKEND, answers stored by other workers are picked up this often
+    ANSWER_CACHE_SYNC_SECONDS = float(os.getenv("ANSWER_CACHE_SYNC_SECONDS", "1"))
+
+    # Retrieval Cache Configuration
+    RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+    RETRIEVAL_CACHE_BACKEND = os.getenv("RETRIEVAL_CACHE_BACKEND", CACHE_BACKEND).lower() # Overrides CACHE_BACKEND
+    RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 2048))
+    RETRIEVAL_CACHE_TTL_SECONDS = int(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", 3600))
+
+    # Per-request deadlines (seconds, 0 disables). Work is also cancelled when the client disconnects.
+    ASK_TIMEOUT_SECONDS = float(os.getenv("ASK_TIMEOUT_SECONDS", 120))
+    AGENT_TIMEOUT_SECONDS = float(os.getenv("AGENT_TIMEOUT_SECONDS", 300))
+    SCRAPE_TIMEOUT_SECONDS = float(os.getenv("SCRAPE_TIMEOUT_SECONDS", 3600))
+
+    # Background scrape-and-index jobs
+    # Scraping and indexing run as separate stages, so one service is indexed while the next is scraped
+    JOB_SCRAPE_WORKERS = int(os.getenv("JOB_SCRAPE_WORKERS", 2))
+    JOB_INDEX_WORKERS = int(os.getenv("JOB_INDEX_WORKERS", 1))
+    JOB_MAX_EVENTS = int(os.getenv("JOB_MAX_EVENTS", 1000)) # Per job; older progress events are dropped
+    JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", 100)) # Finished jobs kept in data/jobs
+
+    # In-flight deduplication of identical concurrent requests (per worker process)
+    SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+    # Admission control (concurrency limits, 0 disables). Requests over a limit wait in a bounded
+    # queue; when it is full, or the wait is too long, they are rejected with 429/503 and Retry-After.
+    ASK_MAX_CONCURRENCY = int(os.getenv("ASK_MAX_CONCURRENCY", 64))
+    AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", 32))
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 64)) # Per endpoint
+    ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+    # Upstreams: concurrent model calls (RAG and agent together) and Qdrant searches; query
+    # embeddings are bounded by EMBEDDING_MAX_CONCURRENCY and the same queue and wait limits
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 64))
+    QDRANT_MAX_CONCURRENCY = int(os.getenv("QDRANT_MAX_CONCURRENCY", 32))
+    UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", 256))
+    UPSTREAM_MAX_WAIT_SECONDS = float(os.getenv("UPSTREAM_MAX_WAIT_SECONDS", "15"))
+    # Threads for blocking work: sizes both the asyncio default executor (non-streamed answers,
+    # embeddings, Qdrant) and anyio's thread limiter for sync endpoints. The defaults (CPU count + 4,
+    # and 40) would queue admitted requests out of sight of the limits above.
+    API_WORKER_THREADS = int(os.getenv("API_WORKER_THREADS", 64))
+
+    # Event loop lag is sampled this often for /metrics (0 disables)
+    EVENT_LOOP_LAG_INTERVAL_MS = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_MS", "100"))
 
     def __init__(self):
         os.makedirs(self.RAW_DATA_DIR, exist_ok=True)
         os.makedirs(self.VECTOR_DB_DIR, exist_ok=True)
+        os.makedirs(self.CACHE_DIR, exist_ok=True)
+        os.makedirs(self.SNAPSHOT_DIR, exist_ok=True)
+        os.makedirs(self.JOBS_DIR, exist_ok=True)
 
 settings = Settings()
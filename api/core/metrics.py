@@ -0,0 +1,207 @@
+import time
+import asyncio
+import bisect
+import threading
+from contextlib import contextmanager
+from api.core.timing import record_stage
+
+# In-process metrics in the Prometheus text format, served by GET /metrics.
+# Recording is a dict update under a per-metric lock, so instrumentation can stay on in production.
+# Values are per worker process; Prometheus aggregates across workers.
+
+# Seconds; covers cache hits (~1 ms) up to long generations and index builds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels. By convention the name ends in `_total`."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram (in seconds unless noted), optionally split by labels."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                yield self.name + "_bucket", dict(labels, le=_format_value(float(bound))), cumulative
+            yield self.name + "_sum", labels, state[-1]
+            yield self.name + "_count", labels, cumulative
+
+
+class CallbackMetric:
+    """
+    Counter or gauge whose values are read from `collect()` at scrape time, for state that is
+    already tracked elsewhere (cache hit counts, queue depths). `collect` returns
+    {label values tuple: value}.
+    """
+
+    def __init__(self, name: str, documentation: str, type: str, labelnames: tuple, collect):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in self.collect().items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, type: str, labelnames: tuple, collect) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, type, labelnames, collect))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            except Exception as e:
+                # One broken collector must not take the whole endpoint down
+                lines.append(f"# collection failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Per-stage latency across scraping, indexing and answering. Stages:
+#   scrape_fetch, scrape_convert        one documentation page
+#   embedding                           one embedding API call (a query or an indexing batch)
+#   index_upsert                        one Qdrant upsert batch
+#   search                              one Qdrant query
+#   retrieval                           retrieve_service_docs on a cache miss (embedding + search + dedup)
+#   prompt_build                        RAG prompt assembly and token counting
+#   llm_first_token, llm_generation     RAG answer generation (from the start of generation)
+#   ask_total                           a whole streamed /ask answer, cache hits included
+#   agent_model, agent_tool, agent_run  one agent model call; one tool call; a whole agent run
+STAGE_SECONDS = registry.histogram(
+    "aws_docs_stage_duration_seconds", "Duration of pipeline stages in seconds.", ("stage",)
+)
+STAGE_ERRORS = registry.counter(
+    "aws_docs_stage_errors_total", "Pipeline stage failures.", ("stage",)
+)
+STAGE_ITEMS = registry.counter(
+    "aws_docs_stage_items_total", "Items processed per stage (pages, texts embedded, points upserted, passages retrieved).", ("stage",)
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Records a stage duration in STAGE_SECONDS and in the current request's breakdown."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    record_stage(stage, seconds)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Times a stage with `observe_stage`, counting it in STAGE_ERRORS if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+# Delay between when the event loop should have woken a sleeping task and when it did. Sustained
+# lag means blocking work on the loop: every stream and request on this worker is held up by it.
+EVENT_LOOP_LAG = registry.histogram(
+    "aws_docs_event_loop_lag_seconds", "Event loop scheduling delay in seconds, sampled periodically.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+async def monitor_event_loop_lag(interval: float):
+    """Samples EVENT_LOOP_LAG every `interval` seconds until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
@@ -0,0 +1,111 @@
+import time
+import threading
+from contextvars import ContextVar
+
+# Per-request stage breakdown. The middleware starts one per HTTP request; stages recorded through
+# `api.core.metrics` add to it. Worker threads started with asyncio.to_thread and Strands' own
+# event loop copy the context, so their stages count towards the request that started them.
+
+# Metrics stage -> breakdown key
+STAGE_KEYS = {
+    "embedding": "embed_ms",
+    "search": "search_ms",
+    "retrieval": "retrieval_ms",
+    "prompt_build": "prompt_ms",
+    "llm_first_token": "ttft_ms",
+    "llm_generation": "gen_ms",
+    "agent_model": "model_ms",
+    "agent_tool": "tool_ms",
+    "queue_wait": "queue_ms",
+}
+
+
+class RequestTimings:
+    """Durations (`*_ms`, summed over repeats) and counts (prompt tokens, tool calls) for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def add(self, key: str, value: float):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = dict(self._values)
+        return {k: round(v, 1) if isinstance(v, float) else v for k, v in values.items()}
+
+
+_current: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def start_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current_timings() -> dict:
+    """The breakdown recorded so far for the current request ({} outside a request)."""
+    timings = _current.get()
+    return timings.snapshot() if timings else {}
+
+
+def record_stage(stage: str, seconds: float):
+    timings = _current.get()
+    key = STAGE_KEYS.get(stage)
+    if timings is not None and key:
+        timings.add(key, seconds * 1000)
+
+
+def record_count(key: str, value: int = 1):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(key, value)
+
+
+def format_server_timing(breakdown: dict, total_ms: float) -> str:
+    """`Server-Timing` header value: durations as `dur`, counts as `desc`, plus the total."""
+    entries = []
+    for key, value in breakdown.items():
+        if key.endswith("_ms"):
+            entries.append(f"{key[:-3]};dur={value}")
+        else:
+            entries.append(f'{key};desc="{value}"')
+    entries.append(f"total;dur={round(total_ms, 1)}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that collects each request's stage breakdown and sends it as a
+    `Server-Timing` header. Streaming responses send their headers before any work is done,
+    so they get no header; their final `stats` event carries the breakdown instead.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = start_request()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                streaming = any(
+                    name.lower() == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in headers
+                )
+                if not streaming:
+                    total_ms = (time.perf_counter() - timings.started) * 1000
+                    headers.append((b"server-timing", format_server_timing(timings.snapshot(), total_ms).encode("latin-1")))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
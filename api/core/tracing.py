@@ -0,0 +1,225 @@
+import base64
+import functools
+import threading
+from collections import OrderedDict
+from api.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+_langfuse_observe = None
+_lock = threading.Lock()
+# The active TailSamplingExporter, if tail sampling is configured (for its keep/drop counts)
+tail_sampler = None
+
+# Span attributes treated as payloads by TRACE_PAYLOADS=none (Langfuse observation input/output,
+# GenAI prompt/completion/message attributes from Strands)
+PAYLOAD_ATTRIBUTE_MARKERS = ("input", "output", "prompt", "completion", "message", "system_instructions")
+
+
+def _truncate(value: str, limit: int) -> str:
+    if len(value) <= limit:
+        return value
+    return value[:limit] + f"... [truncated {len(value) - limit} chars]"
+
+
+def _mask_otel_spans(*, params):
+    """Export-time payload policy for TRACE_PAYLOADS=truncated|none; applies to every span, Strands' included."""
+    from langfuse.types import MaskOtelSpansResult, OtelSpanPatch
+
+    limit = settings.TRACE_PAYLOAD_MAX_CHARS
+    patches = {}
+    for identifier, span in params.spans.items():
+        if settings.TRACE_PAYLOADS == "none":
+            dropped = tuple(
+                key for key, value in span.attributes.items()
+                if isinstance(value, str) and any(marker in key for marker in PAYLOAD_ATTRIBUTE_MARKERS)
+            )
+            if dropped:
+                patches[identifier] = OtelSpanPatch(delete_attributes=dropped)
+        else:
+            truncated = {
+                key: _truncate(value, limit) for key, value in span.attributes.items()
+                if isinstance(value, str) and len(value) > limit
+            }
+            if truncated:
+                patches[identifier] = OtelSpanPatch(set_attributes=truncated)
+    return MaskOtelSpansResult(span_patches=patches)
+
+
+class TailSamplingExporter:
+    """
+    Span exporter that decides per trace once its root span has ended: a trace is exported if
+    it is head-sampled (a deterministic OTEL_TRACE_SAMPLING_RATIO fraction of trace IDs), slower
+    than TRACE_KEEP_SLOW_MS, or contains an error. Spans wait in a buffer bounded by
+    TRACE_BUFFER_MAX_SPANS; traces pushed out of it only keep their head-sampling decision.
+    """
+
+    def __init__(self, exporter, ratio: float, slow_ms: float, keep_errors: bool, max_spans: int):
+        self.exporter = exporter
+        self.slow_ms = slow_ms
+        self.keep_errors = keep_errors
+        self.max_spans = max_spans
+        # Same bound as OpenTelemetry's TraceIdRatioBased sampler, so decisions match it
+        self._bound = round(ratio * (2 ** 64))
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # trace ID -> {"spans", "error"}
+        self._buffered = 0
+        self.decisions = {"sampled": 0, "error": 0, "slow": 0, "dropped": 0}
+
+    def _sampled(self, trace_id: int) -> bool:
+        return (trace_id & 0xFFFFFFFFFFFFFFFF) < self._bound
+
+    @staticmethod
+    def _is_error(span) -> bool:
+        from opentelemetry.trace import StatusCode
+        return span.status.status_code == StatusCode.ERROR or span.attributes.get("langfuse.observation.level") == "ERROR"
+
+    def _decide(self, trace_id: int, root=None, error: bool = False) -> bool:
+        if self._sampled(trace_id):
+            reason = "sampled"
+        elif root is not None and self.keep_errors and error:
+            reason = "error"
+        elif root is not None and self.slow_ms and (root.end_time - root.start_time) / 1e6 >= self.slow_ms:
+            reason = "slow"
+        else:
+            reason = "dropped"
+        self.decisions[reason] += 1
+        return reason != "dropped"
+
+    def export(self, spans):
+        from opentelemetry.sdk.trace.export import SpanExportResult
+
+        ready = []
+        with self._lock:
+            for span in spans:
+                trace_id = span.context.trace_id
+                entry = self._pending.setdefault(trace_id, {"spans": [], "error": False})
+                entry["spans"].append(span)
+                entry["error"] = entry["error"] or self._is_error(span)
+                self._buffered += 1
+                # The local root ends last, so the whole trace is known once it arrives
+                if span.parent is None or span.parent.is_remote:
+                    del self._pending[trace_id]
+                    self._buffered -= len(entry["spans"])
+                    if self._decide(trace_id, span, entry["error"]):
+                        ready.extend(entry["spans"])
+            while self._buffered > self.max_spans and self._pending:
+                trace_id, entry = self._pending.popitem(last=False)
+                self._buffered -= len(entry["spans"])
+                if self._decide(trace_id):
+                    ready.extend(entry["spans"])
+        if not ready:
+            return SpanExportResult.SUCCESS
+        return self.exporter.export(ready)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"decisions": dict(self.decisions), "pending_traces": len(self._pending), "buffered_spans": self._buffered}
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.exporter.force_flush(timeout_millis)
+
+    def shutdown(self):
+        self.exporter.shutdown()
+
+
+def _create_otlp_exporter():
+    # Same endpoint and headers the Langfuse SDK uses for its own exporter
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+    credentials = base64.b64encode(f"{settings.LANGFUSE_PUBLIC_KEY}:{settings.LANGFUSE_SECRET_KEY}".encode()).decode("ascii")
+    return OTLPSpanExporter(
+        endpoint=f"{settings.OTEL_EXPORTER_OTLP_ENDPOINT}/v1/traces",
+        headers={
+            "Authorization": f"Basic {credentials}",
+            "x-langfuse-sdk-name": "python",
+            "x-langfuse-public-key": settings.LANGFUSE_PUBLIC_KEY,
+            "x-langfuse-ingestion-version": "4",
+        },
+    )
+
+
+def _configure_langfuse():
+    """
+    Creates the process-wide Langfuse client with this app's sampling and payload settings.
+    Below a sampling ratio of 1, traces are recorded and decided at export by TailSamplingExporter
+    when slow or failed traces are kept; otherwise unsampled traces are not recorded at all.
+    """
+    global tail_sampler
+    if not (settings.LANGFUSE_PUBLIC_KEY and settings.LANGFUSE_SECRET_KEY):
+        # Langfuse falls back to a disabled client on its own
+        return
+    from langfuse import Langfuse
+
+    ratio = min(max(settings.OTEL_TRACE_SAMPLING_RATIO, 0.0), 1.0)
+    options = {}
+    if ratio < 1:
+        if settings.TRACE_KEEP_ERRORS or settings.TRACE_KEEP_SLOW_MS > 0:
+            options["span_exporter"] = tail_sampler = TailSamplingExporter(
+                _create_otlp_exporter(),
+                ratio=ratio,
+                slow_ms=settings.TRACE_KEEP_SLOW_MS,
+                keep_errors=settings.TRACE_KEEP_ERRORS,
+                max_spans=settings.TRACE_BUFFER_MAX_SPANS,
+            )
+        else:
+            options["sample_rate"] = ratio
+    if settings.TRACE_PAYLOADS in ("truncated", "none"):
+        options["mask_otel_spans"] = _mask_otel_spans
+    Langfuse(
+        public_key=settings.LANGFUSE_PUBLIC_KEY,
+        secret_key=settings.LANGFUSE_SECRET_KEY,
+        host=settings.LANGFUSE_HOST,
+        **options,
+    )
+    logger.info(
+        f"Tracing: sampling ratio {ratio}, keep slow >= {settings.TRACE_KEEP_SLOW_MS} ms, "
+        f"keep errors {settings.TRACE_KEEP_ERRORS}, payloads {settings.TRACE_PAYLOADS}"
+    )
+
+
+def _get_langfuse_observe():
+    global _langfuse_observe
+    if _langfuse_observe is None:
+        with _lock:
+            if _langfuse_observe is None:
+                _configure_langfuse()
+                from langfuse import observe as langfuse_observe
+                _langfuse_observe = langfuse_observe
+    return _langfuse_observe
+
+
+def observe(**kwargs):
+    """
+    Same as `langfuse.observe`, but langfuse (slow to import) is only loaded the first time
+    a decorated function is called, not when the module defining it is imported.
+    With TRACE_PAYLOADS=none, arguments and return values are not captured at all.
+    """
+    if settings.TRACE_PAYLOADS == "none":
+        kwargs.setdefault("capture_input", False)
+        kwargs.setdefault("capture_output", False)
+
+    def decorator(func):
+        traced = None
+
+        @functools.wraps(func)
+        def wrapper(*args, **call_kwargs):
+            nonlocal traced
+            if traced is None:
+                traced = _get_langfuse_observe()(**kwargs)(func)
+            return traced(*args, **call_kwargs)
+        return wrapper
+    return decorator
+
+
+def mark_error(error):
+    """Marks the current span as failed, for errors that are handled instead of raised (kept by tail sampling)."""
+    from opentelemetry import trace
+    from opentelemetry.trace import Status, StatusCode
+
+    span = trace.get_current_span()
+    if span.is_recording():
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+        if isinstance(error, BaseException):
+            span.record_exception(error)
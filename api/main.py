@@ -1,15 +1,27 @@
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
-from api.models import ScrapeRequest, AskRequest, AgentRequest
-from api.models import ScrapeRequest, AskRequest, AgentRequest
-from api.services.scraper import scrape_aws_docs
-from api.services.vector_db import build_service_index, list_available_services, delete_service_index
-from api.services.aws_metadata import get_available_services
-from api.services.rag import answer_question, answer_question_stream
-from api.services.agent import run_agent, run_agent_stream
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from api.core.config import settings
+from api.core.metrics import registry as metrics_registry, monitor_event_loop_lag
+from api.core.timing import ServerTimingMiddleware, current_timings
+from api.core import tracing
+from api.models import ScrapeRequest, AskRequest, AgentRequest, SearchRequest
+from api.services.vector_db import list_available_services, delete_service_index, embedding_limiter, embedding_flight, qdrant_limiter
+from api.services.llm import llm_limiter
+from api.services.admission import AdmissionLimiter, AdmissionMiddleware, Overloaded, find_overloaded, overloaded_response_parts
+from api.services.rag import answer_question, subscribe_answer_stream, retrieve_service_docs, retrieval_flight, answer_flight
+from api.services.cache import answer_cache, retrieval_cache, catalog_cache, embedding_cache
+from api.services.sessions import session_store
+from api.services.warmup import warmup
+from api.services.cancellation import CancelScope
+from api.services.jobs import job_manager
+from typing import Optional
 
 import logging
 import json
+import asyncio
+import anyio.to_thread
 
 # Configure logging
 logging.basicConfig(
@@ -18,7 +30,120 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="AWS Doc Agent", version="0.3.0")
+# Endpoint admission: a full queue is the client's cue to back off (429); a wait that runs out
+# means this worker is saturated (503). Both carry Retry-After.
+ask_limiter = AdmissionLimiter(
+    "ask", limit=settings.ASK_MAX_CONCURRENCY, max_queue=settings.ADMISSION_MAX_QUEUE,
+    max_wait=settings.ADMISSION_MAX_WAIT_SECONDS, queue_full_status=429,
+)
+agent_limiter = AdmissionLimiter(
+    "agent", limit=settings.AGENT_MAX_CONCURRENCY, max_queue=settings.ADMISSION_MAX_QUEUE,
+    max_wait=settings.ADMISSION_MAX_WAIT_SECONDS, queue_full_status=429,
+)
+_limiters = {"ask": ask_limiter, "agent": agent_limiter, "llm": llm_limiter, "qdrant": qdrant_limiter}
+
+# Metrics for state the services already track; read at scrape time, so they cost nothing per request
+_caches = {"answer": answer_cache, "retrieval": retrieval_cache, "catalog": catalog_cache, "embedding": embedding_cache}
+_flights = {"answers": answer_flight, "retrieval": retrieval_flight, "embedding": embedding_flight}
+
+def _collect_cache_lookups():
+    values = {}
+    for name, cache in _caches.items():
+        stats = cache.stats()
+        values[(name, "hit")] = stats["hits"]
+        values[(name, "miss")] = stats["misses"]
+    return values
+
+def _collect_single_flight_calls():
+    values = {}
+    for name, flight in _flights.items():
+        stats = flight.stats()
+        values[(name, "executed")] = stats["executed"]
+        values[(name, "coalesced")] = stats["coalesced"]
+    return values
+
+metrics_registry.callback(
+    "aws_docs_cache_lookups_total", "Cache lookups by cache and result (hit/miss).", "counter", ("cache", "result"),
+    _collect_cache_lookups,
+)
+metrics_registry.callback(
+    "aws_docs_cache_entries", "Entries currently held per cache.", "gauge", ("cache",),
+    lambda: {(name,): cache.stats()["entries"] for name, cache in _caches.items()},
+)
+metrics_registry.callback(
+    "aws_docs_single_flight_calls_total", "Single-flight calls executed vs. coalesced onto an in-flight call.", "counter", ("flight", "result"),
+    _collect_single_flight_calls,
+)
+metrics_registry.callback(
+    "aws_docs_single_flight_in_flight", "Single-flight calls currently running.", "gauge", ("flight",),
+    lambda: {(name,): flight.stats()["in_flight"] for name, flight in _flights.items()},
+)
+metrics_registry.callback(
+    "aws_docs_embedding_queue_depth", "Embedding calls waiting for the rate limiter (backlog) or running (in_flight).", "gauge", ("state",),
+    lambda: {(state,): embedding_limiter.stats()[state] for state in ("backlog", "in_flight")},
+)
+metrics_registry.callback(
+    "aws_docs_embedding_throttled_total", "Embedding calls throttled by the API (429/5xx).", "counter", (),
+    lambda: {(): embedding_limiter.stats()["throttled"]},
+)
+metrics_registry.callback(
+    "aws_docs_admission_active", "Requests holding an admission slot, per limiter.", "gauge", ("limiter",),
+    lambda: {(name,): limiter.stats()["active"] for name, limiter in _limiters.items()},
+)
+metrics_registry.callback(
+    "aws_docs_admission_queued", "Requests waiting for an admission slot, per limiter.", "gauge", ("limiter",),
+    lambda: {(name,): limiter.stats()["queued"] for name, limiter in _limiters.items()},
+)
+metrics_registry.callback(
+    "aws_docs_traces_total", "Traces by tail-sampling decision (sampled, error, slow, dropped); empty unless tail sampling is on.", "counter", ("decision",),
+    lambda: {(decision,): count for decision, count in tracing.tail_sampler.stats()["decisions"].items()} if tracing.tail_sampler else {},
+)
+metrics_registry.callback(
+    "aws_docs_jobs", "Active scrape jobs owned by this worker, by status; queued and scraped jobs are waiting for a worker thread.", "gauge", ("status",),
+    lambda: {(status,): count for status, count in job_manager.status_counts().items()},
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Heavy modules and clients are loaded lazily; warm them up in the background so the
+    # server starts accepting requests (and answering /ready) right away
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=settings.API_WORKER_THREADS, thread_name_prefix="api-worker"))
+    # Sync `def` endpoints run on anyio's thread limiter (40 by default), not on the executor above
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.API_WORKER_THREADS
+    warmup_task = asyncio.create_task(warmup.run())
+    lag_task = None
+    if settings.EVENT_LOOP_LAG_INTERVAL_MS > 0:
+        lag_task = asyncio.create_task(monitor_event_loop_lag(settings.EVENT_LOOP_LAG_INTERVAL_MS / 1000))
+    yield
+    warmup_task.cancel()
+    if lag_task:
+        lag_task.cancel()
+
+app = FastAPI(title="AWS Doc Agent", version="0.3.0", lifespan=lifespan)
+# Concurrency limits for the LLM-bound endpoints, held for the whole response (streams included)
+app.add_middleware(AdmissionMiddleware, limiters={("POST", "/ask"): ask_limiter, ("POST", "/agent"): agent_limiter})
+# Per-request stage breakdown (embed, search, prompt tokens, ttft, gen, tool calls) as a Server-Timing header
+app.add_middleware(ServerTimingMiddleware)
+
+@app.exception_handler(Overloaded)
+async def handle_overloaded(request, error: Overloaded):
+    # An upstream limiter (LLM, Qdrant, embeddings) turned the request away
+    status, headers, body = overloaded_response_parts(error)
+    return JSONResponse(body, status_code=status, headers=headers)
+
+@app.exception_handler(Exception)
+async def handle_unexpected_error(request, error: Exception):
+    # Libraries may wrap an Overloaded (Strands raises EventLoopException after the first agent turn)
+    overloaded = find_overloaded(error)
+    if overloaded is not None:
+        return await handle_overloaded(request, overloaded)
+    return PlainTextResponse("Internal Server Error", status_code=500)
+
+@app.get("/ready")
+def get_readiness():
+    """503 until warm-up (module preload, Qdrant, Gemini connections) has completed."""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 @app.get("/services")
 def get_services():
@@ -28,6 +153,7 @@ def get_services():
 @app.get("/services/available")
 def get_available_scrape_services():
     logger.info("Request received: GET /services/available")
+    from api.services.aws_metadata import get_available_services
     return {"services": get_available_services()}
 
 @app.delete("/services/{service_name}")
@@ -35,60 +161,191 @@ def delete_service(service_name: str):
     logger.info(f"Request received: DELETE /services/{service_name}")
     return delete_service_index(service_name)
 
-def scrape_and_index_pipeline(services, limit, max_jobs):
-    # Iterate through scraper events
-    for event_str in scrape_aws_docs(services, limit=limit, max_jobs=max_jobs):
-        yield event_str + "\n"
-        
-        # Check if this event was a successful scrape result
-        try:
-            event = json.loads(event_str)
-            if event.get("type") == "result" and event.get("status") == "success":
-                service = event.get("service")
-                yield json.dumps({"type": "log", "message": f"Indexing {service}..."}) + "\n"
-                
-                # Build Index
-                try:
-                    stats = build_service_index(service)
-                    yield json.dumps({
-                        "type": "index_result",
-                        "service": service,
-                        "stats": stats
-                    }) + "\n"
-                    yield json.dumps({"type": "log", "message": f"Indexing complete for {service}."}) + "\n"
-                except Exception as e:
-                    logger.error(f"Indexing failed for {service}: {e}")
-                    yield json.dumps({"type": "error", "message": f"Indexing failed: {e}"}) + "\n"
-                    
-        except Exception:
-            pass
+@app.get("/cache/stats")
+def get_cache_stats():
+    # Hit counts are per worker; entries are shared between workers unless CACHE_BACKEND is "memory"
+    return {
+        "backend": settings.CACHE_BACKEND,
+        "answer_cache": answer_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "single_flight": {
+            "answers": answer_flight.stats(),
+            "retrieval": retrieval_flight.stats(),
+            "embedding": embedding_flight.stats(),
+        },
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Process metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/limits")
+def get_limiter_stats():
+    """Admission limiters (active, queued, admitted, rejected) and the embedding rate limiter."""
+    return dict({name: limiter.stats() for name, limiter in _limiters.items()}, embedding=embedding_limiter.stats())
+
+@app.get("/limits/embedding")
+def get_embedding_limiter_stats():
+    return embedding_limiter.stats()
+
+async def cancel_on_disconnect(events, scope: CancelScope):
+    # Starlette cancels the response when the client disconnects; pass that on to work
+    # that only watches `scope` (worker threads, Strands checkpoints)
+    completed = False
+    try:
+        async for event in events:
+            yield event
+        completed = True
+    finally:
+        if not completed:
+            scope.cancel("client disconnected")
+        scope.close()
+
+def format_ndjson(event: dict) -> str:
+    return json.dumps(event) + "\n"
 
 @app.post("/scrape")
 async def scrape_service(request: ScrapeRequest):
-    logger.info(f"Request received: POST /scrape - Services: {request.services}")
-    
+    """
+    Queues one background scrape-and-index job per service; a service that already has a job
+    in progress joins it. With `stream`, follows the jobs' events (NDJSON) until they finish;
+    disconnecting stops the stream, not the jobs.
+    """
+    logger.info(f"Request received: POST /scrape - Services: {request.services}, Stream: {request.stream}")
+
+    jobs = []
+    for service in request.services:
+        # Submitting takes the registry's file locks and may wait for them, so it runs in a worker thread
+        job, joined = await asyncio.to_thread(job_manager.submit, service, limit=request.limit, max_jobs=request.max_jobs)
+        jobs.append(dict(job, joined=joined))
+
+    if not request.stream:
+        return {"jobs": jobs}
+
+    async def job_events():
+        for job in jobs:
+            message = f"Joined running job {job['id']} for {job['service']}." if job["joined"] else f"Queued job {job['id']} for {job['service']}."
+            yield format_ndjson({"type": "log", "job_id": job["id"], "message": message})
+        async for event in job_manager.follow([job["id"] for job in jobs]):
+            yield format_ndjson(event)
+
     return StreamingResponse(
-        scrape_and_index_pipeline(request.services, request.limit, request.max_jobs),
-        media_type="text/event-stream"
+        job_events(),
+        media_type="text/event-stream",
+        headers={"X-Job-Ids": ",".join(job["id"] for job in jobs)}
     )
 
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None):
+    return {"jobs": job_manager.list_jobs(status)}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, since: Optional[int] = None):
+    """Job status and progress; with `since`, also the events from that index (for polling)."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if since is not None:
+        events, next_index, _ = job_manager.events(job_id, since)
+        job.update(events=events, next_index=next_index)
+    return job
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, since: int = 0):
+    """Reattaches to a job's event stream (NDJSON), replaying events from index `since`."""
+    if await asyncio.to_thread(job_manager.get, job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def job_events():
+        async for event in job_manager.follow([job_id], since=since):
+            yield format_ndjson(event)
+
+    return StreamingResponse(job_events(), media_type="text/event-stream")
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    logger.info(f"Request received: DELETE /jobs/{job_id}")
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+def format_sse(event: dict) -> str:
+    # One Server-Sent Event per answer event: `event: <type>` plus the JSON-encoded content
+    return f"event: {event['type']}\ndata: {json.dumps(event['content'])}\n\n"
+
+async def stream_ask_events(answer_events, session=None, question=None):
+    # Frame answer events as SSE and, with a session, store the completed turn
+    answer_parts = []
+    failed = False
+    async for event in answer_events:
+        if event["type"] == "token":
+            answer_parts.append(event["content"])
+        elif event["type"] == "error":
+            failed = True
+        yield format_sse(event)
+    if session is not None and answer_parts and not failed:
+        session_store.append_turn(session, question, "".join(answer_parts))
+
 @app.post("/ask")
 async def ask_question(request: AskRequest):
-    logger.info(f"Request received: POST /ask - Service: {request.service_name}, Stream: {request.stream}")
+    logger.info(f"Request received: POST /ask - Service: {request.service_name}, Stream: {request.stream}, Session: {request.session_id}")
+
+    # Sessions are opt-in (a session_id or new_session); other requests are stateless and
+    # may send their own history
+    if request.session_id is None and not request.new_session:
+        if request.stream:
+            return StreamingResponse(
+                stream_ask_events(subscribe_answer_stream(request.service_name, request.question, request.history)),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        return {"answer": await asyncio.to_thread(answer_question, request.service_name, request.question, request.history)}
+
+    session = session_store.get_or_create(request.session_id, kind="ask", service_name=request.service_name)
     if request.stream:
-        # answer_question_stream is an async generator, so we can pass it directly
+        # Identical concurrent questions share one generation (single-flight)
         return StreamingResponse(
-            answer_question_stream(request.service_name, request.question, request.history),
-            media_type="text/event-stream"
+            stream_ask_events(subscribe_answer_stream(request.service_name, request.question, session["history"]), session, request.question),
+            media_type="text/event-stream",
+            # Disable proxy buffering so the early `sources` event reaches the client right away
+            headers={"X-Session-Id": session["id"], "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
         )
-    return {"answer": answer_question(request.service_name, request.question, request.history)}
+    # The blocking generation runs in a worker thread, so it does not stall the event loop
+    answer = await asyncio.to_thread(answer_question, request.service_name, request.question, session["history"])
+    session_store.append_turn(session, request.question, answer)
+    return {"answer": answer, "session_id": session["id"]}
+
+@app.post("/search")
+def search_docs(request: SearchRequest):
+    """Retrieval only: the passages `/ask` would use, without generating an answer."""
+    logger.info(f"Request received: POST /search - Service: {request.service_name}")
+    docs = retrieve_service_docs(request.service_name, request.query, path_filters=request.path_filters, k=request.k)
+    return {"results": docs, "timings": current_timings()}
 
 @app.post("/agent")
 async def run_agent_endpoint(request: AgentRequest):
-    logger.info(f"Request received: POST /agent - Stream: {request.stream}")
+    logger.info(f"Request received: POST /agent - Stream: {request.stream}, Session: {request.session_id}")
+    # Imported here: strands is only loaded for the agent (or by the background warm-up)
+    from api.services.agent import run_agent, run_agent_stream
+    # Sessions are opt-in, as for /ask
+    session = None
+    if request.session_id is not None or request.new_session:
+        session = session_store.get_or_create(request.session_id, kind="agent")
     if request.stream:
+        scope = CancelScope("agent run", timeout=settings.AGENT_TIMEOUT_SECONDS)
         return StreamingResponse(
-            run_agent_stream(request.query),
-            media_type="text/event-stream"
+            cancel_on_disconnect(run_agent_stream(request.query, session, scope), scope),
+            media_type="text/event-stream",
+            headers={"X-Session-Id": session["id"]} if session else None
         )
-    return {"response": run_agent(request.query)}
+    response = await asyncio.to_thread(run_agent, request.query, session)
+    return {"response": response, "session_id": session["id"]} if session else {"response": response}
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    logger.info(f"Request received: DELETE /sessions/{session_id}")
+    return {"session_id": session_id, "deleted": session_store.delete(session_id)}
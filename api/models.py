@@ -5,13 +5,30 @@ class ScrapeRequest(BaseModel):
     services: List[str]
     limit: Optional[int] = None
     max_jobs: int = 4
+    # Follow the background jobs' progress in the response; False returns the job IDs at once
+    stream: bool = True
 
 class AskRequest(BaseModel):
     question: str
     service_name: str
     stream: bool = False
+    # Server-side conversation; takes precedence over `history` when given
+    session_id: Optional[str] = None
+    # Starts a server-side conversation; without this or a session_id, nothing is stored
+    new_session: bool = False
+    # Deprecated: full client-side history, used only when no session_id is sent
     history: Optional[List[dict]] = None
 
 class AgentRequest(BaseModel):
     query: str
     stream: bool = False
+    session_id: Optional[str] = None
+    # Starts a server-side conversation; without this or a session_id, nothing is stored
+    new_session: bool = False
+
+class SearchRequest(BaseModel):
+    query: str
+    service_name: str
+    k: int = 5
+    # Restrict results to these topic paths and their subtopics (e.g. "Amazon S3 > Features")
+    path_filters: Optional[List[str]] = None
@@ -0,0 +1,255 @@
+import json
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from api.core.metrics import registry
+from api.core.timing import record_stage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Admission control: concurrency limits with a bounded wait queue, per endpoint (/ask, /agent)
+# and per upstream (LLM, Qdrant; the embedding API has its own adaptive limiter). Under overload,
+# requests beyond the queue are turned away at once with a Retry-After hint instead of all
+# slowing down together until they time out.
+
+ADMISSION_WAIT = registry.histogram(
+    "aws_docs_admission_wait_seconds", "Time spent queued for an admission slot, per limiter (admitted and rejected).", ("limiter",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+ADMISSION_REJECTED = registry.counter(
+    "aws_docs_admission_rejected_total", "Requests turned away by admission control, per limiter and reason (queue_full, wait_timeout).", ("limiter", "reason"),
+)
+
+
+class Overloaded(Exception):
+    """Raised when a limiter turns work away; the API answers with `status_code` and a Retry-After header."""
+
+    def __init__(self, limiter: str, reason: str, retry_after: int, status_code: int = 503):
+        super().__init__(f"{limiter} is overloaded ({reason.replace('_', ' ')}); retry in {retry_after}s")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def find_overloaded(error: BaseException):
+    """
+    The Overloaded behind `error`, or None. Looks through wrapping exceptions, such as the
+    EventLoopException Strands raises for a model error after the first turn.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, Overloaded):
+            return error
+        seen.add(id(error))
+        error = getattr(error, "original_exception", None) or error.__cause__
+    return None
+
+
+def record_wait(limiter: str, seconds: float):
+    """Records queue time in ADMISSION_WAIT and in the current request's breakdown (`queue_ms`)."""
+    ADMISSION_WAIT.observe(seconds, limiter=limiter)
+    record_stage("queue_wait", seconds)
+
+
+class _Waiter:
+    __slots__ = ("granted", "wake")
+
+    def __init__(self, wake):
+        self.granted = False
+        self.wake = wake
+
+
+class AdmissionLimiter:
+    """
+    At most `limit` holders at once; up to `max_queue` more wait in FIFO order for at most
+    `max_wait` seconds (0: no time limit). Anything beyond that raises Overloaded right away.
+    Works from the event loop (`async with limiter.slot_async()`) and from worker threads
+    (`with limiter.slot()`); a released slot is handed straight to the next waiter.
+    `limit` 0 disables the limiter.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float, queue_full_status: int = 503, timeout_status: int = 503):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.queue_full_status = queue_full_status
+        self.timeout_status = timeout_status
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = deque()
+        # Average time a slot is held (moving average), for the Retry-After estimate
+        self._hold_seconds = 1.0
+        self._admitted = 0
+        self._rejected = 0
+
+    def _retry_after(self) -> int:
+        # Time for the current queue to drain, at the observed hold time
+        drain = self._hold_seconds * (len(self._queue) + 1) / max(self.limit, 1)
+        return min(60, max(1, math.ceil(drain)))
+
+    def _reject(self, reason: str, waited: float) -> Overloaded:
+        self._rejected += 1
+        error = Overloaded(self.name, reason, self._retry_after(), self.queue_full_status if reason == "queue_full" else self.timeout_status)
+        ADMISSION_REJECTED.inc(limiter=self.name, reason=reason)
+        record_wait(self.name, waited)
+        logger.debug(f"Admission: {error}")
+        return error
+
+    def _enter(self, waiter: _Waiter) -> bool:
+        """Takes a free slot (True) or queues `waiter` (False); raises Overloaded if the queue is full."""
+        with self._lock:
+            if self._active < self.limit and not self._queue:
+                self._active += 1
+                self._admitted += 1
+                return True
+            if len(self._queue) >= self.max_queue:
+                raise self._reject("queue_full", 0.0)
+            self._queue.append(waiter)
+            return False
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Removes a waiter that stopped waiting; False if it was granted a slot meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queue.remove(waiter)
+            return True
+
+    def release(self, held_seconds: float = None):
+        with self._lock:
+            if held_seconds is not None:
+                self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held_seconds
+            if not self._queue:
+                self._active -= 1
+                return
+            waiter = self._queue.popleft()
+            waiter.granted = True
+            self._admitted += 1
+        waiter.wake()
+
+    def acquire(self):
+        """Blocks the calling thread until a slot is free; raises Overloaded instead of waiting too long."""
+        if self.limit <= 0:
+            return
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        if self._enter(waiter):
+            record_wait(self.name, 0.0)
+            return
+        start = time.perf_counter()
+        event.wait(self.max_wait or None)
+        waited = time.perf_counter() - start
+        if not waiter.granted and self._give_up(waiter):
+            with self._lock:
+                raise self._reject("wait_timeout", waited)
+        record_wait(self.name, waited)
+
+    async def acquire_async(self):
+        """Same as `acquire`, waiting on the event loop instead of blocking a thread."""
+        if self.limit <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(wake)
+        if self._enter(waiter):
+            record_wait(self.name, 0.0)
+            return
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait or None)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # Cancelled while queued: leave the queue, or pass on a slot granted in the meantime
+            if not self._give_up(waiter):
+                self.release()
+            raise
+        waited = time.perf_counter() - start
+        if not waiter.granted and self._give_up(waiter):
+            with self._lock:
+                raise self._reject("wait_timeout", waited)
+        record_wait(self.name, waited)
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.limit > 0:
+                self.release(time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def slot_async(self):
+        await self.acquire_async()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.limit > 0:
+                self.release(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "avg_hold_seconds": round(self._hold_seconds, 3),
+            }
+
+
+def overloaded_response_parts(error: Overloaded) -> tuple[int, dict, dict]:
+    """(status, headers, body) of the response for a rejected request."""
+    body = {"detail": str(error), "limiter": error.limiter, "reason": error.reason, "retry_after": error.retry_after}
+    return error.status_code, {"Retry-After": str(error.retry_after)}, body
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that runs each request to a limited route under its AdmissionLimiter,
+    for the whole response (streams included), or rejects it with 429/503 and Retry-After.
+    `limiters` maps (method, path) to a limiter.
+    """
+
+    def __init__(self, app, limiters: dict):
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiters.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if limiter is None or limiter.limit <= 0:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await limiter.acquire_async()
+        except Overloaded as error:
+            status, headers, body = overloaded_response_parts(error)
+            data = json.dumps(body).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]
+                           + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            })
+            await send({"type": "http.response.body", "body": data})
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - start)
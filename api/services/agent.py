@@ -1,174 +1,435 @@
 from strands import Agent, tool
-from strands.models.gemini import GeminiModel
+from strands.tools.executors import ConcurrentToolExecutor
+from strands.hooks import HookProvider, HookRegistry, BeforeToolCallEvent, AfterToolCallEvent, BeforeModelCallEvent, AfterModelCallEvent
 from api.core.config import settings
+from api.services.llm import get_gemini_model, AGENT_MODEL_PARAMS
 from api.services.rag import retrieve_service_docs
-from api.services.vector_db import list_service_headers
-from langfuse import observe
+from api.services.vector_db import list_service_headers, list_available_services as db_list_services
+from api.services.sessions import session_store
+from api.services.prompt import count_tokens, truncate_to_tokens
+from api.services.cancellation import CancelScope
+from api.services.admission import find_overloaded
+from api.core.tracing import observe
+from api.core.metrics import observe_stage
+from api.core.timing import record_count, current_timings
 
 import json
 import os
+import time
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Initialize the model
-gemini_model = None
-if settings.GOOGLE_API_KEY:
-    try:
-        gemini_model = GeminiModel(
-            client_args={
-                "api_key": settings.GOOGLE_API_KEY,
-            },
-            model_id=settings.GEMINI_AGENT_MODEL_ID,
-            params={
-                "temperature": 0.0,
-                "max_output_tokens": 8192,
-            }
-        )
-    except Exception as e:
-        print(f"Failed to initialize GeminiModel: {e}")
+# Tools are async so that the calls from one model turn run concurrently on the event loop;
+# blocking embedding and Qdrant work is moved to worker threads.
 
 @tool
-def list_available_services() -> list[str]:
+async def list_available_services() -> list[str]:
     """
     Lists the AWS services available in the knowledge base documentation.
     
     Returns:
-        List of service names to be used in `explore_service_topics` and `search_service_documentation`.
+        List of service names to be used in `browse_service_topics` and `search_service_documentation`.
     """
     if not settings.QDRANT_HOST:
          return []
          
-    from api.services.vector_db import list_available_services as db_list_services
-    return db_list_services()
+    return await asyncio.to_thread(db_list_services)
+
+TOPIC_SEPARATOR = " > "
+
+def _topic_children(headers: list[str], prefix: str = None) -> tuple[list[tuple[str, int]], bool]:
+    """
+    Groups header paths one level below `prefix`.
+    Returns ([(child_path, descendant_count)], prefix_is_topic).
+    """
+    prefix_parts = prefix.split(TOPIC_SEPARATOR) if prefix else []
+    depth = len(prefix_parts)
+    counts = {}
+    prefix_is_topic = False
+    for header in headers:
+        if not header:
+            continue
+        parts = header.split(TOPIC_SEPARATOR)
+        if parts[:depth] != prefix_parts:
+            continue
+        if len(parts) == depth:
+            prefix_is_topic = True
+            continue
+        child = TOPIC_SEPARATOR.join(parts[: depth + 1])
+        counts.setdefault(child, 0)
+        if len(parts) > depth + 1:
+            counts[child] += 1
+    return sorted(counts.items()), prefix_is_topic
 
 @tool
-def explore_service_topics(service_name: str) -> list[str]:
+async def browse_service_topics(service_name: str, prefix: str = None, offset: int = 0, limit: int = 50) -> str:
     """
-    Lists the topics available for a specific AWS service in the knowledge base documentation.
-    Use this to understand what information is available for a service before searching.
+    Browses the topic tree of a specific AWS service's documentation, one level at a time.
+    Start without a prefix to see the top-level topics, then drill down by passing a topic path as `prefix`.
     
     Args:
         service_name: The name of the AWS service (e.g., 'AmazonS3') from `list_available_services`.
+        prefix: Optional topic path to list the children of (e.g., 'Security > Data protection').
+        offset: Number of topics to skip, for paging through long lists.
+        limit: Maximum number of topics to return.
         
     Returns:
-        Unique list of topics from service documentation.
+        Topic paths directly under the prefix, with the number of subtopics below each.
+        The paths can be used as `context_filters` in `search_service_documentation`; a path covers its subtopics.
     """
-    return list_service_headers(service_name)
+    headers = await asyncio.to_thread(list_service_headers, service_name)
+    if not headers:
+        return f"No topics found for {service_name}."
+
+    children, prefix_is_topic = _topic_children(headers, prefix)
+    if not children:
+        return f"No subtopics under '{prefix}'." if prefix else f"No topics found for {service_name}."
+
+    offset = max(0, offset)
+    limit = max(1, min(limit, 200))
+    page = children[offset : offset + limit]
+    location = f"'{prefix}'" if prefix else "the top level"
+    lines = [f"Topics at {location} of {service_name} ({offset + 1}-{offset + len(page)} of {len(children)}):"]
+    if prefix_is_topic:
+        lines.append(f"('{prefix}' itself also has content.)")
+    for path, subtopics in page:
+        lines.append(f"- {path} [{subtopics} subtopics]" if subtopics else f"- {path}")
+    if offset + len(page) < len(children):
+        lines.append(f"More topics available: call again with offset={offset + len(page)}.")
+    return "\n".join(lines)
 
 @tool
-def search_service_documentation(service_name: str, query: str, context_filters: list[str] = None) -> str:
+async def search_service_documentation(service_name: str, query: str, context_filters: list[str] = None, offset: int = 0) -> str:
     """
     Searches the documentation for a specific AWS service.
+    Results are ranked by relevance and trimmed to a size budget; use `offset` to read further results.
     
     Args:
         service_name: The name of the AWS service (e.g., 'AmazonS3') from `list_available_services`.
         query: The search query.
-        context_filters: Optional list of context paths (from explore_service_topics) to filter the search.
+        context_filters: Optional list of topic paths (from browse_service_topics) to filter the search; each includes its subtopics.
+        offset: Number of top results to skip, to fetch results omitted from a previous call.
         
     Returns:
         Relevant documentation snippets with sources.
     """
-    docs = retrieve_service_docs(service_name, query, path_filters=context_filters)
+    offset = max(0, offset)
+    docs = await asyncio.to_thread(
+        retrieve_service_docs, service_name, query, path_filters=context_filters, k=offset + settings.AGENT_SEARCH_RESULTS
+    )
+    docs = sorted(docs, key=lambda d: d.get("score", 0), reverse=True)[offset:]
     if not docs:
         return "No relevant documentation found."
         
     result = ""
+    budget = settings.AGENT_TOOL_OUTPUT_TOKEN_BUDGET
+    shown = 0
     for i, doc in enumerate(docs):
-        result += f"--- Result {i+1} ---\n"
-        result += f"Source: {doc['url']}\n"
-        result += f"Context: {doc['context']}\n"
-        result += f"Content:\n{doc['content']}\n\n"
+        entry = f"--- Result {offset + i + 1} (score {doc.get('score', 0):.3f}) ---\n"
+        entry += f"Source: {doc['url']}\n"
+        entry += f"Context: {doc['context']}\n"
+        entry += f"Content:\n{doc['content']}\n\n"
+        tokens = count_tokens(entry)
+        if tokens > budget:
+            if shown == 0:
+                # Always return something: truncate the best result to the budget
+                result += truncate_to_tokens(entry, budget) + "\n\n"
+                shown = 1
+            break
+        result += entry
+        budget -= tokens
+        shown += 1
+
+    if shown < len(docs):
+        result += f"[{len(docs) - shown} lower-ranked results omitted to save space. Call again with offset={offset + shown} to read them.]\n"
         
     return result
 
-def create_agent():
-    """Creates and returns the Strands Agent instance."""
-    if not gemini_model:
-        raise ValueError("Gemini Model not initialized. Check API Key.")
-        
-    agent = Agent(
-        model=gemini_model,
-        tools=[list_available_services, explore_service_topics, search_service_documentation],
-        system_prompt="""You are an expert AWS Documentation Assistant.
+AGENT_SYSTEM_PROMPT = """You are an expert AWS Documentation Assistant.
 Your goal is to help users find information about AWS services by querying the local knowledge base.
 
 Follow this "work loop":
 1. Identify the service the user is asking about. If not clear, ask the user and repeat this step.
-2. Always explore available services and topics using `list_available_services` and `explore_service_topics` to understand the documentation structure and build a plan to answer the user's question.
+2. Always explore available services and topics using `list_available_services` and `browse_service_topics` to understand the documentation structure and build a plan to answer the user's question.
+   - `browse_service_topics` returns one level of the topic tree; drill down with `prefix` only into branches relevant to the question.
 3. Use `search_service_documentation` to find specific information about some service or topic from user question. 
    - Use `context_filters` if you have identified relevant topics from step 2 to make the search more precise.
+   - When you need several independent lookups (e.g. the same question for two services), request them all in the same turn; they run in parallel.
 4. Synthesize the information found to answer the user's question.
 5. Always cite the sources (URLs) provided in the search results.
 
 If you cannot find information on the knowledge base, suggest checking the official AWS website.
 """
+
+def _build_system_prompt() -> str:
+    """Appends the (cached) service catalog to the system prompt so the agent can skip discovery."""
+    if not settings.AGENT_INJECT_CATALOG:
+        return AGENT_SYSTEM_PROMPT
+    services = db_list_services()
+    if not services:
+        return AGENT_SYSTEM_PROMPT
+    return AGENT_SYSTEM_PROMPT + f"""
+Indexed services: {", ".join(services)}
+This list is current, so you do not need to call `list_available_services`.
+"""
+
+# Tool specs are built once when the decorated functions are defined; the list is reused by every agent
+AGENT_TOOLS = [list_available_services, browse_service_topics, search_service_documentation]
+
+class AgentRunBudget(HookProvider):
+    """
+    Per-run accounting and limits for one agent invocation.
+    After AGENT_MAX_TOOL_ITERATIONS model turns, further tool calls are refused with a message asking
+    the model to answer; if it keeps going, the run is cancelled.
+    """
+
+    def __init__(self, max_tool_iterations: int = None):
+        self.max_tool_iterations = max_tool_iterations or settings.AGENT_MAX_TOOL_ITERATIONS
+        self.stats = {
+            "model_calls": 0,
+            "tool_calls": 0,
+            "tool_calls_refused": 0,
+            "tool_output_tokens": 0,
+            "tool_time_ms": 0.0,
+            "stopped_early": False,
+        }
+        # toolUseId -> {"name", "duration_ms", "output_tokens"}, or {"name", "refused": True}
+        self.tool_runs = {}
+        self._started = time.perf_counter()
+        self._model_started = None
+
+    def register_hooks(self, registry: HookRegistry, **kwargs):
+        registry.add_callback(BeforeModelCallEvent, self._before_model)
+        registry.add_callback(AfterModelCallEvent, self._after_model)
+        registry.add_callback(BeforeToolCallEvent, self._before_tool)
+        registry.add_callback(AfterToolCallEvent, self._after_tool)
+
+    def _before_model(self, event: BeforeModelCallEvent):
+        # One more call after the tool budget runs out lets the model read the refusals and answer
+        if self.stats["model_calls"] > self.max_tool_iterations + 1:
+            logger.warning(f"Agent exceeded {self.max_tool_iterations} tool iterations; cancelling run.")
+            self.stats["stopped_early"] = True
+            event.agent.cancel()
+        self._model_started = time.perf_counter()
+
+    def _after_model(self, event: AfterModelCallEvent):
+        self.stats["model_calls"] += 1
+        if self._model_started is not None:
+            observe_stage("agent_model", time.perf_counter() - self._model_started)
+            self._model_started = None
+
+    def _before_tool(self, event: BeforeToolCallEvent):
+        if self.stats["model_calls"] > self.max_tool_iterations:
+            self.stats["tool_calls_refused"] += 1
+            self.tool_runs[event.tool_use.get("toolUseId")] = {"name": event.tool_use.get("name"), "refused": True}
+            event.cancel_tool = "Tool call limit reached for this request. Answer now using the information already gathered."
+
+    def _after_tool(self, event: AfterToolCallEvent):
+        if event.cancel_message:
+            return
+        output = "".join(c.get("text", "") for c in (event.result or {}).get("content", []) if isinstance(c, dict))
+        tokens = count_tokens(output)
+        duration_ms = (event.duration or 0) * 1000
+        self.stats["tool_calls"] += 1
+        self.stats["tool_output_tokens"] += tokens
+        self.stats["tool_time_ms"] += duration_ms
+        observe_stage("agent_tool", duration_ms / 1000)
+        self.tool_runs[event.tool_use.get("toolUseId")] = {
+            "name": event.tool_use.get("name"),
+            "duration_ms": duration_ms,
+            "output_tokens": tokens,
+        }
+
+    def finalize(self, result=None) -> dict:
+        """
+        Returns the run stats, including model token usage when the run produced a result
+        and the request's stage breakdown under `timings`.
+        """
+        stats = dict(self.stats, tool_time_ms=round(self.stats["tool_time_ms"], 1))
+        metrics = getattr(result, "metrics", None)
+        if metrics is not None:
+            usage = metrics.accumulated_usage
+            stats["input_tokens"] = usage.get("inputTokens", 0)
+            stats["output_tokens"] = usage.get("outputTokens", 0)
+            stats["cycles"] = metrics.cycle_count
+            record_count("prompt_tokens", stats["input_tokens"])
+        for key in ("model_calls", "tool_calls", "tool_calls_refused"):
+            record_count(key, stats[key])
+        stats["timings"] = current_timings()
+        observe_stage("agent_run", time.perf_counter() - self._started)
+        logger.info(f"Agent run stats: {stats}")
+        return stats
+
+def create_agent(streaming: bool = True, messages: list[dict] = None, budget: AgentRunBudget = None, system_prompt: str = None):
+    """
+    Creates and returns the Strands Agent instance.
+    Each request gets a fresh agent (isolated conversation state) over a shared, warmed model.
+    `messages` resumes a previous conversation, including its tool results.
+    `budget` bounds and accounts for the run.
+    `system_prompt` is built here when not given; async callers build it in a worker thread.
+    """
+    # The shared-client model serves streaming requests on the server loop
+    model = get_gemini_model(settings.GEMINI_AGENT_MODEL_ID, AGENT_MODEL_PARAMS, shared_client=streaming)
+    if not model:
+        raise ValueError("Gemini Model not initialized. Check API Key.")
+        
+    agent = Agent(
+        model=model,
+        messages=messages,
+        tools=AGENT_TOOLS,
+        system_prompt=system_prompt or _build_system_prompt(),
+        callback_handler=None, # Skip the default handler that prints every token to stdout
+        hooks=[budget] if budget else None,
+        # Independent tool calls from the same model turn run concurrently
+        tool_executor=ConcurrentToolExecutor()
     )
     return agent
 
 
 @observe(as_type="agent")
-def run_agent(query: str):
+def run_agent(query: str, session: dict = None, scope: CancelScope = None):
     """
     Runs the agent with Langfuse observability.
+    With a `session`, the conversation continues from its stored messages and is saved back.
+    `scope` cancels the run (deadline or caller); by default it gets AGENT_TIMEOUT_SECONDS.
     """
     logger.debug(f"Starting agent with query: {query}")
-    agent = create_agent()
+    budget = AgentRunBudget()
+    scope = scope or CancelScope("agent run", timeout=settings.AGENT_TIMEOUT_SECONDS)
+    agent = create_agent(streaming=False, messages=session["messages"] if session else None, budget=budget)
     # Strands agent is callable
-    return agent(query)
+    try:
+        result = agent(query, cancel_signal=scope.event)
+    except Exception as error:
+        # An upstream limiter turned a model or search call away; after the first turn Strands
+        # wraps it, so unwrap it for the API's 429/503 handler
+        overloaded = find_overloaded(error)
+        if overloaded is None:
+            raise
+        budget.finalize()
+        if overloaded is error:
+            raise
+        raise overloaded from error
+    finally:
+        scope.close()
+    budget.finalize(result)
+    if session is not None and not scope.cancelled:
+        session["messages"] = agent.messages
+        session_store.save(session)
+    return result
 
 @observe(as_type="agent")
-async def run_agent_stream(query: str):
+async def run_agent_stream(query: str, session: dict = None, scope: CancelScope = None):
     """
     Runs the agent in streaming mode.
+    With a `session`, the conversation continues from its stored messages and is saved back.
+    `scope` cancels the run when the client disconnects or the deadline passes;
+    by default it gets AGENT_TIMEOUT_SECONDS.
     """
     logger.debug(f"Starting agent stream with query: {query}")
-    agent = create_agent()
-    # streams formatted chunks
-    async for chunk in agent.stream_async(query):
-        # Inspect chunk for tool calls (reasoning/actions)
-        # Chunk structure:
-        # Message with toolUse: {'message': {'role': 'assistant', 'content': [{'toolUse': {...}}]}}
-        # Content Delta: {'event': {'contentBlockDelta': {'delta': {'text': '...'}}}}
+    budget = AgentRunBudget()
+    scope = scope or CancelScope("agent run", timeout=settings.AGENT_TIMEOUT_SECONDS)
+    # The catalog lookup reads the cache or Qdrant, so it stays off the event loop
+    system_prompt = await asyncio.to_thread(_build_system_prompt)
+    agent = create_agent(messages=session["messages"] if session else None, budget=budget, system_prompt=system_prompt)
+    result = None
+    overloaded = None
+    tools_started_at = None
+    try:
+        # streams formatted chunks; Strands stops at its next checkpoint once the scope is cancelled
+        async for chunk in agent.stream_async(query, cancel_signal=scope.event):
+            if "result" in chunk:
+                result = chunk["result"]
+
+            # Inspect chunk for tool calls (reasoning/actions)
+            # Chunk structure:
+            # Message with toolUse: {'message': {'role': 'assistant', 'content': [{'toolUse': {...}}]}}
+            # Content Delta: {'event': {'contentBlockDelta': {'delta': {'text': '...'}}}}
         
-        try:
-             # Check for Tool Use (The "Reasoning" / Action)
-             if "message" in chunk:
-                 msg = chunk["message"]
-                 if msg.get("role") == "assistant":
-                     for content in msg.get("content", []):
-                         if "toolUse" in content:
-                             tool_use = content["toolUse"]
+            try:
+                 # Check for Tool Use (The "Reasoning" / Action)
+                 if "message" in chunk:
+                     msg = chunk["message"]
+                     if msg.get("role") == "assistant":
+                         if any("toolUse" in content for content in msg.get("content", [])):
+                             tools_started_at = time.perf_counter()
+                         for content in msg.get("content", []):
+                             if "toolUse" in content:
+                                 tool_use = content["toolUse"]
+                                 event = {
+                                     "type": "thought",
+                                     "content": f"🛠️ **Action**: Calling `{tool_use['name']}`\nInput: `{tool_use['input']}`"
+                                 }
+                                 yield json.dumps(event) + "\n"
+            
+                 # Check for Tool Result (The Observation) - Optional, sometimes useful to show what it found
+                 if "message" in chunk:
+                     msg = chunk["message"]
+                     if msg.get("role") == "user":
+                         tool_results = [content["toolResult"] for content in msg.get("content", []) if "toolResult" in content]
+                         for tool_result in tool_results:
+                             run = budget.tool_runs.get(tool_result.get("toolUseId"))
+                             if run and run.get("refused"):
+                                 observation = f"⛔ **Observation**: `{run['name']}` skipped, step limit reached."
+                             elif run:
+                                 observation = f"✅ **Observation**: `{run['name']}` returned in {run['duration_ms']:.0f} ms."
+                             else:
+                                 observation = "✅ **Observation**: Received tool result."
                              event = {
-                                 "type": "thought",
-                                 "content": f"🛠️ **Action**: Calling `{tool_use['name']}`\nInput: `{tool_use['input']}`"
+                                 "type": "thought", 
+                                 "content": observation
                              }
                              yield json.dumps(event) + "\n"
-            
-             # Check for Tool Result (The Observation) - Optional, sometimes useful to show what it found
-             if "message" in chunk:
-                 msg = chunk["message"]
-                 if msg.get("role") == "user":
-                     for content in msg.get("content", []):
-                         if "toolResult" in content:
-                             # We can summarize or just note it returned
+                         # The calls of one turn run concurrently, so the turn takes about as long as the slowest
+                         runs = [budget.tool_runs.get(r.get("toolUseId"), {}) for r in tool_results]
+                         if len(runs) > 1 and tools_started_at is not None and all("duration_ms" in run for run in runs):
+                             wall_ms = (time.perf_counter() - tools_started_at) * 1000
+                             total_ms = sum(run["duration_ms"] for run in runs)
                              event = {
-                                 "type": "thought", 
-                                 "content": "✅ **Observation**: Received tool result."
+                                 "type": "thought",
+                                 "content": f"⏱️ {len(tool_results)} tools ran in parallel: {wall_ms:.0f} ms wall-clock ({total_ms:.0f} ms combined)."
                              }
                              yield json.dumps(event) + "\n"
+                         tools_started_at = None
 
-             # Check for Content Delta (The Final Answer)
-             if "event" in chunk:
-                 event_data = chunk["event"]
-                 if "contentBlockDelta" in event_data:
-                     delta = event_data["contentBlockDelta"].get("delta", {})
-                     if "text" in delta:
-                         event = {
-                             "type": "answer",
-                             "content": delta["text"]
-                         }
-                         yield json.dumps(event) + "\n"
+                 # Check for Content Delta (The Final Answer)
+                 if "event" in chunk:
+                     event_data = chunk["event"]
+                     if "contentBlockDelta" in event_data:
+                         delta = event_data["contentBlockDelta"].get("delta", {})
+                         if "text" in delta:
+                             event = {
+                                 "type": "answer",
+                                 "content": delta["text"]
+                             }
+                             yield json.dumps(event) + "\n"
                          
-        except Exception as e:
-            logger.error(f"Error parsing chunk: {e}")
+            except Exception as e:
+                logger.error(f"Error parsing chunk: {e}")
+    except Exception as e:
+        # An upstream limiter turned a model or search call away (wrapped by Strands after the
+        # first turn); end the run with what we have
+        overloaded = find_overloaded(e)
+        if overloaded is None:
+            raise
+    finally:
+        scope.close()
+
+    # Per-run accounting: model/tool steps and tokens
+    stats = budget.finalize(result)
+    if overloaded:
+        stats["overloaded"] = str(overloaded)
+        yield json.dumps({"type": "answer", "content": f"\n\n_Stopped: {overloaded}._"}) + "\n"
+    elif scope.cancelled:
+        stats["cancelled"] = scope.reason
+        yield json.dumps({"type": "answer", "content": f"\n\n_Stopped: {scope.reason}._"}) + "\n"
+    elif stats["stopped_early"]:
+        yield json.dumps({"type": "answer", "content": "\n\n_Stopped: the step limit for this request was reached._"}) + "\n"
+    yield json.dumps({"type": "stats", "content": stats}) + "\n"
+
+    # A cancelled run is not saved, so the next turn resumes from the last complete one
+    if session is not None and not scope.cancelled and not overloaded:
+        session["messages"] = agent.messages
+        session_store.save(session)
@@ -1,4 +1,7 @@
 import requests
+from urllib.parse import urlsplit
+from api.core.config import settings
+from api.services.cache import create_store
 
 # Curated list of popular AWS services
 # This list can be expanded. The key is the service name used in the URL.
@@ -8,7 +11,9 @@ AWS_SERVICES = []
 import xml.etree.ElementTree as ET
 import re
 
-_CACHED_SERVICES_MAP = {}
+# service name -> sitemap URL, keyed by sitemap index URL. On a shared CACHE_BACKEND one fetch
+# serves every worker, and a restarted worker does not fetch the index again.
+_services_cache = create_store("aws_services", max_entries=8, ttl_seconds=settings.AWS_SERVICES_CACHE_TTL_SECONDS)
 
 def fetch_online_services() -> dict[str, str]:
     """
@@ -16,7 +21,9 @@ def fetch_online_services() -> dict[str, str]:
     Returns a dict mapping service_name -> sitemap_url.
     Prioritizes 'userguide' over 'developerguide'.
     """
-    url = "https://docs.aws.amazon.com/sitemap_index.xml"
+    url = settings.AWS_DOCS_SITEMAP_INDEX_URL
+    # Service sitemaps live on the same host as the index (docs.aws.amazon.com, or a local mirror)
+    origin = "{0.scheme}://{0.netloc}".format(urlsplit(url))
     try:
         response = requests.get(url, timeout=10)
         if response.status_code != 200:
@@ -35,7 +42,7 @@ def fetch_online_services() -> dict[str, str]:
             # We are looking for .../latest/userguide/sitemap.xml or .../latest/developerguide/sitemap.xml
             # Regex to capture service name and type
             # Example: https://docs.aws.amazon.com/AmazonS3/latest/userguide/sitemap.xml
-            match = re.search(r'https://docs\.aws\.amazon\.com/([^/]+)/latest/(userguide|developerguide|devguide)/sitemap\.xml', loc)
+            match = re.search(re.escape(origin) + r'/([^/]+)/latest/(userguide|developerguide|devguide)/sitemap\.xml', loc)
             
             if match:
                 service_name = match.group(1)
@@ -52,18 +59,20 @@ def fetch_online_services() -> dict[str, str]:
         print(f"Error fetching online services: {e}")
         return {}
 
+def _get_services_map() -> dict[str, str]:
+    url = settings.AWS_DOCS_SITEMAP_INDEX_URL
+    services = _services_cache.get(url)
+    if services is None:
+        services = fetch_online_services()
+        # A failed fetch returns {}; it is not cached, so the next call tries again
+        if services:
+            _services_cache.set(url, services)
+    return services
+
 def get_available_services() -> list[str]:
     """Returns the list of available service names."""
-    global _CACHED_SERVICES_MAP
-    
-    if not _CACHED_SERVICES_MAP:
-        _CACHED_SERVICES_MAP = fetch_online_services()
-    
-    return sorted(list(_CACHED_SERVICES_MAP.keys()))
+    return sorted(_get_services_map().keys())
 
 def get_service_sitemap_url(service_name: str) -> str:
     """Returns the cached sitemap URL for a service, or None."""
-    global _CACHED_SERVICES_MAP
-    if not _CACHED_SERVICES_MAP:
-        _CACHED_SERVICES_MAP = fetch_online_services()
-    return _CACHED_SERVICES_MAP.get(service_name)
+    return _get_services_map().get(service_name)
@@ -0,0 +1,527 @@
+import re
+import json
+import time
+import sqlite3
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from api.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+    """
+    Caches generated answers per service and matches new questions by embedding similarity.
+    Entries are scoped to the index generation they were produced from, so a rebuild or
+    delete of the service index invalidates them automatically.
+
+    With a shared `store`, every answer is also published there under a time-ordered key, and
+    each worker pulls the answers other workers stored at most every ANSWER_CACHE_SYNC_SECONDS.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl_seconds: int, store=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.shared_store = store
+        self._lock = threading.Lock()
+        # service_name -> {"generation": str, "entries": [dict], "matrix": np.ndarray,
+        #                  "synced_key": str (last shared key seen), "synced_at": float}
+        self._services = {}
+        self._hits = 0
+        self._misses = 0
+        self._latency_saved_ms = 0.0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _get_bucket(self, service_name: str, generation: str | None) -> dict:
+        bucket = self._services.get(service_name)
+        if bucket is None or bucket["generation"] != generation:
+            # Index was rebuilt or deleted since these answers were generated
+            if bucket is not None:
+                logger.info(f"Answer cache for {service_name} invalidated (generation changed).")
+            bucket = {"generation": generation, "entries": [], "matrix": None, "synced_key": "", "synced_at": 0.0}
+            self._services[service_name] = bucket
+        return bucket
+
+    def _purge_expired(self, bucket: dict):
+        now = time.time()
+        entries = [e for e in bucket["entries"] if now - e["created_at"] < self.ttl_seconds]
+        if len(entries) != len(bucket["entries"]):
+            bucket["entries"] = entries
+            bucket["matrix"] = np.vstack([e["vector"] for e in entries]) if entries else None
+
+    @staticmethod
+    def _shared_prefix(service_name: str, generation: str | None) -> str:
+        return f"{service_name}|{generation}|"
+
+    def _sync(self, service_name: str, generation: str | None):
+        """Adds the answers other workers stored in the shared store since the last sync."""
+        with self._lock:
+            bucket = self._get_bucket(service_name, generation)
+            if time.time() - bucket["synced_at"] < settings.ANSWER_CACHE_SYNC_SECONDS:
+                return
+            bucket["synced_at"] = time.time()
+            after = bucket["synced_key"]
+
+        items = self.shared_store.items_after(self._shared_prefix(service_name, generation), after)
+        if not items:
+            return
+
+        with self._lock:
+            bucket = self._get_bucket(service_name, generation)
+            known = {e["key"] for e in bucket["entries"]}
+            for key, value in items:
+                if key not in known:
+                    bucket["entries"].append(dict(value, key=key, vector=self._normalize(value["vector"]), hits=0))
+            bucket["synced_key"] = max(bucket["synced_key"], items[-1][0])
+            bucket["entries"] = bucket["entries"][-self.max_entries:]
+            bucket["matrix"] = np.vstack([e["vector"] for e in bucket["entries"]]) if bucket["entries"] else None
+
+    def lookup(self, service_name: str, generation: str | None, embedding) -> dict | None:
+        """
+        Returns the closest cached entry if its similarity is above the threshold, else None.
+        """
+        query = self._normalize(embedding)
+        if self.shared_store is not None:
+            self._sync(service_name, generation)
+        with self._lock:
+            bucket = self._get_bucket(service_name, generation)
+            self._purge_expired(bucket)
+
+            if bucket["matrix"] is None or bucket["matrix"].shape[1] != query.shape[0]:
+                self._misses += 1
+                return None
+
+            similarities = bucket["matrix"] @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self._misses += 1
+                return None
+
+            entry = bucket["entries"][best]
+            entry["hits"] += 1
+            self._hits += 1
+            self._latency_saved_ms += entry["generation_ms"]
+
+        logger.debug(f"Answer cache hit for {service_name} (similarity={similarity:.4f}): '{entry['question']}'")
+        return {
+            "question": entry["question"],
+            "answer": entry["answer"],
+            "sources": entry["sources"],
+            "similarity": similarity,
+        }
+
+    def store(self, service_name: str, generation: str | None, question: str, embedding, answer: str, generation_ms: float,
+              sources: list[dict] = None):
+        """
+        Stores a generated answer and the sources it was built from.
+        The oldest entry is evicted once the service bucket is full.
+        """
+        # Time-ordered, so other workers can fetch only the entries added since their last sync
+        key = f"{self._shared_prefix(service_name, generation)}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        entry = {
+            "key": key,
+            "question": question,
+            "answer": answer,
+            "sources": sources or [],
+            "vector": self._normalize(embedding),
+            "generation_ms": generation_ms,
+            "created_at": time.time(),
+            "hits": 0,
+        }
+        if self.shared_store is not None:
+            shared = {k: entry[k] for k in ("question", "answer", "sources", "generation_ms", "created_at")}
+            self.shared_store.set(key, dict(shared, vector=[float(x) for x in embedding]))
+        with self._lock:
+            bucket = self._get_bucket(service_name, generation)
+            bucket["entries"].append(entry)
+            if len(bucket["entries"]) > self.max_entries:
+                bucket["entries"] = bucket["entries"][-self.max_entries:]
+            bucket["matrix"] = np.vstack([e["vector"] for e in bucket["entries"]])
+
+    def invalidate(self, service_name: str = None):
+        """Drops cached answers for one service, or for all services."""
+        with self._lock:
+            if service_name is None:
+                self._services.clear()
+            else:
+                self._services.pop(service_name, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "backend": type(self.shared_store).__name__ if self.shared_store is not None else "MemoryStore",
+                "entries": sum(len(b["entries"]) for b in self._services.values()),
+                "services": len(self._services),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "latency_saved_ms": round(self._latency_saved_ms, 1),
+            }
+
+
+class _StoreStats:
+    """Hit/miss counters shared by the key/value stores."""
+
+    def _init_stats(self):
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            hits, misses = self._hits, self._misses
+        lookups = hits + misses
+        return {
+            "backend": type(self).__name__,
+            "entries": len(self),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+# Every store has the same interface: get / set / delete / clear / items_after / stats / len.
+# Values must be JSON-serializable for the sqlite and redis stores; MemoryStore keeps the objects.
+
+class MemoryStore(_StoreStats):
+    """Bounded in-process key/value store with LRU eviction and a TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._init_stats()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] < time.time():
+                del self._data[key]
+                item = None
+            if item is not None:
+                self._data.move_to_end(key)
+        self._count(item is not None)
+        return item[1] if item is not None else None
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items_after(self, prefix: str, after: str = "") -> list[tuple[str, object]]:
+        """Live (key, value) pairs whose key starts with `prefix` and sorts after `after`, in key order."""
+        now = time.time()
+        with self._lock:
+            items = [(k, v) for k, (expires_at, v) in self._data.items() if k.startswith(prefix) and k > after and expires_at >= now]
+        return sorted(items, key=lambda item: item[0])
+
+    def __len__(self):
+        return len(self._data)
+
+
+_sqlite_local = threading.local()
+
+class SqliteStore(_StoreStats):
+    """
+    Bounded key/value store backed by a local SQLite file, so several API workers on the same
+    machine share entries, and keep them across restarts. Values are stored as JSON. Several
+    namespaces share one file, each with its own size limit and TTL. Errors count as misses.
+    Eviction is approximately LRU: a hit refreshes the entry's access time at most every
+    ACCESS_REFRESH_SECONDS, so most reads do not take the file's single write lock.
+    """
+
+    ACCESS_REFRESH_SECONDS = 60
+
+    def __init__(self, path: str, namespace: str, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._writes = 0
+        self._init_stats()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries(namespace, accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared between threads; one per thread and file
+        connections = getattr(_sqlite_local, "connections", None)
+        if connections is None:
+            connections = _sqlite_local.connections = {}
+        conn = connections.get(self.path)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            connections[self.path] = conn
+        return conn
+
+    def get(self, key: str):
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row is not None and row[1] < now:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                row = None
+            if row is not None and now - row[2] > self.ACCESS_REFRESH_SECONDS:
+                conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key))
+        except sqlite3.Error as e:
+            logger.warning(f"Cache read failed ({self.namespace}): {e}")
+            row = None
+        self._count(row is not None)
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, key: str, value):
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), now + self.ttl_seconds, now),
+            )
+            self._writes += 1
+            # Prune periodically rather than on every write
+            if self._writes % 100 == 0:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at < ?", (self.namespace, now))
+                conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.namespace, self.namespace, self.max_entries),
+                )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Cache write failed ({self.namespace}): {e}")
+
+    def delete(self, key: str) -> bool:
+        try:
+            cursor = self._conn().execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.warning(f"Cache delete failed ({self.namespace}): {e}")
+            return False
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def items_after(self, prefix: str, after: str = "") -> list[tuple[str, object]]:
+        """Live (key, value) pairs whose key starts with `prefix` and sorts after `after`, in key order."""
+        try:
+            rows = self._conn().execute(
+                "SELECT key, value FROM cache_entries WHERE namespace = ? AND key > ? AND key < ? AND expires_at >= ? ORDER BY key",
+                (self.namespace, max(after, prefix), prefix + "\uffff", time.time()),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Cache read failed ({self.namespace}): {e}")
+            return []
+        return [(key, json.loads(value)) for key, value in rows if key.startswith(prefix)]
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+
+_redis_clients = {}
+_redis_clients_lock = threading.Lock()
+
+class RedisStore(_StoreStats):
+    """
+    Key/value store on a Redis-compatible server, shared by every worker that can reach it.
+    Keys are `aws-docs:<namespace>:<key>` and expire after the TTL. A sorted set per namespace
+    (`aws-docs-index:<namespace>`, scored by write time) indexes the keys, for counting, syncing
+    and trimming the namespace to `max_entries` oldest-first. Values are stored as JSON.
+    Errors count as misses.
+    """
+
+    def __init__(self, url: str, namespace: str, max_entries: int, ttl_seconds: int):
+        import redis # Optional dependency, only needed for CACHE_BACKEND=redis
+
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._prefix = f"aws-docs:{namespace}:"
+        self._index = f"aws-docs-index:{namespace}"
+        self._errors = redis.RedisError
+        with _redis_clients_lock:
+            if url not in _redis_clients:
+                _redis_clients[url] = redis.Redis.from_url(url)
+            self._client = _redis_clients[url]
+        self._init_stats()
+
+    def _trim(self):
+        """Drops index members whose keys have expired, then the oldest entries beyond `max_entries`."""
+        self._client.zremrangebyscore(self._index, "-inf", time.time() - self.ttl_seconds)
+        excess = self._client.zcard(self._index) - self.max_entries
+        if excess <= 0:
+            return
+        oldest = self._client.zrange(self._index, 0, excess - 1)
+        if oldest:
+            pipe = self._client.pipeline(transaction=False)
+            pipe.delete(*[self._prefix + key.decode("utf-8") for key in oldest])
+            pipe.zrem(self._index, *oldest)
+            pipe.execute()
+
+    def get(self, key: str):
+        try:
+            data = self._client.get(self._prefix + key)
+        except self._errors as e:
+            logger.warning(f"Cache read failed ({self.namespace}): {e}")
+            data = None
+        self._count(data is not None)
+        return json.loads(data) if data is not None else None
+
+    def set(self, key: str, value):
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            pipe.set(self._prefix + key, json.dumps(value), ex=self.ttl_seconds)
+            pipe.zadd(self._index, {key: time.time()})
+            pipe.zcard(self._index)
+            if pipe.execute()[-1] > self.max_entries:
+                self._trim()
+        except (self._errors, TypeError, ValueError) as e:
+            logger.warning(f"Cache write failed ({self.namespace}): {e}")
+
+    def delete(self, key: str) -> bool:
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            pipe.delete(self._prefix + key)
+            pipe.zrem(self._index, key)
+            return pipe.execute()[0] > 0
+        except self._errors as e:
+            logger.warning(f"Cache delete failed ({self.namespace}): {e}")
+            return False
+
+    def clear(self):
+        keys = self._client.zrange(self._index, 0, -1)
+        for i in range(0, len(keys), 500):
+            self._client.delete(*[self._prefix + key.decode("utf-8") for key in keys[i : i + 500]])
+        self._client.delete(self._index)
+
+    def items_after(self, prefix: str, after: str = "") -> list[tuple[str, object]]:
+        """Live (key, value) pairs whose key starts with `prefix` and sorts after `after`, in key order."""
+        try:
+            # Only entries written since `after` (if it is still indexed) can sort after it
+            since = self._client.zscore(self._index, after) if after else None
+            low = since if since is not None else time.time() - self.ttl_seconds
+            members = self._client.zrangebyscore(self._index, low, "+inf")
+            keys = sorted(k for k in (member.decode("utf-8") for member in members) if k.startswith(prefix) and k > after)
+            values = self._client.mget([self._prefix + k for k in keys]) if keys else []
+        except self._errors as e:
+            logger.warning(f"Cache read failed ({self.namespace}): {e}")
+            return []
+        return [(k, json.loads(v)) for k, v in zip(keys, values) if v is not None]
+
+    def __len__(self):
+        try:
+            return self._client.zcount(self._index, time.time() - self.ttl_seconds, "+inf")
+        except self._errors:
+            return 0
+
+
+def create_store(namespace: str, max_entries: int, ttl_seconds: int, backend: str = None):
+    """
+    A store for one cache namespace on the configured backend (CACHE_BACKEND, or `backend`).
+    MemoryStore is per process; SqliteStore and RedisStore are shared by all workers.
+    """
+    backend = backend or settings.CACHE_BACKEND
+    if backend == "sqlite":
+        return SqliteStore(settings.CACHE_SQLITE_PATH, namespace, max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend == "redis":
+        try:
+            return RedisStore(settings.CACHE_REDIS_URL, namespace, max_entries=max_entries, ttl_seconds=ttl_seconds)
+        except ImportError:
+            logger.warning(f"CACHE_BACKEND=redis needs the redis package (pip install redis); the {namespace} cache is per process.")
+    elif backend != "memory":
+        logger.warning(f"Unknown cache backend '{backend}'; the {namespace} cache is per process.")
+    return MemoryStore(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+
+class RetrievalCache:
+    """
+    Caches ranked retrieval results keyed by (service, query, filters, k, index generation).
+    Because the generation is part of the key, results from a previous build are never returned.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def make_key(service_name: str, query: str, path_filters: list[str] | None, k: int, generation: str | None) -> str:
+        normalized_query = re.sub(r"\s+", " ", query).strip()
+        raw = json.dumps([service_name, normalized_query, sorted(path_filters or []), k, generation])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> list[dict] | None:
+        return self.store.get(key)
+
+    def set(self, key: str, docs: list[dict]):
+        self.store.set(key, docs)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+answer_cache = SemanticAnswerCache(
+    threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    # Answers are matched in memory; a shared backend only distributes them between workers.
+    # The shared namespace holds several services' worth of entries.
+    store=create_store("answers", settings.ANSWER_CACHE_MAX_ENTRIES * 20, settings.ANSWER_CACHE_TTL_SECONDS)
+    if settings.CACHE_BACKEND != "memory" else None,
+)
+
+retrieval_cache = RetrievalCache(create_store(
+    "retrieval",
+    max_entries=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+    backend=settings.RETRIEVAL_CACHE_BACKEND,
+))
+
+# Query embeddings, keyed by model and text
+embedding_cache = create_store(
+    "embeddings",
+    max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.EMBEDDING_CACHE_TTL_SECONDS,
+)
+
+# Service catalog and topic lists, keyed by index/catalog generation
+catalog_cache = create_store(
+    "catalog",
+    max_entries=settings.CATALOG_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.CATALOG_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,142 @@
+import time
+import heapq
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class OperationCancelled(Exception):
+    """Raised by long-running work whose CancelScope was cancelled or ran past its deadline."""
+
+
+class _DeadlineTimer:
+    """
+    One daemon thread that runs the deadlines set outside an event loop (e.g. by scrape jobs in
+    worker threads), instead of a thread per deadline. Cancelled entries stay in the heap until
+    they are due, or until they make up half of it.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._cancelled = 0
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay: float, callback, *args) -> list:
+        entry = [time.monotonic() + delay, 0, callback, args]
+        with self._condition:
+            self._counter += 1
+            entry[1] = self._counter
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cancel-deadlines", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry: list):
+        with self._condition:
+            if entry[2] is None:
+                return
+            entry[2] = None
+            self._cancelled += 1
+            if self._cancelled > len(self._heap) // 2:
+                self._heap = [e for e in self._heap if e[2] is not None]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                entry = heapq.heappop(self._heap)
+                callback, args = entry[2], entry[3]
+                if callback is None:
+                    self._cancelled = max(0, self._cancelled - 1)
+                    continue
+                entry[2] = None
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Deadline callback failed: {e}")
+
+
+_deadline_timer = _DeadlineTimer()
+
+
+class CancelScope:
+    """
+    Cooperative cancellation for one request: a thread-safe flag plus an optional deadline.
+
+    Work running in worker threads polls `cancelled` or calls `check()` between steps;
+    `event` can be handed to Strands as `cancel_signal`. A deadline set on the event loop is
+    scheduled with `loop.call_later`; one set elsewhere runs on a shared timer thread.
+    Call `close()` when the request is over to stop the timer.
+    """
+
+    def __init__(self, name: str, timeout: float = None):
+        self.name = name
+        self.event = threading.Event()
+        self.reason = None
+        self.deadline = None
+        self._timer = None
+        self._loop = None
+        if timeout:
+            self.set_deadline(timeout)
+
+    def set_deadline(self, timeout: float):
+        """Starts (or restarts) the deadline `timeout` seconds from now; 0 removes it."""
+        self.close()
+        self.deadline = time.monotonic() + timeout if timeout else None
+        if not timeout:
+            return
+        reason = f"deadline of {timeout:g}s exceeded"
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        if self._loop is not None:
+            self._timer = self._loop.call_later(timeout, self.cancel, reason)
+        else:
+            self._timer = _deadline_timer.schedule(timeout, self.cancel, reason)
+
+    def cancel(self, reason: str = "cancelled"):
+        if self.event.is_set():
+            return
+        self.reason = reason
+        self.event.set()
+        logger.info(f"Cancelling {self.name}: {reason}")
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise OperationCancelled(f"{self.name} cancelled: {self.reason}")
+
+    def remaining(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def close(self):
+        timer, self._timer = self._timer, None
+        if timer is None:
+            return
+        if self._loop is None:
+            _deadline_timer.cancel(timer)
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            timer.cancel()
+        elif not self._loop.is_closed():
+            # TimerHandle.cancel is not thread-safe
+            self._loop.call_soon_threadsafe(timer.cancel)
@@ -0,0 +1,31 @@
+import re
+import math
+import hashlib
+import functools
+
+# Deterministic stand-in for the embedding API (EMBEDDING_BACKEND=fake), for benchmarks and
+# load tests that must not touch the network. Each token is hashed to a signed slot
+# (feature hashing), so texts sharing words get similar vectors and search results stay meaningful.
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+@functools.lru_cache(maxsize=65536)
+def _token_slot(token: str, dimension: int) -> tuple[int, float]:
+    digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % dimension, 1.0 if digest >> 63 else -1.0
+
+
+def fake_embedding(text: str, dimension: int) -> list[float]:
+    vector = [0.0] * dimension
+    for token in _TOKEN_RE.findall(text.lower()):
+        slot, sign = _token_slot(token, dimension)
+        vector[slot] += sign
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def fake_embeddings(contents, dimension: int) -> list[list[float]]:
+    """Same call shape as `embed_content`: one text or a list of texts."""
+    texts = [contents] if isinstance(contents, str) else contents
+    return [fake_embedding(text, dimension) for text in texts]
@@ -0,0 +1,122 @@
+import re
+import json
+import uuid
+import asyncio
+from pydantic import ValidationError
+from strands.models import Model
+from api.core.config import settings
+
+# Stand-in for the Gemini model (LLM_BACKEND=fake), for load tests that must not depend on the
+# API's latency or quota. Every call waits FAKE_LLM_FIRST_TOKEN_MS, then streams
+# FAKE_LLM_OUTPUT_TOKENS words FAKE_LLM_TOKEN_MS apart. With tools, it follows the path a
+# real agent usually takes: list the services (unless the system prompt lists them), search the
+# first one, then answer.
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9-]{2,}")
+_CATALOG_RE = re.compile(r"^Indexed services: (.+)$", re.MULTILINE)
+
+
+def _text_of(message: dict) -> str:
+    return " ".join(block["text"] for block in message.get("content", []) if "text" in block)
+
+
+def _last_question(messages: list) -> str:
+    for message in reversed(messages):
+        if message["role"] == "user" and _text_of(message):
+            return _text_of(message)
+    return ""
+
+
+def _pending_tool_result(messages: list):
+    """(tool name, result text) if the last message answers a tool call from this turn, else None."""
+    if not messages or messages[-1]["role"] != "user":
+        return None
+    results = [block["toolResult"] for block in messages[-1].get("content", []) if "toolResult" in block]
+    if not results:
+        return None
+    names = {
+        block["toolUse"]["toolUseId"]: block["toolUse"]["name"]
+        for message in messages if message["role"] == "assistant"
+        for block in message.get("content", []) if "toolUse" in block
+    }
+    result = results[0]
+    text = " ".join(
+        item["text"] if "text" in item else json.dumps(item.get("json"))
+        for item in result.get("content", [])
+    )
+    return names.get(result.get("toolUseId")), text
+
+
+def _first_service(tool_output: str):
+    try:
+        services = json.loads(tool_output)
+    except ValueError:
+        services = re.findall(r"['\"]([^'\"]+)['\"]", tool_output)
+    return services[0] if isinstance(services, list) and services else None
+
+
+class FakeStreamingModel(Model):
+    """Strands model that streams canned answers with a configurable latency and makes no network calls."""
+
+    def __init__(self, model_id: str, params: dict = None):
+        self.config = {"model_id": model_id, "params": params or {}}
+
+    def update_config(self, **model_config):
+        self.config.update(model_config)
+
+    def get_config(self):
+        return self.config
+
+    async def structured_output(self, output_model, prompt, system_prompt=None, **kwargs):
+        # A default instance; fields without a default are left unset rather than invented
+        await asyncio.sleep(settings.FAKE_LLM_FIRST_TOKEN_MS / 1000)
+        try:
+            output = output_model()
+        except ValidationError:
+            output = output_model.model_construct()
+        yield {"output": output}
+
+    def _next_tool_call(self, messages: list, tool_specs: list, system_prompt: str):
+        tools = {spec["name"] for spec in tool_specs or []}
+        pending = _pending_tool_result(messages)
+        if pending is None:
+            catalog = _CATALOG_RE.search(system_prompt or "")
+            service = catalog.group(1).split(", ")[0] if catalog else None
+            if service is None and "list_available_services" in tools:
+                return "list_available_services", {}
+        else:
+            name, output = pending
+            service = _first_service(output) if name == "list_available_services" else None
+        if service and "search_service_documentation" in tools:
+            return "search_service_documentation", {"service_name": service, "query": _last_question(messages)}
+        return None
+
+    async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+        prompt = (system_prompt or "") + " " + " ".join(_text_of(m) for m in messages)
+        yield {"messageStart": {"role": "assistant"}}
+        await asyncio.sleep(settings.FAKE_LLM_FIRST_TOKEN_MS / 1000)
+
+        tool_call = self._next_tool_call(messages, tool_specs, system_prompt)
+        if tool_call:
+            name, arguments = tool_call
+            yield {"contentBlockStart": {"start": {"toolUse": {"toolUseId": f"fake-{uuid.uuid4().hex[:12]}", "name": name}}}}
+            yield {"contentBlockDelta": {"delta": {"toolUse": {"input": json.dumps(arguments)}}}}
+            yield {"contentBlockStop": {}}
+            yield {"messageStop": {"stopReason": "tool_use"}}
+            output_tokens = 20
+        else:
+            # Answer with words from the prompt, so answers vary with the retrieved passages
+            words = _WORD_RE.findall(prompt)[-500:] or ["answer"]
+            for i in range(settings.FAKE_LLM_OUTPUT_TOKENS):
+                if i:
+                    await asyncio.sleep(settings.FAKE_LLM_TOKEN_MS / 1000)
+                yield {"contentBlockDelta": {"delta": {"text": words[i % len(words)] + " "}}}
+            yield {"contentBlockStop": {}}
+            yield {"messageStop": {"stopReason": "end_turn"}}
+            output_tokens = settings.FAKE_LLM_OUTPUT_TOKENS
+
+        input_tokens = len(prompt) // 4
+        yield {"metadata": {
+            "usage": {"inputTokens": input_tokens, "outputTokens": output_tokens, "totalTokens": input_tokens + output_tokens},
+            "metrics": {"latencyMs": 0},
+        }}
@@ -0,0 +1,447 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from api.core.config import settings
+from api.services.cancellation import CancelScope
+import logging
+
+try:
+    import fcntl
+except ImportError: # Windows: no cross-process locks, so jobs are only coordinated within one worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# A job is scraped and then indexed by separate worker pools, so indexing one service
+# overlaps with scraping the next: queued -> scraping -> scraped (waiting to index) -> indexing
+ACTIVE_STATUSES = {"queued", "scraping", "scraped", "indexing"}
+WAITING_STATUSES = {"queued", "scraped"}
+# Progress events are frequent; job files are rewritten for them at most this often
+PROGRESS_SAVE_INTERVAL_SECONDS = 2.0
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobManager:
+    """
+    Runs scrape-and-index jobs, one job per service at a time. Scraping and indexing are separate
+    stages with their own bounded worker pools; the index pool's work queue connects them.
+
+    A job is a plain dict:
+        {"id", "service", "status" (see ACTIVE_STATUSES, then "succeeded" | "failed" | "cancelled"),
+         "limit", "max_jobs", "created_at", "started_at", "finished_at", "progress", "result", "error",
+         "events" (recent events), "event_offset" (number of older events dropped)}
+    Job state is written to JOBS_DIR, so it outlives the submitting connection and the process.
+    Event indexes are absolute, so a client can resume a stream with `since`.
+
+    JOBS_DIR is also the registry shared by the API workers on a host. Each job records its
+    owner process, which holds a lock file in `owners/` while it lives; an active job is only
+    failed once that lock is free. A lock file per service in `services/` is held by the owner
+    of the service's active job, so a submit on any worker joins it. Jobs owned by another
+    worker are read from their files, and cancelled through a `<job_id>.cancel` marker.
+    """
+
+    def __init__(self, jobs_dir: str, scrape_workers: int, index_workers: int, max_events: int, history_limit: int):
+        self.jobs_dir = jobs_dir
+        self.scrape_workers = scrape_workers
+        self.index_workers = index_workers
+        self.max_events = max_events
+        self.history_limit = history_limit
+        self._lock = threading.Lock()
+        self._jobs = {}  # job ID -> job, for the active jobs this process owns
+        self._active = {}  # service -> job ID
+        self._scopes = {}  # job ID -> CancelScope
+        self._service_locks = {}  # job ID -> held service lock file
+        self._last_saved = {}
+        self._scrape_executor = None
+        self._index_executor = None
+        self._owner = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.jobs_dir, "owners"), exist_ok=True)
+        os.makedirs(os.path.join(self.jobs_dir, "services"), exist_ok=True)
+        # Held for the life of the process, as proof to other workers that its jobs are still running
+        self._owner_lock = self._try_lock(self._owner_lock_path(self._owner))
+        self._load()
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _cancel_marker_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.cancel")
+
+    def _owner_lock_path(self, owner: str) -> str:
+        return os.path.join(self.jobs_dir, "owners", f"{owner}.lock")
+
+    def _service_lock_path(self, service: str) -> str:
+        return os.path.join(self.jobs_dir, "services", hashlib.sha1(service.encode("utf-8")).hexdigest() + ".lock")
+
+    @staticmethod
+    def _try_lock(path: str):
+        """Opens `path` and takes an exclusive lock on it; None if another open file holds the lock."""
+        f = open(path, "a+", encoding="utf-8")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return None
+        return f
+
+    def _owner_alive(self, owner: str | None) -> bool:
+        if owner == self._owner:
+            return True
+        path = self._owner_lock_path(owner) if owner and JOB_ID_RE.match(owner) else None
+        if path is None or not os.path.exists(path):
+            return False
+        lock = self._try_lock(path)
+        if lock is None:
+            return True
+        # Nobody holds it: the owner process is gone
+        lock.close()
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def _job_ids(self) -> list[str]:
+        return [name[:-5] for name in os.listdir(self.jobs_dir) if name.endswith(".json") and JOB_ID_RE.match(name[:-5])]
+
+    def _load_job(self, job_id: str) -> dict | None:
+        """
+        Reads a job from its file (jobs owned by other workers, and finished ones).
+        An active job whose owner process is gone is marked failed.
+        """
+        if not JOB_ID_RE.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable job file for {job_id}: {e}")
+            return None
+        if job["status"] in ACTIVE_STATUSES and not self._owner_alive(job.get("owner")):
+            # The job must be submitted again
+            job.update(status="failed", error="Interrupted by a server restart.", finished_at=time.time())
+            self._save(job)
+        return job
+
+    def _load(self):
+        jobs = [self._load_job(job_id) for job_id in self._job_ids()]
+        # Lock files of owners that exited without a remaining active job
+        for filename in os.listdir(os.path.join(self.jobs_dir, "owners")):
+            if filename.endswith(".lock"):
+                self._owner_alive(filename[:-5])
+        logger.debug(f"Found {sum(1 for j in jobs if j)} jobs in {self.jobs_dir}")
+
+    def _save(self, job: dict):
+        path = self._path(job["id"])
+        # Unique per writer: another worker may be marking the same orphaned job failed
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+        if job["id"] in self._jobs:
+            self._last_saved[job["id"]] = time.monotonic()
+
+    def _prune(self):
+        # Only finished jobs, read from disk, so the active jobs of every worker are kept
+        finished = sorted(
+            (j for j in map(self._load_job, self._job_ids()) if j and j["status"] not in ACTIVE_STATUSES),
+            key=lambda j: j["created_at"],
+        )
+        for job in finished[: max(0, len(finished) - self.history_limit)]:
+            for path in (self._path(job["id"]), self._cancel_marker_path(job["id"])):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _summary(job: dict) -> dict:
+        summary = {k: v for k, v in job.items() if k not in ("events", "event_offset")}
+        summary["event_count"] = job["event_offset"] + len(job["events"])
+        return summary
+
+    def submit(self, service: str, limit: int = None, max_jobs: int = 4) -> tuple[dict, bool]:
+        """
+        Queues a scrape-and-index job for `service`, or joins the one already queued or running
+        on any worker. Returns (job summary, joined).
+        """
+        # Retried while another worker holds the service lock but its job is not readable as
+        # active yet (just created) or any more (just finished)
+        for _ in range(100):
+            with self._lock:
+                active_id = self._active.get(service)
+                if active_id:
+                    logger.info(f"Scrape job for {service} already in progress ({active_id}); joining it")
+                    return self._summary(self._jobs[active_id]), True
+                service_lock = self._try_lock(self._service_lock_path(service))
+                if service_lock is not None:
+                    return self._start(service, service_lock, limit, max_jobs), False
+
+            with open(self._service_lock_path(service), "r", encoding="utf-8") as f:
+                job = self._load_job(f.read().strip())
+            if job is not None and job["status"] in ACTIVE_STATUSES:
+                logger.info(f"Scrape job for {service} already in progress on another worker ({job['id']}); joining it")
+                return self._summary(job), True
+            time.sleep(0.05)
+        raise RuntimeError(f"Could not queue or join a scrape job for {service}.")
+
+    def _start(self, service: str, service_lock, limit: int, max_jobs: int) -> dict:
+        """Creates and queues a job; called with `_lock` and the service lock held."""
+        job = {
+            "id": uuid.uuid4().hex,
+            "service": service,
+            "owner": self._owner,
+            "status": "queued",
+            "limit": limit,
+            "max_jobs": max_jobs,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": None,
+            "pages_scraped": None,
+            "result": None,
+            "error": None,
+            "events": [],
+            "event_offset": 0,
+        }
+        self._jobs[job["id"]] = job
+        self._active[service] = job["id"]
+        self._scopes[job["id"]] = CancelScope(f"scrape job {job['id']} ({service})")
+        self._save(job)
+        # Other workers read the holder's job ID from the service lock, once the job file exists
+        service_lock.seek(0)
+        service_lock.truncate()
+        service_lock.write(job["id"])
+        service_lock.flush()
+        self._service_locks[job["id"]] = service_lock
+        if self._scrape_executor is None:
+            self._scrape_executor = ThreadPoolExecutor(max_workers=self.scrape_workers, thread_name_prefix="job-scrape")
+            self._index_executor = ThreadPoolExecutor(max_workers=self.index_workers, thread_name_prefix="job-index")
+        self._scrape_executor.submit(self._scrape_stage, job["id"])
+        logger.info(f"Queued scrape job {job['id']} for {service}")
+        return self._summary(job)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._summary(job)
+        job = self._load_job(job_id)
+        return self._summary(job) if job else None
+
+    def list_jobs(self, status: str = None) -> list[dict]:
+        with self._lock:
+            jobs = {job_id: self._summary(j) for job_id, j in self._jobs.items()}
+        for job_id in self._job_ids():
+            if job_id not in jobs:
+                job = self._load_job(job_id)
+                if job is not None:
+                    jobs[job_id] = self._summary(job)
+        return sorted((j for j in jobs.values() if status is None or j["status"] == status), key=lambda j: j["created_at"], reverse=True)
+
+    def status_counts(self) -> dict[str, int]:
+        """Number of active jobs per status owned by this worker; the job queue depth."""
+        with self._lock:
+            counts = dict.fromkeys(ACTIVE_STATUSES, 0)
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
+
+    def events(self, job_id: str, since: int = 0) -> tuple[list[dict], int, bool] | None:
+        """Returns (events from index `since`, next index, job finished) or None for an unknown job."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._events_since(job, since)
+        job = self._load_job(job_id)
+        return self._events_since(job, since) if job else None
+
+    @staticmethod
+    def _events_since(job: dict, since: int) -> tuple[list[dict], int, bool]:
+        start = max(0, since - job["event_offset"])
+        events = job["events"][start:]
+        return events, job["event_offset"] + len(job["events"]), job["status"] not in ACTIVE_STATUSES
+
+    def cancel(self, job_id: str) -> dict | None:
+        """
+        Requests cancellation; a waiting job is cancelled at once, a running one at its next checkpoint.
+        A job owned by another worker is cancelled by that worker, at its next event or stage.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                other = self._load_job(job_id)
+                if other is not None and other["status"] in ACTIVE_STATUSES:
+                    open(self._cancel_marker_path(job_id), "w").close()
+                return self._summary(other) if other else None
+            scope = self._scopes.get(job_id)
+            if scope and job["status"] in ACTIVE_STATUSES:
+                scope.cancel("cancelled by user")
+            waiting = job["status"] in WAITING_STATUSES
+        if waiting:
+            self._finish(job, "cancelled", error="cancelled by user")
+        return self.get(job_id)
+
+    def _check_cancel_marker(self, job_id: str):
+        """Applies a cancellation requested through another worker."""
+        path = self._cancel_marker_path(job_id)
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            self.cancel(job_id)
+
+    def _emit(self, job: dict, event: dict):
+        self._check_cancel_marker(job["id"])
+        event = dict(event, job_id=job["id"])
+        with self._lock:
+            job["events"].append(event)
+            if len(job["events"]) > self.max_events:
+                dropped = len(job["events"]) - self.max_events
+                job["events"] = job["events"][dropped:]
+                job["event_offset"] += dropped
+            if event.get("type") == "progress":
+                job["progress"] = {"current": event.get("current"), "total": event.get("total")}
+                if time.monotonic() - self._last_saved.get(job["id"], 0) < PROGRESS_SAVE_INTERVAL_SECONDS:
+                    return
+            self._save(job)
+
+    def _finish(self, job: dict, status: str, result: dict = None, error: str = None):
+        with self._lock:
+            job.update(status=status, result=result, error=error, finished_at=time.time())
+            if self._active.get(job["service"]) == job["id"]:
+                del self._active[job["service"]]
+            scope = self._scopes.pop(job["id"], None)
+            self._save(job)
+            # Finished jobs are read from their files from now on
+            self._jobs.pop(job["id"], None)
+            self._last_saved.pop(job["id"], None)
+            service_lock = self._service_locks.pop(job["id"], None)
+            if service_lock:
+                service_lock.close()
+            self._prune()
+        if scope:
+            scope.close()
+        logger.info(f"Scrape job {job['id']} for {job['service']} {status}" + (f": {error}" if error else ""))
+
+    def _scrape_stage(self, job_id: str):
+        self._check_cancel_marker(job_id)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            scope = self._scopes.get(job_id)
+            if job is None or job["status"] != "queued":
+                # Cancelled while waiting for a scrape worker
+                return
+            job.update(status="scraping", started_at=time.time())
+            self._save(job)
+        # The deadline counts from the start of the run, not from when the job was queued
+        scope.set_deadline(settings.SCRAPE_TIMEOUT_SECONDS)
+        # Imported here: the scraper's HTML libraries are only needed once a job runs
+        from api.services.scraper import scrape_aws_docs
+
+        service = job["service"]
+        try:
+            scraped = None
+            last_error = None
+            for event_str in scrape_aws_docs([service], limit=job["limit"], max_jobs=job["max_jobs"], cancel=scope):
+                event = json.loads(event_str)
+                self._emit(job, event)
+                if event.get("type") == "result" and event.get("status") == "success":
+                    scraped = event
+                elif event.get("type") == "error":
+                    last_error = event.get("message")
+
+            if scope.cancelled:
+                self._finish(job, "cancelled", error=scope.reason)
+                return
+            if scraped is None:
+                self._finish(job, "failed", error=last_error or "Scrape produced no result.")
+                return
+        except Exception as e:
+            logger.error(f"Scrape job {job_id} for {service} failed while scraping: {e}")
+            self._emit(job, {"type": "error", "service": service, "message": f"Job failed: {e}"})
+            self._finish(job, "failed", error=str(e))
+            return
+
+        # Hand over to the index stage; this scrape worker moves on to the next queued service
+        with self._lock:
+            job.update(status="scraped", pages_scraped=scraped.get("pages_scraped"))
+            self._save(job)
+        self._emit(job, {"type": "log", "message": f"Waiting to index {service}..."})
+        self._index_executor.submit(self._index_stage, job_id)
+
+    def _index_stage(self, job_id: str):
+        self._check_cancel_marker(job_id)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            scope = self._scopes.get(job_id)
+            if job is None or job["status"] != "scraped":
+                # Cancelled while waiting for an index worker
+                return
+            job["status"] = "indexing"
+            self._save(job)
+
+        service = job["service"]
+        from api.services.vector_db import build_service_index
+
+        def on_progress(current, total):
+            self._emit(job, {"type": "index_progress", "service": service, "current": current, "total": total})
+
+        try:
+            self._emit(job, {"type": "log", "message": f"Indexing {service}..."})
+            stats = build_service_index(service, cancel=scope, on_progress=on_progress)
+            self._emit(job, {"type": "index_result", "service": service, "stats": stats})
+            if stats.get("status") == "success":
+                self._emit(job, {"type": "log", "message": f"Indexing complete for {service}."})
+                self._finish(job, "succeeded", result={"pages_scraped": job.get("pages_scraped"), **stats})
+            elif stats.get("status") == "cancelled":
+                self._finish(job, "cancelled", error=scope.reason)
+            else:
+                self._finish(job, "failed", result=stats, error=stats.get("message") or stats.get("status"))
+        except Exception as e:
+            logger.error(f"Scrape job {job_id} for {service} failed while indexing: {e}")
+            self._emit(job, {"type": "error", "service": service, "message": f"Job failed: {e}"})
+            self._finish(job, "failed", error=str(e))
+
+    async def follow(self, job_ids: list[str], since: int = 0, poll_interval: float = 0.25):
+        """
+        Yields the events of `job_ids` (from index `since` for each) until all of them finish.
+        Leaving early (e.g. a client disconnect) does not affect the jobs.
+        The job files are read in a worker thread, so polling does not block the event loop.
+        """
+        positions = {job_id: since for job_id in job_ids}
+        while positions:
+            for job_id in list(positions):
+                result = await asyncio.to_thread(self.events, job_id, positions[job_id])
+                if result is None:
+                    del positions[job_id]
+                    continue
+                events, positions[job_id], finished = result
+                for event in events:
+                    yield event
+                if finished:
+                    job = await asyncio.to_thread(self.get, job_id)
+                    yield {"type": "job_finished", "job_id": job_id, "service": job["service"],
+                           "status": job["status"], "error": job["error"]}
+                    del positions[job_id]
+            if positions:
+                await asyncio.sleep(poll_interval)
+
+
+job_manager = JobManager(
+    jobs_dir=settings.JOBS_DIR,
+    scrape_workers=settings.JOB_SCRAPE_WORKERS,
+    index_workers=settings.JOB_INDEX_WORKERS,
+    max_events=settings.JOB_MAX_EVENTS,
+    history_limit=settings.JOB_HISTORY_LIMIT,
+)
@@ -0,0 +1,141 @@
+import json
+import asyncio
+import threading
+from api.core.config import settings
+from api.services.admission import AdmissionLimiter
+import logging
+
+logger = logging.getLogger(__name__)
+
+# google-genai and strands are slow to import, so clients and models are created on first use
+# (or during warm-up in the FastAPI lifespan) rather than at import time.
+_google_client = None
+_models = {}
+_lock = threading.RLock()
+
+RAG_MODEL_PARAMS = {
+    "temperature": 0.3, # Slightly creative but grounded
+    "max_output_tokens": 8192,
+}
+
+AGENT_MODEL_PARAMS = {
+    "temperature": 0.0,
+    "max_output_tokens": 8192,
+}
+
+# Concurrent model calls across RAG answers and agent turns (tool calls do not hold a slot)
+llm_limiter = AdmissionLimiter(
+    "llm",
+    limit=settings.LLM_MAX_CONCURRENCY,
+    max_queue=settings.UPSTREAM_MAX_QUEUE,
+    max_wait=settings.UPSTREAM_MAX_WAIT_SECONDS,
+)
+
+def _limited(model):
+    """Wraps a Strands model so each call holds an `llm_limiter` slot while it streams."""
+    from strands.models import Model
+
+    class LimitedModel(Model):
+        def __init__(self, inner):
+            self.inner = inner
+
+        def __getattr__(self, name):
+            return getattr(self.inner, name)
+
+        @property
+        def stateful(self):
+            return self.inner.stateful
+
+        def update_config(self, **model_config):
+            self.inner.update_config(**model_config)
+
+        def get_config(self):
+            return self.inner.get_config()
+
+        async def count_tokens(self, *args, **kwargs):
+            return await self.inner.count_tokens(*args, **kwargs)
+
+        async def structured_output(self, *args, **kwargs):
+            async with llm_limiter.slot_async():
+                async for event in self.inner.structured_output(*args, **kwargs):
+                    yield event
+
+        async def stream(self, *args, **kwargs):
+            async with llm_limiter.slot_async():
+                async for event in self.inner.stream(*args, **kwargs):
+                    yield event
+
+    return LimitedModel(model)
+
+def get_google_client():
+    """
+    Shared Google GenAI client: one connection pool for embeddings and generation,
+    instead of a new client (and TLS handshake) per request. None without an API key.
+    """
+    global _google_client
+    if _google_client is None and settings.GOOGLE_API_KEY:
+        with _lock:
+            if _google_client is None:
+                from google import genai
+                _google_client = genai.Client(api_key=settings.GOOGLE_API_KEY)
+    return _google_client
+
+def create_gemini_model(model_id: str, params: dict, shared_client: bool = True):
+    """
+    Creates a GeminiModel. With `shared_client`, requests reuse the warmed process-wide client;
+    this is meant for streaming on the server event loop. Synchronous callers run Strands on a
+    private event loop, so they get a model that creates its own client per call.
+    With LLM_BACKEND=fake, returns the local stand-in model instead.
+    """
+    if settings.LLM_BACKEND == "fake":
+        from api.services.fake_llm import FakeStreamingModel
+        return FakeStreamingModel(model_id=f"fake-{model_id}", params=params)
+    if not settings.GOOGLE_API_KEY:
+        return None
+    try:
+        from strands.models.gemini import GeminiModel
+        if shared_client:
+            return GeminiModel(client=get_google_client(), model_id=model_id, params=params)
+        return GeminiModel(client_args={"api_key": settings.GOOGLE_API_KEY}, model_id=model_id, params=params)
+    except Exception as e:
+        logger.error(f"Failed to initialize GeminiModel {model_id}: {e}")
+        return None
+
+def get_gemini_model(model_id: str, params: dict, shared_client: bool = True):
+    """Returns the process-wide GeminiModel for this configuration, creating it on first use."""
+    key = (model_id, shared_client, json.dumps(params, sort_keys=True))
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = create_gemini_model(model_id, params, shared_client)
+                if model is not None:
+                    if settings.LLM_MAX_CONCURRENCY > 0:
+                        model = _limited(model)
+                    _models[key] = model
+    return model
+
+async def warm_up():
+    """
+    Opens connections to the Gemini API ahead of the first request, for both the sync client
+    (embeddings) and the async client (streaming generation). Failures are logged, not raised.
+    """
+    google_client = await asyncio.to_thread(get_google_client)
+    if not google_client:
+        logger.warning("Skipping Gemini warm-up: Google API Key not configured")
+        return False
+    async def _warm():
+        await google_client.aio.models.get(model=settings.GEMINI_RAG_MODEL_ID)
+        if settings.GEMINI_AGENT_MODEL_ID != settings.GEMINI_RAG_MODEL_ID:
+            await google_client.aio.models.get(model=settings.GEMINI_AGENT_MODEL_ID)
+        # The sync client is used from worker threads for embeddings
+        await asyncio.to_thread(google_client.models.get, model=settings.GEMINI_EMBEDDING_MODEL_ID)
+
+    try:
+        await asyncio.wait_for(_warm(), timeout=settings.WARMUP_TIMEOUT_SECONDS)
+        logger.info("Gemini clients warmed up.")
+        return True
+    except Exception as e:
+        logger.warning(f"Gemini warm-up failed: {e}")
+        return False
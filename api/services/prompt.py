@@ -0,0 +1,157 @@
+import re
+import json
+import hashlib
+import threading
+from api.core.config import settings
+from api.services.cache import MemoryStore
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rough ratio used when the model tokenizer is unavailable
+CHARS_PER_TOKEN = 4
+
+_tokenizer = None
+_tokenizer_failed = False
+_tokenizer_lock = threading.Lock()
+
+# Compressed older turns, keyed by the content of the turns they summarize.
+# A conversation's prefix is unique to its session, so this acts as a per-session cache.
+_summary_cache = MemoryStore(max_entries=settings.RAG_SUMMARY_CACHE_MAX_ENTRIES, ttl_seconds=settings.RAG_SUMMARY_CACHE_TTL_SECONDS)
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is not None or _tokenizer_failed:
+        return _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            try:
+                from google.genai.local_tokenizer import LocalTokenizer
+                _tokenizer = LocalTokenizer(model_name=settings.GEMINI_RAG_MODEL_ID)
+            except Exception as e:
+                logger.warning(f"Local tokenizer unavailable for {settings.GEMINI_RAG_MODEL_ID}, estimating tokens: {e}")
+                _tokenizer_failed = True
+    return _tokenizer
+
+def warm_up_tokenizer() -> bool:
+    """Loads the local tokenizer (downloading its model on first use); False if the estimate is used instead."""
+    return _get_tokenizer() is not None
+
+def count_tokens(text: str) -> int:
+    """Counts tokens with the RAG model's local tokenizer, falling back to a character estimate."""
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        try:
+            return tokenizer.count_tokens(text).total_tokens
+        except Exception as e:
+            logger.debug(f"Token counting failed, estimating: {e}")
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts text down to roughly `max_tokens`, preferring to stop at a line break."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    # Binary search for the longest prefix that fits (to within a few characters). Prefixes
+    # longer than twice the estimate are not considered, so each count stays cheap.
+    fits, too_long = 0, min(len(text), max_tokens * CHARS_PER_TOKEN * 2)
+    if count_tokens(text[:too_long]) <= max_tokens:
+        fits = too_long
+    while too_long - fits > CHARS_PER_TOKEN:
+        middle = (fits + too_long) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            fits = middle
+        else:
+            too_long = middle
+    cut = text[:fits]
+    newline = cut.rfind("\n")
+    if newline > len(cut) // 2:
+        cut = cut[:newline]
+    return cut.rstrip() + " [...]"
+
+def _compress_turn(role: str, content: str) -> str:
+    # Keep the first sentence or two of an older turn; drop code blocks and extra whitespace
+    content = re.sub(r"```.*?```", "[code]", content, flags=re.DOTALL)
+    content = re.sub(r"\s+", " ", content).strip()
+    limit = settings.RAG_SUMMARY_TURN_CHARS
+    if len(content) > limit:
+        sentences = re.split(r"(?<=[.!?])\s+", content)
+        summary = ""
+        for sentence in sentences:
+            if len(summary) + len(sentence) > limit:
+                break
+            summary += sentence + " "
+        content = (summary.strip() or content[:limit]) + " [...]"
+    return f"{role}: {content}"
+
+def _summarize_turns(turns: list[dict]) -> str:
+    key = hashlib.sha1(json.dumps(turns, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    summary = _summary_cache.get(key)
+    if summary is None:
+        summary = "\n".join(_compress_turn(t.get("role", "user"), str(t.get("content", ""))) for t in turns)
+        _summary_cache.set(key, summary)
+    return summary
+
+def _fit_lines(lines: list[str], budget: int) -> tuple[list[str], int]:
+    """
+    Drops lines from the front until the rest fit in `budget` tokens. Each line is counted once
+    (plus one token for its line break), so the total is an estimate of the joined text's count.
+    Returns (kept lines, their tokens).
+    """
+    counts = [count_tokens(line) + 1 for line in lines]
+    total = sum(counts)
+    start = 0
+    while start < len(lines) and total > budget:
+        total -= counts[start]
+        start += 1
+    return lines[start:], total
+
+def build_history_block(history: list[dict], budget: int) -> str:
+    """
+    Renders chat history within a token budget: the most recent turns are kept verbatim,
+    older turns are compressed, and the oldest compressed lines are dropped if still over budget.
+    """
+    if not history or budget <= 0:
+        return ""
+
+    recent_count = settings.RAG_RECENT_TURNS
+    if recent_count:
+        older, recent = history[:-recent_count], history[-recent_count:]
+    else:
+        older, recent = history, []
+
+    # Recent turns are trimmed (oldest first) only if they alone exceed the budget
+    recent_lines, recent_tokens = _fit_lines([f"{m.get('role', 'user')}: {m.get('content', '')}" for m in recent], budget)
+    recent_text = "\n".join(recent_lines)
+
+    summary_lines, _ = _fit_lines(_summarize_turns(older).split("\n") if older else [], budget - recent_tokens)
+    summary_text = "\n".join(summary_lines)
+
+    parts = []
+    if summary_text:
+        parts.append(f"Earlier conversation (condensed):\n{summary_text}")
+    if recent_text:
+        parts.append(recent_text)
+    if not parts:
+        return ""
+    return "Chat History:\n" + "\n".join(parts) + "\n\n"
+
+def select_passages(docs: list[dict], budget: int) -> list[dict]:
+    """
+    Keeps the highest-scoring passages that fit in the token budget.
+    The best passage is truncated rather than dropped if it alone exceeds the budget.
+    """
+    selected = []
+    remaining = budget
+    for doc in sorted(docs, key=lambda d: d.get("score", 0), reverse=True):
+        tokens = count_tokens(doc["content"])
+        if tokens <= remaining:
+            selected.append(doc)
+            remaining -= tokens
+        elif not selected and remaining > 0:
+            selected.append({**doc, "content": truncate_to_tokens(doc["content"], remaining)})
+            remaining = 0
+    return selected
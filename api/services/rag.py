@@ -1,35 +1,50 @@
-from strands import Agent
-from strands.models.gemini import GeminiModel
 from api.core.config import settings
-from api.services.vector_db import search_service_index
+from api.core.tracing import observe, mark_error
+from api.services.llm import get_gemini_model, RAG_MODEL_PARAMS
+from api.services.vector_db import search_service_index, get_embedding, get_index_generation
+from api.services.cache import answer_cache, retrieval_cache
+from api.services.prompt import count_tokens, build_history_block, select_passages
+from api.services.singleflight import SingleFlight, StreamFanout
+from api.services.cancellation import CancelScope
+from api.services.admission import Overloaded
+from api.core.metrics import track_stage, observe_stage, STAGE_ERRORS, STAGE_ITEMS
+from api.core.timing import record_count, current_timings
 import logging
 import json
+import re
+import time
+import asyncio
 
 logger = logging.getLogger(__name__)
 
-# Initialize RAG Model
-gemini_rag_model = None
-if settings.GOOGLE_API_KEY:
-    try:
-        gemini_rag_model = GeminiModel(
-            client_args={
-                "api_key": settings.GOOGLE_API_KEY,
-            },
-            model_id=settings.GEMINI_RAG_MODEL_ID,
-            params={
-                "temperature": 0.3, # Slightly creative but grounded
-                "max_output_tokens": 8192,
-            }
-        )
-    except Exception as e:
-        logger.error(f"Failed to initialize GeminiModel for RAG: {e}")
+# In-flight deduplication: identical concurrent searches and answers are computed once
+retrieval_flight = SingleFlight("retrieval")
+answer_flight = StreamFanout("answer")
 
-def retrieve_service_docs(service_name: str, query: str, path_filters: list[str] = None):
+def retrieve_service_docs(service_name: str, query: str, path_filters: list[str] = None, query_embedding: list[float] = None, k: int = 5):
     """
     Retrieve relevant documents from the service's knowledge base.
+    Results are cached per index generation, so repeated searches skip embedding and Qdrant.
+    Identical searches running at the same time share one embedding and Qdrant call.
     """
+    cache_key = None
+    if settings.RETRIEVAL_CACHE_ENABLED or settings.SINGLE_FLIGHT_ENABLED:
+        generation = get_index_generation(service_name)
+        cache_key = retrieval_cache.make_key(service_name, query, path_filters, k, generation)
+    if settings.RETRIEVAL_CACHE_ENABLED:
+        cached_docs = retrieval_cache.get(cache_key)
+        if cached_docs is not None:
+            logger.debug(f"Retrieval cache hit for {service_name} with query: '{query}'")
+            return cached_docs
+
+    if settings.SINGLE_FLIGHT_ENABLED:
+        return retrieval_flight.do(cache_key, _search_service_docs, service_name, query, path_filters, query_embedding, k, cache_key)
+    return _search_service_docs(service_name, query, path_filters, query_embedding, k, cache_key)
+
+@track_stage("retrieval")
+def _search_service_docs(service_name: str, query: str, path_filters: list[str], query_embedding: list[float], k: int, cache_key: str = None):
     logger.debug(f"Retrieving docs for {service_name} with query: '{query}'")
-    docs = search_service_index(service_name, query, k=5, path_filters=path_filters)
+    docs = search_service_index(service_name, query, k=k, path_filters=path_filters, query_embedding=query_embedding)
     # Deduplicate based on content to avoid repetitive context
     seen = set()
     unique_docs = []
@@ -39,26 +54,13 @@ def retrieve_service_docs(service_name: str, query: str, path_filters: list[str]
             seen.add(doc['content'])
             
     logger.debug(f"Retrieved {len(unique_docs)} unique documents.")
+    STAGE_ITEMS.inc(len(unique_docs), stage="retrieval")
+    # Empty results are not cached: the collection may simply not exist yet
+    if settings.RETRIEVAL_CACHE_ENABLED and unique_docs:
+        retrieval_cache.set(cache_key, unique_docs)
     return unique_docs
 
-from langfuse import observe
-
-def _prepare_rag_context(service_name: str, docs: list[dict], history: list[dict] = None) -> str:
-    """Helper to construct the RAG context string."""
-    context_str = ""
-    for i, doc in enumerate(docs):
-        context_str += f"Source {i+1} ({doc['url']}):\n{doc['content']}\n\n"
-        
-    history_str = ""
-    if history:
-        history_str = "Chat History:\n"
-        for msg in history:
-            role = msg.get("role", "user")
-            content = msg.get("content", "")
-            history_str += f"{role}: {content}\n"
-        history_str += "\n"
-
-    system_prompt = f"""You are a helpful assistant for AWS {service_name} documentation.
+RAG_PROMPT_TEMPLATE = """You are a helpful assistant for AWS {service_name} documentation.
 Your goal is to answer the user's question mostly based on the provided Context.
 
 Instructions:
@@ -72,79 +74,231 @@ Context:
 
 {history_str}
 """
+
+@track_stage("prompt_build")
+def _prepare_rag_context(service_name: str, docs: list[dict], history: list[dict] = None, question: str = "") -> str:
+    """
+    Helper to construct the RAG context string within RAG_PROMPT_TOKEN_BUDGET.
+    History gets up to RAG_HISTORY_TOKEN_BUDGET; retrieved passages fill the rest by score.
+    """
+    fixed_tokens = count_tokens(RAG_PROMPT_TEMPLATE.format(service_name=service_name, context_str="", history_str="")) + count_tokens(question)
+    history_budget = min(settings.RAG_HISTORY_TOKEN_BUDGET, settings.RAG_PROMPT_TOKEN_BUDGET - fixed_tokens)
+    history_str = build_history_block(history, history_budget)
+
+    passage_budget = settings.RAG_PROMPT_TOKEN_BUDGET - fixed_tokens - count_tokens(history_str)
+    selected_docs = select_passages(docs, passage_budget)
+
+    context_str = ""
+    for i, doc in enumerate(selected_docs):
+        context_str += f"Source {i+1} ({doc['url']}):\n{doc['content']}\n\n"
+
+    system_prompt = RAG_PROMPT_TEMPLATE.format(service_name=service_name, context_str=context_str, history_str=history_str)
+    prompt_tokens = count_tokens(system_prompt) + count_tokens(question)
+    record_count("prompt_tokens", prompt_tokens)
+    logger.info(
+        f"RAG prompt for {service_name}: ~{prompt_tokens} tokens "
+        f"(passages {len(selected_docs)}/{len(docs)}, history turns {len(history or [])}, budget {settings.RAG_PROMPT_TOKEN_BUDGET})"
+    )
     return system_prompt
 
-def _create_rag_agent() -> Agent:
-    """Helper to create a configured Strands Agent for RAG (without system prompt)."""
-    if not gemini_rag_model:
+def _create_rag_agent(streaming: bool = True):
+    """
+    Helper to create a configured Strands Agent for RAG (without system prompt).
+    Agents are cheap to build; each request gets a fresh one so no conversation state is shared.
+    The shared-client model serves streaming requests on the server loop.
+    """
+    from strands import Agent
+    model = get_gemini_model(settings.GEMINI_RAG_MODEL_ID, RAG_MODEL_PARAMS, shared_client=streaming)
+    if not model:
         raise ValueError("Gemini RAG Model not initialized.")
         
     # Initialize agent with NO tools and NO system prompt (to avoid model incompatibility)
     agent = Agent(
-        model=gemini_rag_model,
+        model=model,
         tools=[], 
-        system_prompt=None
+        system_prompt=None,
+        callback_handler=None # Skip the default handler that prints every token to stdout
     )
     return agent
 
+def _lookup_cached_answer(service_name: str, question: str, history: list[dict] = None):
+    """
+    Embeds the question and checks the semantic answer cache.
+    Returns (query_embedding, index_generation, cached_entry_or_None).
+    Follow-up questions (with history) depend on the conversation, so they bypass the cache.
+    """
+    query_emb = get_embedding(question)
+    generation = get_index_generation(service_name)
+    if not settings.ANSWER_CACHE_ENABLED or history:
+        return query_emb, generation, None
+    return query_emb, generation, answer_cache.lookup(service_name, generation, query_emb)
+
+def _store_cached_answer(service_name: str, generation: str, question: str, query_emb: list[float], answer: str, generation_ms: float,
+                         history: list[dict] = None, sources: list[dict] = None):
+    if not settings.ANSWER_CACHE_ENABLED or history or not answer:
+        return
+    answer_cache.store(service_name, generation, question, query_emb, answer, generation_ms, sources=sources)
+
+def _source_refs(docs: list[dict]) -> list[dict]:
+    """Citation list for the client: one entry per retrieved passage, best first."""
+    return [
+        {"url": doc["url"], "context": doc.get("context", ""), "score": round(doc.get("score", 0), 4)}
+        for doc in sorted(docs, key=lambda d: d.get("score", 0), reverse=True)
+    ]
+
 @observe(as_type="agent")
 def answer_question(service_name: str, question: str, history: list[dict] = None):
     """
     Generates an answer using RAG via Strands Agent.
     """
     try:
+        # 0. Check the answer cache for an equivalent question
+        query_emb, generation, cached = _lookup_cached_answer(service_name, question, history)
+        if cached:
+            return cached["answer"]
+
         # 1. Retrieve
-        docs = retrieve_service_docs(service_name, question)
+        docs = retrieve_service_docs(service_name, question, query_embedding=query_emb)
         if not docs:
             return f"I couldn't find any relevant information in the {service_name} knowledge base."
             
         # 2. Create Agent and Context
-        context_instruction = _prepare_rag_context(service_name, docs, history)
-        agent = _create_rag_agent()
+        context_instruction = _prepare_rag_context(service_name, docs, history, question)
+        agent = _create_rag_agent(streaming=False)
         
         # 3. Run Agent
         # Prepend context to the question since we can't use system_prompt with some models
         full_prompt = f"{context_instruction}\n\nUser Question: {question}"
         
-        response = agent(full_prompt)
-        return response.get("response", {}).get("text", "No response generated.")
-        
+        start = time.perf_counter()
+        with track_stage("llm_generation"):
+            response = agent(full_prompt)
+        answer = str(response).strip()
+        if not answer:
+            return "No response generated."
+
+        _store_cached_answer(service_name, generation, question, query_emb, answer, (time.perf_counter() - start) * 1000, history, _source_refs(docs))
+        return answer
+
+    except Overloaded as e:
+        # Rejected by an upstream limiter: the API answers 503 with Retry-After
+        mark_error(e)
+        raise
     except Exception as e:
         logger.error(f"RAG Error: {e}")
+        mark_error(e)
         return f"Error generating answer: {e}"
 
 # We skip standalone query rewrite for now to keep it simple with Strands,
 # or we could reimplement it using a simple strands agent too if needed.
 # For now, simplistic history injection is often sufficient.
 
+def _finish_stats(stats: dict, start: float):
+    elapsed = time.perf_counter() - start
+    # Per-stage breakdown of this request (embed_ms, search_ms, prompt_tokens, ttft_ms, gen_ms, ...)
+    stats["timings"] = current_timings()
+    stats["total_ms"] = round(elapsed * 1000, 1)
+    observe_stage("ask_total", elapsed)
+
 @observe(as_type="agent")
 async def answer_question_stream(service_name: str, question: str, history: list[dict] = None):
     """
     Generates a streaming answer using RAG via Strands Agent.
+    Yields events in order: `sources` (as soon as retrieval finishes), `token` deltas,
+    then `stats`; `error` replaces the rest if something fails.
+    Each event is {"type": ..., "content": ...}; the API frames them as SSE.
     """
+    start = time.perf_counter()
+    stats = {"cached": False, "sources": 0}
     try:
-        # 1. Retrieve
-        docs = retrieve_service_docs(service_name, question)
+        # 0. Check the answer cache; hits are sent back immediately
+        # Embedding and search are blocking calls; keep them off the event loop
+        query_emb, generation, cached = await asyncio.to_thread(_lookup_cached_answer, service_name, question, history)
+        if cached:
+            stats.update(cached=True, sources=len(cached["sources"]))
+            yield {"type": "sources", "content": cached["sources"]}
+            yield {"type": "token", "content": cached["answer"]}
+            _finish_stats(stats, start)
+            yield {"type": "stats", "content": stats}
+            return
+
+        # 1. Retrieve, and send the citations before generation starts
+        docs = await asyncio.to_thread(retrieve_service_docs, service_name, question, query_embedding=query_emb)
+        sources = _source_refs(docs)
+        stats.update(sources=len(sources), retrieval_ms=round((time.perf_counter() - start) * 1000, 1))
+        yield {"type": "sources", "content": sources}
         if not docs:
-             yield f"I couldn't find any relevant information in the {service_name} knowledge base."
-             return
+            yield {"type": "token", "content": f"I couldn't find any relevant information in the {service_name} knowledge base."}
+            _finish_stats(stats, start)
+            yield {"type": "stats", "content": stats}
+            return
 
-        # 2. Create Agent and Context
-        context_instruction = _prepare_rag_context(service_name, docs, history)
+        # 2. Create Agent and Context (token counting is CPU-bound; keep it off the event loop)
+        context_instruction = await asyncio.to_thread(_prepare_rag_context, service_name, docs, history, question)
         agent = _create_rag_agent()
         
         # 3. Stream Agent
         full_prompt = f"{context_instruction}\n\nUser Question: {question}"
         
-        async for chunk in agent.stream_async(full_prompt):
-            # Parse Strands chunk for content
-             if "event" in chunk:
-                 event_data = chunk["event"]
-                 if "contentBlockDelta" in event_data:
-                     delta = event_data["contentBlockDelta"].get("delta", {})
-                     if "text" in delta:
-                         yield delta["text"]
+        generation_start = time.perf_counter()
+        answer_parts = []
+        # Strands stops at its next checkpoint once the deadline fires. A client disconnect
+        # cancels this generator directly (or, when coalesced, once every subscriber has left).
+        scope = CancelScope("answer generation", timeout=settings.ASK_TIMEOUT_SECONDS)
+        try:
+            async for chunk in agent.stream_async(full_prompt, cancel_signal=scope.event):
+                # Parse Strands chunk for content
+                 if "event" in chunk:
+                     event_data = chunk["event"]
+                     if "contentBlockDelta" in event_data:
+                         delta = event_data["contentBlockDelta"].get("delta", {})
+                         if "text" in delta:
+                             if not answer_parts:
+                                 stats["first_token_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                                 observe_stage("llm_first_token", time.perf_counter() - generation_start)
+                             answer_parts.append(delta["text"])
+                             yield {"type": "token", "content": delta["text"]}
+        finally:
+            scope.close()
+
+        if scope.cancelled:
+            # A partial answer is neither cached nor recorded as complete
+            yield {"type": "error", "content": f"Answer generation stopped: {scope.reason}."}
+            stats["cancelled"] = scope.reason
+            _finish_stats(stats, start)
+            yield {"type": "stats", "content": stats}
+            return
+
+        generation_ms = (time.perf_counter() - generation_start) * 1000
+        observe_stage("llm_generation", generation_ms / 1000)
+        _store_cached_answer(service_name, generation, question, query_emb, "".join(answer_parts), generation_ms, history, sources)
+        stats["generation_ms"] = round(generation_ms, 1)
+        _finish_stats(stats, start)
+        yield {"type": "stats", "content": stats}
                          
     except Exception as e:
         logger.error(f"RAG Stream Error: {e}")
-        yield f"Error generating answer: {e}"
+        mark_error(e)
+        STAGE_ERRORS.inc(stage="ask_total")
+        yield {"type": "error", "content": f"Error generating answer: {e}"}
+
+async def subscribe_answer_stream(service_name: str, question: str, history: list[dict] = None):
+    """
+    Same events as `answer_question_stream`, but identical questions asked at the same time
+    (same service, normalized question and index generation, no history) share one generation
+    whose events fan out to every caller. Coalesced callers get `"coalesced": true` in their stats.
+    """
+    if history or not settings.SINGLE_FLIGHT_ENABLED:
+        async for event in answer_question_stream(service_name, question, history):
+            yield event
+        return
+
+    normalized_question = re.sub(r"\s+", " ", question).strip().lower()
+    key = (service_name, normalized_question, get_index_generation(service_name))
+    leader, events = answer_flight.subscribe(key, lambda: answer_question_stream(service_name, question))
+    if not leader:
+        logger.info(f"Coalesced /ask for {service_name} onto in-flight answer: '{question}'")
+    async for event in events:
+        if event["type"] == "stats" and not leader:
+            event = {"type": "stats", "content": dict(event["content"], coalesced=True)}
+        yield event
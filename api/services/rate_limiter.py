@@ -0,0 +1,175 @@
+import re
+import math
+import time
+import random
+import threading
+from api.services.admission import Overloaded, ADMISSION_REJECTED, record_wait
+import logging
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _get_status_code(error: Exception) -> int | None:
+    for attr in ("code", "status_code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _get_retry_after(error: Exception) -> float | None:
+    """Extracts a retry hint from a Retry-After header or a google.rpc.RetryInfo detail."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    # Gemini reports quota waits as e.g. {"retryDelay": "27s"} in the error details
+    match = re.search(r"retryDelay['\"]?\s*:\s*['\"]([\d.]+)s", str(getattr(error, "details", "")))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket limiter with an AIMD-controlled concurrency window for a shared upstream API.
+
+    Successful calls increase the request rate and concurrency additively; 429/5xx responses
+    halve them (at most once per cooldown) and Retry-After hints pause all callers.
+    Retryable failures are retried, so callers never silently lose work.
+    """
+
+    def __init__(self, name: str, rate: float, max_rate: float, max_concurrency: int,
+                 min_rate: float = 0.2, max_retries: int = 6, cooldown_seconds: float = 1.0):
+        self.name = name
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.cooldown_seconds = cooldown_seconds
+
+        self._concurrency = float(max(1, max_concurrency // 2))
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._in_flight = 0
+        self._waiting = 0
+        self._throttled = 0
+        self._completed = 0
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        burst = max(1.0, self.rate)
+        self._tokens = min(burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _overloaded(self, reason: str, waited: float) -> Overloaded:
+        # Time for the backlog to drain at the current rate
+        retry_after = min(60, max(1, math.ceil(max(self._waiting, 1) / self.rate)))
+        ADMISSION_REJECTED.inc(limiter=self.name, reason=reason)
+        record_wait(self.name, waited)
+        return Overloaded(self.name, reason, retry_after)
+
+    def acquire(self, max_wait: float = None, max_backlog: int = None):
+        """
+        Waits for a request slot. Interactive callers pass `max_wait` (seconds, 0 for no limit)
+        and `max_backlog` to get Overloaded instead of queueing behind a long backlog.
+        """
+        start = time.monotonic()
+        with self._cond:
+            if max_backlog is not None and self._waiting >= max_backlog:
+                raise self._overloaded("queue_full", 0.0)
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    remaining = max_wait - (now - start) if max_wait else float("inf")
+                    if remaining <= 0:
+                        raise self._overloaded("wait_timeout", now - start)
+                    self._refill(now)
+                    if now < self._blocked_until:
+                        self._cond.wait(min(self._blocked_until - now, remaining))
+                        continue
+                    if self._in_flight < int(self._concurrency) and self._tokens >= 1:
+                        self._tokens -= 1
+                        self._in_flight += 1
+                        record_wait(self.name, now - start)
+                        return
+                    # Wake up when the next token is due, or earlier if a slot is released
+                    self._cond.wait(min(max(0.01, (1 - self._tokens) / self.rate), remaining))
+            finally:
+                self._waiting -= 1
+
+    def release(self, throttled: bool = False, retry_after: float = None, failed: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self._throttled += 1
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, now + retry_after)
+                if now - self._last_decrease > self.cooldown_seconds:
+                    self._last_decrease = now
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    self._concurrency = max(1.0, self._concurrency / 2)
+                    logger.warning(
+                        f"{self.name} throttled: rate -> {self.rate:.2f}/s, concurrency -> {int(self._concurrency)}"
+                    )
+            elif not failed:
+                self._completed += 1
+                self.rate = min(self.max_rate, self.rate + 1 / max(self.rate, 1.0))
+                self._concurrency = min(float(self.max_concurrency), self._concurrency + 1 / self._concurrency)
+            self._cond.notify_all()
+
+    def call(self, fn, *args, max_wait: float = None, max_backlog: int = None, **kwargs):
+        """
+        Runs `fn` under the limiter, retrying throttled and transient server errors.
+        `max_wait` and `max_backlog` bound each wait for a slot (see `acquire`).
+        """
+        attempt = 0
+        while True:
+            self.acquire(max_wait=max_wait, max_backlog=max_backlog)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                status = _get_status_code(e)
+                if status not in RETRYABLE_STATUS_CODES:
+                    self.release(failed=True)
+                    raise
+                retry_after = _get_retry_after(e)
+                self.release(throttled=True, retry_after=retry_after)
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.error(f"{self.name} giving up after {attempt} attempts: {e}")
+                    raise
+                if not retry_after:
+                    # Jittered exponential backoff when the server gave no hint
+                    time.sleep(min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0))
+                logger.debug(f"{self.name} retrying after HTTP {status} (attempt {attempt})")
+                continue
+            self.release()
+            return result
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "rate_per_second": round(self.rate, 2),
+                "concurrency_limit": int(self._concurrency),
+                "in_flight": self._in_flight,
+                "backlog": self._waiting,
+                "throttled": self._throttled,
+                "completed": self._completed,
+                "paused_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 1),
+            }
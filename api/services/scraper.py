@@ -11,6 +11,8 @@ import time
 from markdownify import markdownify as md
 from api.core.config import settings
 from api.services.aws_metadata import get_service_sitemap_url
+from api.services.cancellation import CancelScope
+from api.core.metrics import track_stage, STAGE_ITEMS
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,17 +21,21 @@ logger = logging.getLogger(__name__)
 def scrape_page(url):
     """Scrape a single page and return the Markdown content."""
     try:
-        response = requests.get(url, timeout=10)
+        with track_stage("scrape_fetch"):
+            response = requests.get(url, timeout=10)
         if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            # AWS docs main content is usually in #main-col-body
-            main_content = soup.find('div', id='main-col-body')
-            if main_content:
-                # Convert HTML to Markdown
-                return md(str(main_content), heading_style="ATX")
-            else:
-                # Fallback to body if main content not found
-                return md(str(soup.body), heading_style="ATX")
+            with track_stage("scrape_convert"):
+                soup = BeautifulSoup(response.content, 'html.parser')
+                # AWS docs main content is usually in #main-col-body
+                main_content = soup.find('div', id='main-col-body')
+                if main_content:
+                    # Convert HTML to Markdown
+                    markdown = md(str(main_content), heading_style="ATX")
+                else:
+                    # Fallback to body if main content not found
+                    markdown = md(str(soup.body), heading_style="ATX")
+            STAGE_ITEMS.inc(stage="scrape_convert")
+            return markdown
         else:
             logger.warning(f"Failed to fetch {url}: {response.status_code}")
             return None
@@ -60,14 +66,19 @@ def get_sitemap_urls(sitemap_content):
         logger.error(f"Error parsing sitemap XML: {e}")
     return urls
 
-def scrape_aws_docs(service_list: list[str], limit: int = None, max_jobs: int = 4):
+def scrape_aws_docs(service_list: list[str], limit: int = None, max_jobs: int = 4, cancel: CancelScope = None):
     # Yields JSON strings for progress updates
+    # With `cancel`, pending page fetches are dropped and the generator stops once it is cancelled
     
     # Ensure max_jobs is reasonable
     if max_jobs < 1: max_jobs = 1
     if max_jobs > 20: max_jobs = 20
 
     for service in service_list:
+        if cancel and cancel.cancelled:
+            yield json.dumps({"type": "cancelled", "service": service, "message": f"Scrape cancelled: {cancel.reason}"})
+            return
+
         yield json.dumps({"type": "log", "message": f"Locating sitemap for: {service}..."})
         
         # 1. Get Sitemap URL from Metadata
@@ -125,6 +136,10 @@ def scrape_aws_docs(service_list: list[str], limit: int = None, max_jobs: int =
                 future_to_index = {executor.submit(scrape_page, url): i for i, url in enumerate(page_urls)}
                 
                 for future in as_completed(future_to_index):
+                    if cancel and cancel.cancelled:
+                        # Drop queued pages; only requests already in flight finish
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        break
                     i = future_to_index[future]
                     url = page_urls[i]
                     try:
@@ -147,6 +162,12 @@ def scrape_aws_docs(service_list: list[str], limit: int = None, max_jobs: int =
                             logger.error(f"Error scraping {url}: {e}")
                             completed_count += 1
             
+            if cancel and cancel.cancelled:
+                # Keep the previous raw file rather than writing a partial scrape
+                logger.info(f"Scrape of {service} cancelled after {completed_count}/{total_pages} pages: {cancel.reason}")
+                yield json.dumps({"type": "cancelled", "service": service, "message": f"Scrape cancelled: {cancel.reason}"})
+                return
+
             final_content = [b for b in full_content_blocks if b]
             
             filename = f"{service}.md"
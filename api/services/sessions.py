@@ -0,0 +1,67 @@
+import copy
+import time
+import uuid
+from api.core.config import settings
+from api.services.cache import create_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    Server-side conversation state with TTL eviction, so clients only send the new message.
+
+    A session is a plain dict:
+        {"id", "kind" ("ask" | "agent"), "service_name", "history" (ask turns),
+         "messages" (Strands agent messages, including tool results), "updated_at"}
+    Callers get a copy and write it back with `save`. Sessions are held in a cache store
+    (namespace "sessions"); with a shared CACHE_BACKEND any worker can continue a conversation.
+    """
+
+    def __init__(self, store):
+        # The store's TTL is refreshed on every save, and its LRU limit caps the session count
+        self.store = store
+
+    def get_or_create(self, session_id: str | None, kind: str, service_name: str = None) -> dict:
+        """
+        Returns the session for `session_id`, or a new one if it is unknown, expired or was used
+        for a different kind or service (a new service starts a new conversation).
+        """
+        now = time.time()
+        session = self.store.get(session_id) if session_id else None
+        if session and session["kind"] == kind and session["service_name"] == service_name:
+            return copy.deepcopy(session)
+
+        return {
+            "id": session_id or uuid.uuid4().hex,
+            "kind": kind,
+            "service_name": service_name,
+            "history": [],
+            "messages": [],
+            "updated_at": now,
+        }
+
+    def save(self, session: dict):
+        session["updated_at"] = time.time()
+        self.store.set(session["id"], session)
+
+    def append_turn(self, session: dict, question: str, answer: str):
+        """Records a question/answer pair on an ask session and saves it."""
+        session["history"].append({"role": "user", "content": question})
+        session["history"].append({"role": "assistant", "content": answer})
+        session["history"] = session["history"][-settings.SESSION_MAX_HISTORY_MESSAGES:]
+        self.save(session)
+
+    def delete(self, session_id: str) -> bool:
+        return self.store.delete(session_id)
+
+    def __len__(self):
+        return len(self.store)
+
+
+session_store = SessionStore(create_store(
+    "sessions",
+    max_entries=settings.SESSION_MAX_SESSIONS,
+    ttl_seconds=settings.SESSION_TTL_SECONDS,
+))
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Collapses identical concurrent calls: the first caller for a key runs the function,
+    callers arriving while it is in flight wait for and share its result (or exception).
+    Nothing is kept once the call finishes; caching is left to the caches.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                self._executed += 1
+                leader = True
+            else:
+                self._coalesced += 1
+                leader = False
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn(*args, **kwargs)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._calls), "executed": self._executed, "coalesced": self._coalesced}
+
+
+class StreamFanout:
+    """
+    Single-flight for async event streams. The first subscriber for a key starts the producer;
+    later subscribers replay the events produced so far and then follow it live.
+    The producer is cancelled if every subscriber goes away before it finishes.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    async def _produce(self, key, flight: dict, stream):
+        try:
+            async for event in stream:
+                flight["events"].append(event)
+                async with flight["changed"]:
+                    flight["changed"].notify_all()
+        except Exception as e:
+            flight["error"] = e
+        finally:
+            flight["done"] = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            async with flight["changed"]:
+                flight["changed"].notify_all()
+
+    async def _follow(self, key, flight: dict):
+        index = 0
+        try:
+            while True:
+                if index < len(flight["events"]):
+                    yield flight["events"][index]
+                    index += 1
+                    continue
+                if flight["done"]:
+                    break
+                async with flight["changed"]:
+                    # Re-check under the condition so a notification between checks is not lost
+                    if index >= len(flight["events"]) and not flight["done"]:
+                        await flight["changed"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+        finally:
+            flight["subscribers"] -= 1
+            if flight["subscribers"] == 0 and not flight["done"]:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                logger.debug(f"{self.name}: all subscribers left {key}, cancelling producer")
+                flight["task"].cancel()
+
+    def subscribe(self, key, stream_factory) -> tuple[bool, object]:
+        """
+        Returns (is_leader, async iterator of events) for `key`.
+        `stream_factory()` is only called when no identical stream is in flight.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = {"events": [], "done": False, "error": None, "subscribers": 0, "changed": asyncio.Condition()}
+            flight["task"] = asyncio.create_task(self._produce(key, flight, stream_factory()))
+            self._flights[key] = flight
+            self._executed += 1
+            leader = True
+        else:
+            self._coalesced += 1
+            leader = False
+        flight["subscribers"] += 1
+        return leader, self._follow(key, flight)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(f["subscribers"] for f in self._flights.values()),
+            "executed": self._executed,
+            "coalesced": self._coalesced,
+        }
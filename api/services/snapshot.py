@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+from qdrant_client.models import Distance, VectorParams
+from api.core.config import settings
+from api.services.vector_db import get_qdrant_client, get_embedding_model_id, _sanitize_collection_name, _bump_index_generation, get_index_generation
+import logging
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Snapshot layout (one directory per service):
+#   manifest.json   - service metadata, vector dimension/dtype, embedding model
+#   raw.md          - the scraped raw pages, if present
+#   points.jsonl    - one {"id", "payload"} object per chunk, in the same order as vectors.npy
+#   vectors.npy     - all chunk vectors as a single (count, dimension) array
+
+def _snapshot_dir(service_name: str) -> str:
+    return os.path.join(settings.SNAPSHOT_DIR, _sanitize_collection_name(service_name))
+
+def export_service_snapshot(service_name: str, output_dir: str = None, dtype: str = "float32", batch_size: int = 256) -> dict:
+    """
+    Exports a service's raw pages, chunk payloads and vectors to a portable snapshot directory.
+    The snapshot is written to a temporary directory next to `output_dir` and renamed into place
+    once complete, so a failed export leaves no partial snapshot behind.
+    """
+    collection_name = _sanitize_collection_name(service_name)
+    output_dir = os.path.normpath(output_dir or _snapshot_dir(service_name))
+    client = get_qdrant_client()
+
+    if not client.collection_exists(collection_name):
+        return {"status": "error", "message": f"Collection for {service_name} not found."}
+
+    expected = client.count(collection_name=collection_name, exact=True).count
+    if not expected:
+        return {"status": "error", "message": f"Collection for {service_name} is empty."}
+    dimension = client.get_collection(collection_name).config.params.vectors.size
+
+    parent = os.path.dirname(output_dir) or "."
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(output_dir)}-", dir=parent)
+    logger.info(f"Exporting {service_name} snapshot to {output_dir}...")
+
+    previous_dir = None
+    try:
+        # Vectors are written straight to the .npy file, a batch at a time, instead of being held in memory
+        vectors = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "vectors.npy"), mode="w+", dtype=dtype, shape=(expected, dimension)
+        )
+        count = 0
+        offset = None
+        with open(os.path.join(tmp_dir, "points.jsonl"), "w", encoding="utf-8") as f:
+            while True:
+                points, next_offset = client.scroll(
+                    collection_name=collection_name,
+                    limit=batch_size,
+                    with_payload=True,
+                    with_vectors=True,
+                    offset=offset
+                )
+                if count + len(points) > expected:
+                    break
+                for point in points:
+                    f.write(json.dumps({"id": str(point.id), "payload": point.payload}) + "\n")
+                vectors[count : count + len(points)] = [point.vector for point in points]
+                count += len(points)
+
+                offset = next_offset
+                if offset is None:
+                    break
+        vectors.flush()
+        del vectors
+
+        if count != expected:
+            # The collection changed while it was exported (e.g. it was re-indexed)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return {"status": "error", "message": f"Collection for {service_name} changed during export; try again."}
+
+        raw_file = os.path.join(settings.RAW_DATA_DIR, f"{service_name}.md")
+        has_raw = os.path.exists(raw_file)
+        if has_raw:
+            shutil.copyfile(raw_file, os.path.join(tmp_dir, "raw.md"))
+
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "service": service_name,
+            "collection": collection_name,
+            "points": count,
+            "dimension": int(dimension),
+            "dtype": dtype,
+            "distance": "cosine",
+            "embedding_model": get_embedding_model_id(),
+            "index_generation": get_index_generation(service_name),
+            "has_raw": has_raw,
+            "created_at": time.time(),
+        }
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Swap the new snapshot in; an existing one is only removed once the new one is in place
+        if os.path.exists(output_dir):
+            previous_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(output_dir)}-old-", dir=parent)
+            os.rmdir(previous_dir)
+            os.rename(output_dir, previous_dir)
+        os.rename(tmp_dir, output_dir)
+        if previous_dir:
+            shutil.rmtree(previous_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if previous_dir and not os.path.exists(output_dir):
+            os.rename(previous_dir, output_dir)
+        raise
+
+    logger.info(f"Exported {count} points for {service_name}.")
+    return {"status": "success", "path": output_dir, "points": count}
+
+def import_service_snapshot(snapshot_dir: str, service_name: str = None, batch_size: int = 256, force: bool = False) -> dict:
+    """
+    Bulk-loads a snapshot into the configured Qdrant backend without any embedding calls.
+    The collection is recreated, and the raw file is restored if the snapshot includes one.
+    """
+    with open(os.path.join(snapshot_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return {"status": "error", "message": f"Unsupported snapshot format: {manifest.get('format_version')}"}
+
+    # Vectors are only comparable with queries embedded by the same model
+    if manifest.get("embedding_model") != get_embedding_model_id() and not force:
+        return {
+            "status": "error",
+            "message": f"Snapshot was embedded with {manifest.get('embedding_model')}, "
+                       f"but {get_embedding_model_id()} is configured.",
+        }
+
+    service_name = service_name or manifest["service"]
+    renamed = service_name != manifest["service"]
+    collection_name = _sanitize_collection_name(service_name)
+
+    # Memory-map the vectors so large snapshots are streamed from disk
+    vectors = np.load(os.path.join(snapshot_dir, "vectors.npy"), mmap_mode="r")
+    ids = []
+    payloads = []
+    with open(os.path.join(snapshot_dir, "points.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            payload = record["payload"]
+            if renamed:
+                # Chunks name their service; under a new name they must point at the new one
+                payload.update(service=service_name, source=f"{service_name}.md")
+            ids.append(record["id"])
+            payloads.append(payload)
+
+    if len(ids) != vectors.shape[0]:
+        return {"status": "error", "message": f"Snapshot is inconsistent: {len(ids)} payloads, {vectors.shape[0]} vectors."}
+
+    logger.info(f"Importing {len(ids)} points into collection '{collection_name}'...")
+    client = get_qdrant_client()
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(size=int(vectors.shape[1]), distance=Distance.COSINE),
+    )
+
+    for i in range(0, len(ids), batch_size):
+        client.upload_collection(
+            collection_name=collection_name,
+            vectors=np.asarray(vectors[i : i + batch_size], dtype=np.float32),
+            payload=payloads[i : i + batch_size],
+            ids=ids[i : i + batch_size],
+            batch_size=batch_size,
+            wait=True,
+        )
+
+    raw_snapshot = os.path.join(snapshot_dir, "raw.md")
+    if os.path.exists(raw_snapshot):
+        shutil.copyfile(raw_snapshot, os.path.join(settings.RAW_DATA_DIR, f"{service_name}.md"))
+
+    _bump_index_generation(service_name)
+    logger.info(f"Imported {len(ids)} points for {service_name}.")
+    return {"status": "success", "service": service_name, "documents_indexed": len(ids)}
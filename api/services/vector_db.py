@@ -1,35 +1,144 @@
 import os
 import re
+import time
 import uuid
-from google import genai
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from api.core.config import settings
+from api.services.rate_limiter import AdaptiveRateLimiter
+from api.services.admission import AdmissionLimiter
+from api.services.llm import get_google_client
+from api.services.cache import catalog_cache, embedding_cache
+from api.services.singleflight import SingleFlight
+from api.services.cancellation import CancelScope, OperationCancelled
+from api.core.metrics import track_stage, STAGE_ITEMS
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Configure Google GenAI Client
-google_client = None
-if settings.GOOGLE_API_KEY:
-    google_client = genai.Client(api_key=settings.GOOGLE_API_KEY)
 
-# Initialize Qdrant Client
-# We assume the user has Qdrant running locally on Docker at the specified host/port
-client = QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
+# Qdrant client, created on first use so that importing this module (and starting the API)
+# does not import qdrant_client or need a reachable server.
+# We assume the user has Qdrant running locally on Docker at the specified host/port,
+# unless an embedded local store is configured.
+_client = None
+_client_lock = threading.Lock()
+
+def get_qdrant_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from qdrant_client import QdrantClient
+                if settings.QDRANT_LOCAL_PATH == ":memory:":
+                    _client = QdrantClient(location=":memory:")
+                elif settings.QDRANT_LOCAL_PATH:
+                    _client = QdrantClient(path=settings.QDRANT_LOCAL_PATH)
+                else:
+                    _client = QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
+    return _client
+
+# Shared limiter for all embedding calls (queries and indexing), adapting to 429/5xx feedback
+embedding_limiter = AdaptiveRateLimiter(
+    "embedding",
+    rate=settings.EMBEDDING_RATE_LIMIT,
+    max_rate=settings.EMBEDDING_MAX_RATE,
+    max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+    max_retries=settings.EMBEDDING_MAX_RETRIES,
+)
+
+def get_embedding_model_id() -> str:
+    """Identifies the vectors' embedding space; vectors from different models must not be mixed."""
+    if settings.EMBEDDING_BACKEND == "fake":
+        return f"fake-{settings.FAKE_EMBEDDING_DIMENSION}"
+    return settings.GEMINI_EMBEDDING_MODEL_ID
+
+def _embed_content(contents, interactive: bool = False):
+    if settings.EMBEDDING_BACKEND == "fake":
+        from api.services.fake_embeddings import fake_embeddings
+        with track_stage("embedding"):
+            vectors = fake_embeddings(contents, settings.FAKE_EMBEDDING_DIMENSION)
+        STAGE_ITEMS.inc(len(vectors), stage="embedding")
+        return vectors
 
-def get_embedding(text: str):
     # Using the new embedding model via google.genai SDK
     # ref: https://googleapis.github.io/python-genai/
+    google_client = get_google_client()
     if not google_client:
         raise ValueError("Google API Key not configured")
-        
-    result = google_client.models.embed_content(
-        model=settings.GEMINI_EMBEDDING_MODEL_ID,
-        contents=text,
-        config=None # Task type is handled differently or defaults are fine
-    )
-    return result.embeddings[0].values
+
+    # Includes time spent waiting for the rate limiter and on retries
+    with track_stage("embedding"):
+        result = embedding_limiter.call(
+            google_client.models.embed_content,
+            model=settings.GEMINI_EMBEDDING_MODEL_ID,
+            contents=contents,
+            config=None, # Task type is handled differently or defaults are fine
+            # Queries fail fast under overload; indexing batches wait as long as it takes
+            max_wait=settings.UPSTREAM_MAX_WAIT_SECONDS if interactive else None,
+            max_backlog=settings.UPSTREAM_MAX_QUEUE if interactive else None,
+        )
+    STAGE_ITEMS.inc(len(result.embeddings), stage="embedding")
+    return [e.values for e in result.embeddings]
+
+# Concurrent Qdrant searches; index upserts are already bounded by the index job workers
+qdrant_limiter = AdmissionLimiter(
+    "qdrant",
+    limit=settings.QDRANT_MAX_CONCURRENCY,
+    max_queue=settings.UPSTREAM_MAX_QUEUE,
+    max_wait=settings.UPSTREAM_MAX_WAIT_SECONDS,
+)
+
+# Identical texts embedded concurrently (e.g. the same question from several users) share one call
+embedding_flight = SingleFlight("embedding")
+
+def _embed_query(text: str):
+    if not settings.SINGLE_FLIGHT_ENABLED:
+        return _embed_content(text, interactive=True)[0]
+    return embedding_flight.do((get_embedding_model_id(), text), lambda: _embed_content(text, interactive=True)[0])
+
+def get_embedding(text: str):
+    """Embeds a query. Results are cached per model (EMBEDDING_CACHE_*), across workers with a shared cache backend."""
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return _embed_query(text)
+    key = hashlib.sha1(f"{get_embedding_model_id()}\n{text}".encode("utf-8")).hexdigest()
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+        embedding = [float(x) for x in _embed_query(text)]
+        embedding_cache.set(key, embedding)
+    return embedding
+
+def get_embeddings(texts: list[str], cancel: CancelScope = None, on_progress=None) -> list[list[float]]:
+    """
+    Embeds a list of texts in batches of EMBEDDING_BATCH_SIZE, running batches concurrently.
+    The shared limiter decides how many requests are actually in flight.
+    Raises if any batch still fails after retries, so no text is silently skipped.
+    With `cancel`, batches not yet sent are skipped once it is cancelled (OperationCancelled).
+    `on_progress(embedded, total)` is called as batches complete.
+    """
+    batch_size = settings.EMBEDDING_BATCH_SIZE
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    progress_lock = threading.Lock()
+    embedded = 0
+
+    def embed_batch(batch):
+        nonlocal embedded
+        if cancel:
+            cancel.check()
+        result = _embed_content(batch)
+        if on_progress:
+            with progress_lock:
+                embedded += len(batch)
+                on_progress(embedded, len(texts))
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=settings.EMBEDDING_MAX_CONCURRENCY)
+    try:
+        results = list(executor.map(embed_batch, batches))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return [emb for batch in results for emb in batch]
 
 def split_markdown_by_headers(markdown_text):
     """
@@ -78,9 +187,90 @@ def _sanitize_collection_name(name: str) -> str:
     # Qdrant collection names should be alphanumeric, underscores, or hyphens.
     return re.sub(r'[^a-zA-Z0-9_-]', '_', name)
 
-def build_service_index(service_name: str):
+def _generation_file(service_name: str) -> str:
+    return os.path.join(settings.VECTOR_DB_DIR, f"{_sanitize_collection_name(service_name)}.generation")
+
+def get_index_generation(service_name: str) -> str | None:
+    """
+    Returns the current build generation of a service index, or None if none has been recorded yet.
+    The generation changes on every rebuild or delete, so it can be used to scope caches.
+    """
+    return _read_generation(_generation_file(service_name))
+
+# Changes whenever any service index is built or deleted (a leading dot never clashes with a collection name)
+_CATALOG_GENERATION_FILE = ".catalog.generation"
+
+def _read_generation(path: str) -> str | None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _write_generation(path: str) -> str:
+    generation = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp_path, path)
+    return generation
+
+def get_catalog_generation() -> str | None:
+    """Returns a marker that changes whenever any service index is built or deleted."""
+    return _read_generation(os.path.join(settings.VECTOR_DB_DIR, _CATALOG_GENERATION_FILE))
+
+def _bump_index_generation(service_name: str) -> str:
+    generation = _write_generation(_generation_file(service_name))
+    _write_generation(os.path.join(settings.VECTOR_DB_DIR, _CATALOG_GENERATION_FILE))
+    logger.debug(f"Index generation for {service_name} is now {generation}")
+    return generation
+
+def chunk_raw_pages(content: str, service_name: str) -> list[dict]:
+    """
+    Splits a scraped raw file (pages delimited by START/END PAGE markers) into header-based chunks,
+    each with its page URL, topic context and the text to embed.
+    """
+    documents = []
+    
+    # Split by pages first
+    pages = content.split("--- START PAGE: ")
+    for page in pages:
+        if not page.strip(): continue
+        
+        # Extract URL
+        try:
+            url_end = page.find(" ---")
+            if url_end == -1: continue
+            url = page[:url_end].strip()
+            page_content = page[url_end+4:].split("--- END PAGE:")[0]
+            
+            # Hierarchical chunking
+            chunks = split_markdown_by_headers(page_content)
+            
+            for chunk in chunks:
+                # Combine context and text for embedding
+                full_text = f"Context: {chunk['context']}\nContent: {chunk['text']}"
+                # Limit chunk size (simple char limit for now)
+                if len(full_text) > 2000:
+                    full_text = full_text[:2000]
+                
+                documents.append({
+                    "source": f"{service_name}.md",
+                    "service": service_name,
+                    "url": url,
+                    "context": chunk['context'],
+                    "text": chunk['text'],
+                    "embedding_text": full_text
+                })
+        except Exception as e:
+            print(f"Error processing page in {service_name}: {e}")
+    return documents
+
+def build_service_index(service_name: str, cancel: CancelScope = None, on_progress=None):
     """
     Builds a Qdrant collection for a specific service.
+    If `cancel` fires while embedding, the build stops and the existing collection is left as is.
+    `on_progress(embedded, total)` reports embedding progress in chunks.
     """
     raw_file = os.path.join(settings.RAW_DATA_DIR, f"{service_name}.md")
     if not os.path.exists(raw_file):
@@ -89,72 +279,45 @@ def build_service_index(service_name: str):
     collection_name = _sanitize_collection_name(service_name)
     logger.info(f"Processing {service_name} into collection '{collection_name}'...")
     
-    documents = []
-    
     with open(raw_file, "r", encoding="utf-8") as f:
         content = f.read()
-        
-        # Split by pages first
-        pages = content.split("--- START PAGE: ")
-        for page in pages:
-            if not page.strip(): continue
-            
-            # Extract URL
-            try:
-                url_end = page.find(" ---")
-                if url_end == -1: continue
-                url = page[:url_end].strip()
-                page_content = page[url_end+4:].split("--- END PAGE:")[0]
-                
-                # Hierarchical chunking
-                chunks = split_markdown_by_headers(page_content)
-                
-                for chunk in chunks:
-                    # Combine context and text for embedding
-                    full_text = f"Context: {chunk['context']}\nContent: {chunk['text']}"
-                    # Limit chunk size (simple char limit for now)
-                    if len(full_text) > 2000:
-                        full_text = full_text[:2000]
-                    
-                    documents.append({
-                        "source": f"{service_name}.md",
-                        "service": service_name,
-                        "url": url,
-                        "context": chunk['context'],
-                        "text": chunk['text'],
-                        "embedding_text": full_text
-                    })
-            except Exception as e:
-                print(f"Error processing page in {service_name}: {e}")
+    documents = chunk_raw_pages(content, service_name)
 
     if not documents:
         return {"status": "no documents found"}
 
+    from qdrant_client.models import Distance, VectorParams, PointStruct
+    client = get_qdrant_client()
+
     # Generate embeddings
     points = []
     
     print(f"Generating embeddings for {len(documents)} chunks...")
     logger.info(f"Generating embeddings for {len(documents)} chunks...")
-    for i, doc in enumerate(documents):
-        try:
-            emb = get_embedding(doc["embedding_text"])
-            
-            # Create Qdrant Point
-            point_id = str(uuid.uuid4())
-            payload = {
-                "source": doc["source"],
-                "service": doc["service"],
-                "url": doc["url"],
-                "context": doc["context"],
-                "text": doc["text"]
-            }
-            
-            points.append(PointStruct(id=point_id, vector=emb, payload=payload))
-            
-            if i % 10 == 0:
-                logger.debug(f"Embedded {i}/{len(documents)}")
-        except Exception as e:
-            logger.error(f"Error embedding chunk: {e}")
+    try:
+        embeddings = get_embeddings([doc["embedding_text"] for doc in documents], cancel=cancel, on_progress=on_progress)
+    except OperationCancelled as e:
+        logger.info(f"Indexing {service_name} stopped: {e}")
+        return {"status": "cancelled", "message": str(e)}
+    except Exception as e:
+        # Keep the existing collection intact rather than indexing a partial set of chunks
+        logger.error(f"Error embedding chunks for {service_name}: {e}")
+        return {"status": "error", "message": f"Failed to generate embeddings: {e}"}
+
+    for doc, emb in zip(documents, embeddings):
+        # Create Qdrant Point
+        point_id = str(uuid.uuid4())
+        payload = {
+            "source": doc["source"],
+            "service": doc["service"],
+            "url": doc["url"],
+            "context": doc["context"],
+            "text": doc["text"]
+        }
+        
+        points.append(PointStruct(id=point_id, vector=emb, payload=payload))
+
+    logger.debug(f"Embedded {len(points)}/{len(documents)} (limiter: {embedding_limiter.stats()})")
 
     if not points:
          return {"status": "failed to generate embeddings"}
@@ -177,22 +340,36 @@ def build_service_index(service_name: str):
         batch = points[i : i + batch_size]
         logger.info(f"Upserting batch {i//batch_size + 1}/{(total_points + batch_size - 1)//batch_size} ({len(batch)} points)...")
         try:
-            client.upsert(
-                collection_name=collection_name,
-                points=batch
-            )
+            with track_stage("index_upsert"):
+                client.upsert(
+                    collection_name=collection_name,
+                    points=batch
+                )
+            STAGE_ITEMS.inc(len(batch), stage="index_upsert")
         except Exception as e:
             logger.error(f"Failed to upsert batch starting at {i}: {e}")
             # Optionally retry or re-raise? For now, we log and continue/raise
             raise e
     
+    _bump_index_generation(service_name)
     return {"status": "success", "documents_indexed": len(points)}
 
 def list_service_headers(service_name: str) -> list[str]:
     """
     Returns a unique list of 'context' paths available for a service.
+    Results are cached until the service index is rebuilt or deleted.
     """
+    cache_key = f"headers:{service_name}:{get_index_generation(service_name)}"
+    headers = catalog_cache.get(cache_key)
+    if headers is None:
+        headers = _scroll_service_headers(service_name)
+        if headers:
+            catalog_cache.set(cache_key, headers)
+    return headers
+
+def _scroll_service_headers(service_name: str) -> list[str]:
     collection_name = _sanitize_collection_name(service_name)
+    client = get_qdrant_client()
     
     try:
         # Check if collection exists first
@@ -210,8 +387,8 @@ def list_service_headers(service_name: str) -> list[str]:
         points, next_offset = client.scroll(
             collection_name=collection_name,
             scroll_filter=None,
-            limit=100,
-            with_payload=True,
+            limit=1000,
+            with_payload=["context"], # Only the field we need
             with_vectors=False,
             offset=offset
         )
@@ -226,10 +403,24 @@ def list_service_headers(service_name: str) -> list[str]:
             
     return sorted(list(contexts))
 
-def search_service_index(service_name: str, query: str, k: int = 5, path_filters: list[str] = None):
+def _expand_path_filters(service_name: str, path_filters: list[str]) -> list[str]:
     """
-    Searches the service index, optionally filtering by path contexts.
+    Expands each topic path to itself and every header below it, so filtering on an
+    intermediate path like "S3 > Features" keeps the chunks of its subtopics.
+    """
+    headers = list_service_headers(service_name)
+    contexts = set(path_filters)
+    for pf in path_filters:
+        contexts.update(h for h in headers if h.startswith(pf + " > "))
+    return sorted(contexts)
+
+def search_service_index(service_name: str, query: str, k: int = 5, path_filters: list[str] = None, query_embedding: list[float] = None):
     """
+    Searches the service index, optionally filtering by topic paths (a path matches its subtopics too).
+    A precomputed `query_embedding` can be passed to skip embedding the query again.
+    """
+    from qdrant_client.models import Filter, FieldCondition, MatchAny
+    client = get_qdrant_client()
     collection_name = _sanitize_collection_name(service_name)
     
     try:
@@ -237,34 +428,27 @@ def search_service_index(service_name: str, query: str, k: int = 5, path_filters
     except Exception:
         return []
         
-    query_emb = get_embedding(query)
-    logger.debug(f"Generated embedding for query '{query}'")
+    query_emb = query_embedding
+    if query_emb is None:
+        query_emb = get_embedding(query)
+        logger.debug(f"Generated embedding for query '{query}'")
     
     # Construct Filter
     query_filter = None
     if path_filters:
-        # We want to match if ANY of the path_filters match the context.
-        # Qdrant 'match' - 'text' check keywords. 'match' - 'value' checks exact match.
-        # If we want "contains", we might need full text index on payload or use regex (slow).
-        # For now, let's assume 'context' field in payload is not indexed for text search by default unless configured.
-        # But we can assume exact match or simple match.
-        # Let's try simple match for now. If path_filters are "S3 > Features", we check if context == "S3 > Features".
-        # If we want substring, we'd need to iterate or use specific Qdrant features.
-        
-        should_conditions = []
-        for pf in path_filters:
-            # MatchValue checks for equality. 
-            should_conditions.append(FieldCondition(key="context", match=MatchValue(value=pf)))
-            
-        query_filter = Filter(should=should_conditions)
+        # 'context' holds the full header path of a chunk, so a prefix is matched through the
+        # (cached) list of headers that start with it
+        contexts = _expand_path_filters(service_name, path_filters)
+        query_filter = Filter(must=[FieldCondition(key="context", match=MatchAny(any=contexts))])
 
-    search_result = client.query_points(
-        collection_name=collection_name,
-        query=query_emb,
-        query_filter=query_filter,
-        limit=k,
-        with_payload=True
-    ).points
+    with qdrant_limiter.slot(), track_stage("search"):
+        search_result = client.query_points(
+            collection_name=collection_name,
+            query=query_emb,
+            query_filter=query_filter,
+            limit=k,
+            with_payload=True
+        ).points
     
     results = []
     for scored_point in search_result:
@@ -281,13 +465,20 @@ def search_service_index(service_name: str, query: str, k: int = 5, path_filters
 def list_available_services() -> list[str]:
     """
     Lists all available services (collections) in Qdrant.
+    Results are cached until any service index is built or deleted.
     """
+    cache_key = f"services:{get_catalog_generation()}"
+    services = catalog_cache.get(cache_key)
+    if services is not None:
+        return services
     try:
-        collections_response = client.get_collections()
+        collections_response = get_qdrant_client().get_collections()
         # Filter mostly to standard service names (optional)
-        return [c.name for c in collections_response.collections]
+        services = [c.name for c in collections_response.collections]
     except Exception:
         return []
+    catalog_cache.set(cache_key, services)
+    return services
 
 def delete_service_index(service_name: str) -> dict:
     """
@@ -298,6 +489,7 @@ def delete_service_index(service_name: str) -> dict:
     
     # 1. Delete Qdrant Collection
     try:
+        client = get_qdrant_client()
         if client.collection_exists(collection_name):
             client.delete_collection(collection_name)
             logger.info(f"Deleted collection: {collection_name}")
@@ -308,6 +500,12 @@ def delete_service_index(service_name: str) -> dict:
         logger.error(f"Error deleting collection {collection_name}: {e}")
         results["errors"] = results.get("errors", []) + [f"Vector DB error: {str(e)}"]
 
+    # Invalidate anything cached against the previous index
+    try:
+        _bump_index_generation(service_name)
+    except Exception as e:
+        logger.error(f"Error updating index generation for {service_name}: {e}")
+
     # 2. Delete Raw File
     try:
         raw_file = os.path.join(settings.RAW_DATA_DIR, f"{service_name}.md")
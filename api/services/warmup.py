@@ -0,0 +1,106 @@
+import time
+import asyncio
+import importlib
+from api.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Modules that are imported lazily (on the first request that needs them) and are
+# preloaded here in the background instead, so no request pays their import time
+PRELOAD_MODULES = [
+    "api.services.agent",  # strands
+    "api.services.scraper",  # bs4, markdownify
+    "qdrant_client",
+    "google.genai",
+    "langfuse",
+]
+
+
+def _preload_modules():
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+
+def _load_tokenizer():
+    # The first load downloads the tokenizer model; without this, the first /ask would wait for it
+    from api.services.prompt import warm_up_tokenizer
+    return None if warm_up_tokenizer() else False
+
+
+def _check_qdrant():
+    from api.services.vector_db import get_qdrant_client
+    get_qdrant_client().get_collections()
+
+
+class WarmUp:
+    """
+    Background start-up work: preloading slow modules and the prompt tokenizer, connecting to
+    Qdrant and opening the Gemini connections. The API accepts requests while this runs;
+    /ready reports its state.
+
+    Each component is "pending", "running", "ready", "skipped" (not configured) or "failed";
+    failed components are retried every WARMUP_RETRY_SECONDS until they succeed.
+    """
+
+    def __init__(self):
+        self.started_at = None
+        self.components = {
+            name: {"status": "pending", "duration_ms": None, "error": None}
+            for name in ("modules", "tokenizer", "qdrant", "gemini")
+        }
+
+    async def _run_component(self, name: str, step):
+        component = self.components[name]
+        component.update(status="running", error=None)
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(step(), timeout=settings.WARMUP_TIMEOUT_SECONDS)
+            component["status"] = "skipped" if result is False else "ready"
+        except Exception as e:
+            component.update(status="failed", error=str(e) or type(e).__name__)
+            logger.warning(f"Warm-up of {name} failed: {component['error']}")
+        component["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    async def _warm_gemini(self):
+        from api.services.llm import warm_up
+        if not settings.GOOGLE_API_KEY:
+            return False
+        if not await warm_up():
+            raise RuntimeError("Gemini API not reachable")
+
+    async def run(self):
+        self.started_at = time.time()
+        steps = {
+            "modules": lambda: asyncio.to_thread(_preload_modules),
+            # "skipped" when the tokenizer is unavailable and token counts are estimated
+            "tokenizer": lambda: asyncio.to_thread(_load_tokenizer),
+            "qdrant": lambda: asyncio.to_thread(_check_qdrant),
+            "gemini": self._warm_gemini,
+        }
+        while True:
+            pending = [name for name, c in self.components.items() if c["status"] in ("pending", "failed")]
+            if not pending:
+                break
+            # The module preload runs first: the other steps import some of the same modules
+            if "modules" in pending:
+                await self._run_component("modules", steps["modules"])
+                pending.remove("modules")
+            await asyncio.gather(*(self._run_component(name, steps[name]) for name in pending))
+            if any(c["status"] == "failed" for c in self.components.values()):
+                await asyncio.sleep(settings.WARMUP_RETRY_SECONDS)
+        logger.info(f"Warm-up complete in {time.time() - self.started_at:.2f}s")
+
+    @property
+    def ready(self) -> bool:
+        return all(c["status"] in ("ready", "skipped") for c in self.components.values())
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "started_at": self.started_at,
+            "components": {name: dict(c) for name, c in self.components.items()},
+        }
+
+
+warmup = WarmUp()
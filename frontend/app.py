@@ -1,9 +1,17 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 
 API_URL = "http://localhost:8000"
+# Service lists are cached between reruns; scraping or deleting a service clears the indexed list
+# at once, so the TTLs only cover changes made outside this UI
+SERVICES_CACHE_TTL_SECONDS = 60
+AVAILABLE_SERVICES_CACHE_TTL_SECONDS = 3600
+# The job list is cached too, so idle reruns do not hit the API; "Refresh Jobs" fetches it at once
+JOBS_CACHE_TTL_SECONDS = 10
+HTTP_POOL_SIZE = 4 # Connections kept open to the API per browser session
 
 st.set_page_config(page_title="AWS Doc Agent", page_icon="🤖", layout="wide")
 
@@ -20,14 +28,56 @@ with st.sidebar:
         st.session_state.api_url = api_url_input
 
 # --- Helper Functions ---
+def api_error_message(response):
+    """Error text for a failed API call; 429/503 mean the server is busy and say when to retry."""
+    if response.status_code in (429, 503) and "Retry-After" in response.headers:
+        return f"The server is busy. Please try again in {response.headers['Retry-After']} s."
+    return f"API Error: {response.status_code} - {response.text}"
+
+def get_http_session():
+    """
+    One pooled HTTP session per browser session, reused across its reruns so API connections stay open.
+    Not shared between browser sessions: their scripts run in separate threads and requests.Session is not thread-safe.
+    """
+    if "http_session" not in st.session_state:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        st.session_state.http_session = session
+    return st.session_state.http_session
+
+@st.cache_data(ttl=SERVICES_CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_services(api_url):
+    # Failures raise, and exceptions are not cached
+    response = get_http_session().get(f"{api_url}/services")
+    response.raise_for_status()
+    return response.json().get("services", [])
+
+@st.cache_data(ttl=AVAILABLE_SERVICES_CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_scrapeable_services(api_url):
+    response = get_http_session().get(f"{api_url}/services/available")
+    response.raise_for_status()
+    return response.json().get("services", [])
+
+@st.cache_data(ttl=JOBS_CACHE_TTL_SECONDS, show_spinner=False)
+def fetch_jobs(api_url):
+    response = get_http_session().get(f"{api_url}/jobs")
+    response.raise_for_status()
+    return response.json().get("jobs", [])
+
+def invalidate_service_lists():
+    """Called after a scrape or delete, so the next rerun fetches the changed lists."""
+    # The scrapeable services come from the AWS sitemap index, which scraping does not change
+    fetch_services.clear()
+    fetch_jobs.clear()
+
 def get_services():
     try:
-        response = requests.get(f"{st.session_state.api_url}/services")
-        if response.status_code == 200:
-            return response.json().get("services", [])
-        else:
-            st.error(f"Failed to fetch services: {response.text}")
-            return []
+        return fetch_services(st.session_state.api_url)
+    except requests.HTTPError as e:
+        st.error(f"Failed to fetch services: {e.response.text}")
+        return []
     except Exception as e:
         st.error(f"Connection error: {e}")
         return []
@@ -35,13 +85,48 @@ def get_services():
 def scrape_service(service_name, limit=None):
     payload = {"services": [service_name], "limit": limit}
     try:
-        response = requests.post(f"{st.session_state.api_url}/scrape", json=payload)
+        response = get_http_session().post(f"{st.session_state.api_url}/scrape", json=payload)
+        invalidate_service_lists()
         return response
     except Exception as e:
         return e
 
 def clear_chat_history():
     st.session_state.messages = []
+    # A new service starts a new server-side conversation
+    st.session_state.pop("chat_session_id", None)
+
+def iter_sse_events(response):
+    """Yields (event_type, data) pairs from a Server-Sent Events response."""
+    event_type, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            # A blank line ends the event
+            if data_lines:
+                try:
+                    yield event_type, json.loads("\n".join(data_lines))
+                except json.JSONDecodeError as e:
+                    print(f"Error parsing event: {e}")
+            event_type, data_lines = "message", []
+        elif line.startswith("event:"):
+            event_type = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].lstrip())
+
+def render_sources(container, sources):
+    if not sources:
+        return
+    with container.expander(f"Sources ({len(sources)})", expanded=False):
+        for source in sources:
+            label = source.get("context") or source["url"]
+            st.markdown(f"- [{label}]({source['url']}) · score {source.get('score', 0):.2f}")
+
+def render_stats(container, stats):
+    # Server-side breakdown from the final `stats` event (embed, search, prompt tokens, ttft, gen, tool calls)
+    if not stats:
+        return
+    with container.expander("Debug: request timings", expanded=False):
+        st.json(stats)
 
 # --- UI Layout ---
 tab_chat, tab_agent, tab_kb = st.tabs(["💬 Chat (RAG)", "🕵️ Agent Search", "📚 Knowledge Base"])
@@ -62,6 +147,7 @@ with tab_agent:
                 with st.expander("Reasoning Steps", expanded=False):
                     for step in message["reasoning"]:
                         st.markdown(step)
+            render_stats(st.container(), message.get("stats"))
 
     if query := st.chat_input("Find info about S3 and Lambda integration", key="agent_input"):
         st.session_state.agent_messages.append({"role": "user", "content": query})
@@ -72,14 +158,17 @@ with tab_agent:
             message_placeholder = st.empty()
             reasoning_steps = []
             full_response = ""
+            run_stats = None
             
             # Status container for live reasoning
             status_container = st.status("Thinking...", expanded=True)
             
             try:
-                payload = {"query": query, "stream": True}
-                with requests.post(f"{st.session_state.api_url}/agent", json=payload, stream=True) as response:
+                agent_session_id = st.session_state.get("agent_session_id")
+                payload = {"query": query, "stream": True, "session_id": agent_session_id, "new_session": agent_session_id is None}
+                with get_http_session().post(f"{st.session_state.api_url}/agent", json=payload, stream=True) as response:
                     if response.status_code == 200:
+                        st.session_state.agent_session_id = response.headers.get("X-Session-Id")
                         for line in response.iter_lines():
                             if line:
                                 try:
@@ -93,6 +182,9 @@ with tab_agent:
                                     elif event["type"] == "answer":
                                         full_response += event["content"]
                                         message_placeholder.markdown(full_response + "▌")
+
+                                    elif event["type"] == "stats":
+                                        run_stats = event["content"]
                                         
                                 except Exception as e:
                                     print(f"Error parsing line: {e}")
@@ -100,7 +192,7 @@ with tab_agent:
                         message_placeholder.markdown(full_response)
                         status_container.update(label="Finished", state="complete", expanded=False)
                     else:
-                         st.error(f"API Error: {response.status_code}")
+                         st.error(api_error_message(response))
                          full_response = "Error."
                          
             except Exception as e:
@@ -111,7 +203,8 @@ with tab_agent:
             st.session_state.agent_messages.append({
                 "role": "assistant", 
                 "content": full_response,
-                "reasoning": reasoning_steps
+                "reasoning": reasoning_steps,
+                "stats": run_stats
             })
             st.rerun()
 
@@ -139,6 +232,9 @@ with tab_chat:
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("sources"):
+                render_sources(st.container(), message["sources"])
+            render_stats(st.container(), message.get("stats"))
 
     # Chat Input
     if prompt := st.chat_input("How do I configure bucket logging?"):
@@ -153,35 +249,46 @@ with tab_chat:
                 st.error("Please select a valid service first. Go to 'Knowledge Base' to add services.")
             else:
                 message_placeholder = st.empty()
+                sources_placeholder = st.empty()
                 full_response = ""
+                sources = []
+                answer_stats = None
                 
                 try:
                     # RAG Request to /ask
-                    # Exclude the last message (current prompt) from history to avoid duplication in context
-                    history = st.session_state.messages[:-1]
-                    
+                    # The server keeps the conversation history; only the new question is sent
                     payload = {
                         "question": prompt,
                         "service_name": selected_service,
                         "stream": True,
-                        "history": history
+                        "session_id": st.session_state.get("chat_session_id"),
+                        # The first turn asks the server to start the conversation
+                        "new_session": st.session_state.get("chat_session_id") is None
                     }
                     
-                    with requests.post(
+                    with get_http_session().post(
                         f"{st.session_state.api_url}/ask", 
                         json=payload, 
                         stream=True
                     ) as response:
                         if response.status_code == 200:
-                            for chunk in response.iter_content(chunk_size=None):
-                                if chunk:
-                                    chunk_text = chunk.decode("utf-8")
-                                    full_response += chunk_text
+                            st.session_state.chat_session_id = response.headers.get("X-Session-Id")
+                            # Server-Sent Events: `sources` first, then `token` deltas, then `stats`
+                            for event_type, data in iter_sse_events(response):
+                                if event_type == "sources":
+                                    sources = data
+                                    render_sources(sources_placeholder, sources)
+                                elif event_type == "token":
+                                    full_response += data
                                     message_placeholder.markdown(full_response + "▌")
+                                elif event_type == "stats":
+                                    answer_stats = data
+                                elif event_type == "error":
+                                    st.error(data)
                             
                             message_placeholder.markdown(full_response)
                         else:
-                            st.error(f"API Error: {response.status_code} - {response.text}")
+                            st.error(api_error_message(response))
                             full_response = "Error generating response."
                             
                 except Exception as e:
@@ -189,18 +296,19 @@ with tab_chat:
                     full_response = f"Error: {e}"
 
                 # Add assistant response to chat history
-                st.session_state.messages.append({"role": "assistant", "content": full_response})
+                st.session_state.messages.append({"role": "assistant", "content": full_response, "sources": sources, "stats": answer_stats})
                 st.rerun()
 
 # --- Helper Functions ---
 def get_scrapeable_services():
     try:
-        response = requests.get(f"{st.session_state.api_url}/services/available")
-        if response.status_code == 200:
-            return response.json().get("services", [])
-        return []
+        services = fetch_scrapeable_services(st.session_state.api_url)
     except Exception:
         return []
+    if not services:
+        # The API returns an empty list when the AWS sitemap could not be fetched; ask again next time
+        fetch_scrapeable_services.clear()
+    return services
 
 # ... (existing functions) ...
 
@@ -243,9 +351,11 @@ with tab_kb:
                 }
                 
                 # Stream the response
-                with requests.post(f"{st.session_state.api_url}/scrape", json=payload, stream=True) as response:
+                with get_http_session().post(f"{st.session_state.api_url}/scrape", json=payload, stream=True) as response:
                     if response.status_code == 200:
-                        status_container.write("Connected to scraper...")
+                        # The scrape runs as a background job; leaving the page does not stop it
+                        job_ids = response.headers.get("X-Job-Ids", "")
+                        status_container.write(f"Connected to scrape job {job_ids}...")
                         
                         for line in response.iter_lines():
                             if not line: continue
@@ -267,6 +377,13 @@ with tab_kb:
                                         progress_bar.progress(min(current / total, 1.0))
                                     log_area.caption(f"{msg} ({current}/{total})")
                                     
+                                elif type_ == "index_progress":
+                                    current = event.get("current", 0)
+                                    total = event.get("total", 1)
+                                    if total > 0:
+                                        progress_bar.progress(min(current / total, 1.0))
+                                    log_area.caption(f"Embedding {event.get('service')} ({current}/{total} chunks)")
+                                    
                                 elif type_ == "index_result":
                                     status_container.write("✅ Indexing Complete")
                                     st.json(event.get("stats"))
@@ -275,9 +392,13 @@ with tab_kb:
                                     status_container.error(event.get("message"))
                                     st.error(event.get("message"))
                                     
+                                elif type_ == "cancelled":
+                                    status_container.warning(event.get("message"))
+                                    
                             except Exception as e:
                                 print(f"Error parse: {e}")
                         
+                        invalidate_service_lists()
                         progress_bar.progress(100)
                         status_container.update(label="Process Complete", state="complete", expanded=False)
                         time.sleep(1)
@@ -290,9 +411,33 @@ with tab_kb:
                     st.error(f"Error: {e}")
                     status_container.update(label="Error", state="error")
 
+    with st.expander("Scrape Jobs", expanded=False):
+        if st.button("Refresh Jobs"):
+            fetch_jobs.clear()
+        try:
+            jobs = fetch_jobs(st.session_state.api_url)
+        except requests.HTTPError:
+            jobs = []
+        except Exception as e:
+            jobs = []
+            st.error(f"Connection error: {e}")
+        if not jobs:
+            st.caption("No scrape jobs yet.")
+        for job in jobs[:10]:
+            job_col1, job_col2 = st.columns([4, 1])
+            progress = job.get("progress") or {}
+            progress_text = f" ({progress.get('current')}/{progress.get('total')} pages)" if progress else ""
+            job_col1.write(f"**{job['service']}** · {job['status']}{progress_text} · `{job['id'][:8]}`")
+            if job["status"] in ("queued", "scraping", "scraped", "indexing"):
+                if job_col2.button("Cancel", key=f"cancel_job_{job['id']}"):
+                    get_http_session().delete(f"{st.session_state.api_url}/jobs/{job['id']}")
+                    fetch_jobs.clear()
+                    st.rerun()
+
     st.divider()
     st.subheader("Indexed Services")
     if st.button("Refresh List"):
+        invalidate_service_lists()
         st.rerun()
     
     # List indexed services
@@ -304,8 +449,9 @@ with tab_kb:
         with col_del:
             if st.button("🗑️ Delete", key=f"del_{service}"):
                     with st.spinner(f"Deleting {service}..."):
-                        del_resp = requests.delete(f"{st.session_state.api_url}/services/{service}")
+                        del_resp = get_http_session().delete(f"{st.session_state.api_url}/services/{service}")
                         if del_resp.status_code == 200:
+                            invalidate_service_lists()
                             st.success(f"Deleted {service}")
                             st.rerun()
                         else:
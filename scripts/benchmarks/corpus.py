@@ -0,0 +1,69 @@
+import random
+
+# Synthetic AWS-documentation-like pages, in the raw format the scraper writes
+# (`--- START PAGE: <url> ---` ... `--- END PAGE: <url> ---`). Deterministic for a given seed.
+
+TOPICS = [
+    "buckets", "objects", "versioning", "lifecycle rules", "replication", "access points", "encryption",
+    "bucket policies", "access control lists", "event notifications", "inventory", "storage classes",
+    "multipart uploads", "presigned URLs", "logging", "metrics", "batch operations", "object lock",
+    "functions", "layers", "aliases", "concurrency", "event source mappings", "environment variables",
+    "VPC endpoints", "security groups", "IAM roles", "KMS keys", "CloudWatch alarms", "quotas",
+]
+ACTIONS = ["Configuring", "Creating", "Managing", "Monitoring", "Troubleshooting", "Deleting", "Securing", "Using"]
+VOCABULARY = (
+    "request response region account resource policy permission principal role user console cli api sdk "
+    "endpoint latency throughput durability availability retention prefix key value tag metadata header "
+    "checksum upload download transfer acceleration throttling limit retry timeout error status code "
+    "configuration setting parameter template stack deployment version snapshot backup restore archive "
+    "network subnet gateway route table firewall certificate token credential session audit trail log"
+).split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return " ".join(_sentence(rng, rng.randint(8, 18)) for _ in range(sentences))
+
+
+def generate_page(rng: random.Random, service: str, index: int, sections: int, paragraphs: int) -> tuple[str, str, list[str]]:
+    """Returns (url, markdown, section titles) for one page."""
+    topic = rng.choice(TOPICS)
+    title = f"{rng.choice(ACTIONS)} {topic}"
+    url = f"https://docs.aws.amazon.com/{service}/latest/userguide/page-{index}.html"
+    lines = [f"# {title}", "", _paragraph(rng, 2), ""]
+    section_titles = []
+    for s in range(sections):
+        section = f"{rng.choice(ACTIONS)} {rng.choice(TOPICS)}"
+        section_titles.append(f"{title} > {section}")
+        lines += [f"## {section}", ""]
+        for _ in range(paragraphs):
+            lines += [_paragraph(rng, rng.randint(2, 5)), ""]
+        if s % 2 == 0:
+            lines += [f"### Example: {section}", "", "```", f"aws {service.lower()} {topic.replace(' ', '-')} --region us-east-1", "```", ""]
+    return url, "\n".join(lines), section_titles
+
+
+def generate_raw_corpus(service: str, pages: int, sections: int = 6, paragraphs: int = 3, seed: int = 42) -> tuple[str, list[str]]:
+    """Returns (raw file content, section titles) for `pages` synthetic pages."""
+    rng = random.Random(seed)
+    blocks = []
+    titles = []
+    for i in range(pages):
+        url, content, section_titles = generate_page(rng, service, i, sections, paragraphs)
+        blocks.append(f"--- START PAGE: {url} ---\n{content}\n--- END PAGE: {url} ---\n\n")
+        titles.extend(section_titles)
+    return "".join(blocks), titles
+
+
+def generate_queries(titles: list[str], count: int, seed: int = 7) -> list[str]:
+    """Questions built from section titles plus a few vocabulary words, so some match strongly and some weakly."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        section = rng.choice(titles).split(" > ")[-1].lower()
+        queries.append(f"How do I handle {section} with {rng.choice(VOCABULARY)} and {rng.choice(VOCABULARY)}?")
+    return queries
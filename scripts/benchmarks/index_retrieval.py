@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import platform
+import tempfile
+import subprocess
+
+# Offline benchmark for chunking, indexing (embed + upsert) and search. Runs with no network:
+# embeddings come from the deterministic fake backend and Qdrant runs embedded (in memory or on disk).
+
+SERVICE = "BenchService"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline indexing and retrieval benchmark (fake embedder, embedded Qdrant).")
+    parser.add_argument("--pages", type=int, default=200, help="Synthetic pages in the corpus")
+    parser.add_argument("--sections", type=int, default=6, help="Sections per page")
+    parser.add_argument("--paragraphs", type=int, default=3, help="Paragraphs per section")
+    parser.add_argument("--queries", type=int, default=200, help="Search queries to time")
+    parser.add_argument("--k", type=int, default=5, help="Results per search")
+    parser.add_argument("--dimension", type=int, default=768, help="Fake embedding dimension")
+    parser.add_argument("--backend", choices=["memory", "disk"], default="memory", help="Embedded Qdrant storage")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON results file (default: data/benchmarks/index_retrieval-<time>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    return parser.parse_args()
+
+def configure_environment(args, workdir: str):
+    # Must run before anything from `api` is imported: settings are read at import time
+    os.environ.update({
+        "DATA_DIR": os.path.join(workdir, "data"),
+        "QDRANT_LOCAL_PATH": ":memory:" if args.backend == "memory" else os.path.join(workdir, "qdrant"),
+        "EMBEDDING_BACKEND": "fake",
+        "FAKE_EMBEDDING_DIMENSION": str(args.dimension),
+        # Time the search path itself, not the caches in front of it
+        "RETRIEVAL_CACHE_ENABLED": "false",
+        "EMBEDDING_CACHE_ENABLED": "false",
+        "CACHE_BACKEND": "memory",
+        "SINGLE_FLIGHT_ENABLED": "false",
+    })
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024, 1)
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def latency_summary(seconds: list[float]) -> dict:
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p90_ms": round(percentile(ms, 90), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3),
+    }
+
+def stage_seconds(stage: str) -> float:
+    from api.core.metrics import STAGE_SECONDS
+    for name, labels, value in STAGE_SECONDS.samples():
+        if name.endswith("_sum") and labels.get("stage") == stage:
+            return value
+    return 0.0
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run(args) -> dict:
+    from corpus import generate_raw_corpus, generate_queries
+    from api.core.config import settings
+    from api.services.vector_db import chunk_raw_pages, build_service_index, search_service_index, get_embedding
+
+    results = {"config": vars(args).copy(), "git_commit": git_commit(), "python": platform.python_version()}
+    results["config"].pop("output", None)
+    results["config"].pop("compare", None)
+
+    # Corpus
+    raw, titles = generate_raw_corpus(SERVICE, args.pages, args.sections, args.paragraphs, seed=args.seed)
+    with open(os.path.join(settings.RAW_DATA_DIR, f"{SERVICE}.md"), "w", encoding="utf-8") as f:
+        f.write(raw)
+    results["corpus"] = {"pages": args.pages, "bytes": len(raw.encode("utf-8"))}
+
+    # Chunking (the same parser build_service_index uses)
+    start = time.perf_counter()
+    documents = chunk_raw_pages(raw, SERVICE)
+    chunk_seconds = time.perf_counter() - start
+    results["corpus"]["chunks"] = len(documents)
+    results["chunking"] = {
+        "seconds": round(chunk_seconds, 4),
+        "chunks_per_second": round(len(documents) / chunk_seconds, 1),
+        "mb_per_second": round(len(raw.encode("utf-8")) / chunk_seconds / 1e6, 2),
+    }
+    print(f"Chunked {args.pages} pages into {len(documents)} chunks in {chunk_seconds:.3f}s")
+
+    # Embed + upsert, through the real build path
+    start = time.perf_counter()
+    stats = build_service_index(SERVICE)
+    build_seconds = time.perf_counter() - start
+    if stats.get("status") != "success":
+        raise RuntimeError(f"Index build failed: {stats}")
+    embed_seconds = stage_seconds("embedding")
+    upsert_seconds = stage_seconds("index_upsert")
+    results["indexing"] = {
+        "seconds": round(build_seconds, 3),
+        "chunks_per_second": round(len(documents) / build_seconds, 1),
+        # Embedding runs on several threads, so its summed time can exceed the wall-clock time
+        "embedding_seconds_summed": round(embed_seconds, 3),
+        "upsert_seconds": round(upsert_seconds, 3),
+        "upsert_points_per_second": round(len(documents) / upsert_seconds, 1) if upsert_seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"Indexed {len(documents)} chunks in {build_seconds:.2f}s ({results['indexing']['chunks_per_second']} chunks/s)")
+
+    # Search: end to end (query embedding + Qdrant) and Qdrant alone (precomputed embedding)
+    queries = generate_queries(titles, args.queries, seed=args.seed)
+    embeddings = [get_embedding(q) for q in queries]
+    for query, embedding in zip(queries[:10], embeddings[:10]):
+        search_service_index(SERVICE, query, k=args.k, query_embedding=embedding)  # warm-up
+
+    end_to_end = []
+    for query in queries:
+        start = time.perf_counter()
+        search_service_index(SERVICE, query, k=args.k)
+        end_to_end.append(time.perf_counter() - start)
+
+    qdrant_only = []
+    for query, embedding in zip(queries, embeddings):
+        start = time.perf_counter()
+        search_service_index(SERVICE, query, k=args.k, query_embedding=embedding)
+        qdrant_only.append(time.perf_counter() - start)
+
+    results["search"] = {"end_to_end": latency_summary(end_to_end), "precomputed_embedding": latency_summary(qdrant_only)}
+    results["peak_rss_mb"] = peak_rss_mb()
+    print(f"Search p50 {results['search']['end_to_end']['p50_ms']} ms, p99 {results['search']['end_to_end']['p99_ms']} ms")
+    return results
+
+# (section, key, higher is better) for --compare
+COMPARED_METRICS = [
+    ("chunking", "chunks_per_second", True),
+    ("indexing", "chunks_per_second", True),
+    ("indexing", "upsert_points_per_second", True),
+    ("search.end_to_end", "p50_ms", False),
+    ("search.end_to_end", "p99_ms", False),
+    ("search.precomputed_embedding", "p50_ms", False),
+    ("search.precomputed_embedding", "p99_ms", False),
+    ("", "peak_rss_mb", False),
+]
+
+def lookup(results: dict, section: str):
+    for part in filter(None, section.split(".")):
+        results = results.get(part, {})
+    return results
+
+def compare(baseline: dict, current: dict):
+    if baseline.get("config") != current.get("config"):
+        print("Warning: the baseline was run with a different configuration.")
+    print(f"{'metric':45} {'baseline':>12} {'current':>12} {'change':>9}")
+    for section, key, higher_is_better in COMPARED_METRICS:
+        old = lookup(baseline, section).get(key)
+        new = lookup(current, section).get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        worse = change < 0 if higher_is_better else change > 0
+        flag = "  (worse)" if worse and abs(change) >= 10 else ""
+        print(f"{(section + '.' if section else '') + key:45} {old:>12} {new:>12} {change:>+8.1f}%{flag}")
+
+def main():
+    args = parse_args()
+    output = args.output or os.path.join(os.getcwd(), "data", "benchmarks", f"index_retrieval-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    # Add project root to path
+    sys.path.append(os.getcwd())
+
+    with tempfile.TemporaryDirectory(prefix="aws-docs-bench-") as workdir:
+        configure_environment(args, workdir)
+        results = run(args)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import re
+import sys
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+from corpus import generate_page
+
+# Local stand-in for docs.aws.amazon.com: a sitemap index, one userguide sitemap per service and
+# HTML pages in the AWS layout (`div#main-col-body`). Point AWS_DOCS_SITEMAP_INDEX_URL at
+# `<base_url>/sitemap_index.xml` to scrape it.
+
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+PAGE_PATH = re.compile(r"^/([^/]+)/latest/userguide/page-(\d+)\.html$")
+
+
+def _markdown_to_html(markdown: str) -> str:
+    html = []
+    in_code = False
+    for line in markdown.splitlines():
+        if line.startswith("```"):
+            html.append("</code></pre>" if in_code else "<pre><code>")
+            in_code = not in_code
+        elif in_code:
+            html.append(line)
+        elif line.startswith("#"):
+            level = len(line) - len(line.lstrip("#"))
+            html.append(f"<h{level}>{line[level:].strip()}</h{level}>")
+        elif line:
+            html.append(f"<p>{line}</p>")
+    return "\n".join(html)
+
+
+class DocsSite:
+    """Serves `pages` synthetic pages for each service, each response delayed by `latency_ms`."""
+
+    def __init__(self, services: list[str], pages: int, latency_ms: float = 0, sections: int = 6, paragraphs: int = 3, host: str = "127.0.0.1", port: int = 0):
+        self.services = services
+        self.pages = pages
+        self.latency_ms = latency_ms
+        self.sections = sections
+        self.paragraphs = paragraphs
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def sitemap_index_url(self) -> str:
+        return f"{self.base_url}/sitemap_index.xml"
+
+    def _sitemap_index(self) -> str:
+        entries = "".join(f"<sitemap><loc>{self.base_url}/{s}/latest/userguide/sitemap.xml</loc></sitemap>" for s in self.services)
+        return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="{SITEMAP_NS}">{entries}</sitemapindex>'
+
+    def _sitemap(self, service: str) -> str:
+        entries = "".join(f"<url><loc>{self.base_url}/{service}/latest/userguide/page-{i}.html</loc></url>" for i in range(self.pages))
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{SITEMAP_NS}">{entries}</urlset>'
+
+    def _page(self, service: str, index: int) -> str:
+        # Seeded per page, so every fetch of a page returns the same content
+        _, markdown, _ = generate_page(random.Random(f"{service}-{index}"), service, index, self.sections, self.paragraphs)
+        return f'<html><body><div id="nav">Navigation</div><div id="main-col-body">{_markdown_to_html(markdown)}</div></body></html>'
+
+    def route(self, path: str):
+        """(content type, body) for a path, or None for 404."""
+        if path == "/sitemap_index.xml":
+            return "application/xml", self._sitemap_index()
+        for service in self.services:
+            if path == f"/{service}/latest/userguide/sitemap.xml":
+                return "application/xml", self._sitemap(service)
+        match = PAGE_PATH.match(path)
+        if match and match.group(1) in self.services and int(match.group(2)) < self.pages:
+            return "text/html; charset=utf-8", self._page(match.group(1), int(match.group(2)))
+        return None
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests += 1
+                if site.latency_ms:
+                    time.sleep(site.latency_ms / 1000)
+                routed = site.route(self.path)
+                if routed is None:
+                    self.send_error(404)
+                    return
+                content_type, body = routed
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="docs-site", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a synthetic AWS documentation site.")
+    parser.add_argument("--services", nargs="+", default=["AmazonS3", "AWSLambda"])
+    parser.add_argument("--pages", type=int, default=50, help="Pages per service")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay per response")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    site = DocsSite(args.services, args.pages, args.latency_ms, port=args.port).start()
+    print(f"Serving {len(args.services)} services at {site.sitemap_index_url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        site.stop()
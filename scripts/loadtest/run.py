@@ -0,0 +1,393 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+from docs_site import DocsSite
+
+# Load test for one API worker: starts the app (uvicorn, one worker) with the fake LLM and fake
+# embedder, an in-memory Qdrant and a local docs site, scrapes and indexes the site through
+# /scrape, then drives /ask, /agent and /search at each concurrency level.
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+SCENARIOS = ("search", "ask", "ask_stream", "agent_stream")
+TOPICS = ["bucket versioning", "lifecycle rules", "encryption", "access points", "replication", "event notifications",
+          "concurrency", "layers", "environment variables", "IAM roles", "VPC endpoints", "quotas"]
+LAG_METRIC = "aws_docs_event_loop_lag_seconds"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test /ask, /agent, /search and /scrape on one API worker (no network).")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=["search", "ask_stream", "agent_stream"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32], help="Concurrent users per run")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per run")
+    parser.add_argument("--services", type=int, default=2, help="Services on the docs site")
+    parser.add_argument("--pages", type=int, default=40, help="Pages per service")
+    parser.add_argument("--docs-latency-ms", type=float, default=20, help="Docs site delay per response")
+    parser.add_argument("--first-token-ms", type=float, default=400, help="Fake LLM delay before each model response")
+    parser.add_argument("--token-ms", type=float, default=20, help="Fake LLM delay between tokens")
+    parser.add_argument("--output-tokens", type=int, default=100, help="Fake LLM tokens per answer")
+    parser.add_argument("--question-pool", type=int, default=0, help="Draw questions from a pool of this size (0: every question is new)")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the answer, retrieval and embedding caches on (off by default, to measure the uncached path)")
+    parser.add_argument("--port", type=int, default=0, help="API port (default: a free port)")
+    parser.add_argument("--output", help="JSON results file (default: data/loadtest/loadtest-<time>.json)")
+    parser.add_argument("--check", help="Baseline file with targets; exits with status 1 if any is missed")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+# --- Server under test ---
+
+def server_environment(args, workdir: str, docs: DocsSite) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DATA_DIR": os.path.join(workdir, "data"),
+        "QDRANT_LOCAL_PATH": ":memory:",
+        "EMBEDDING_BACKEND": "fake",
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_FIRST_TOKEN_MS": str(args.first_token_ms),
+        "FAKE_LLM_TOKEN_MS": str(args.token_ms),
+        "FAKE_LLM_OUTPUT_TOKENS": str(args.output_tokens),
+        "AWS_DOCS_SITEMAP_INDEX_URL": docs.sitemap_index_url,
+        # No Gemini warm-up and no trace export; the fake embedder does not need rate limiting
+        "GOOGLE_API_KEY": "",
+        "LANGFUSE_PUBLIC_KEY": "",
+        "LANGFUSE_SECRET_KEY": "",
+        "EMBEDDING_RATE_LIMIT": "10000",
+        "EMBEDDING_MAX_RATE": "10000",
+    })
+    if not args.with_caches:
+        env.update({"ANSWER_CACHE_ENABLED": "false", "RETRIEVAL_CACHE_ENABLED": "false", "EMBEDDING_CACHE_ENABLED": "false"})
+    return env
+
+
+async def wait_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API exited with status {process.returncode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API not ready in time")
+
+
+# --- Event loop lag from /metrics ---
+
+def lag_histogram(metrics_text: str) -> dict:
+    buckets = {}
+    total = count = 0.0
+    for line in metrics_text.splitlines():
+        if not line.startswith(LAG_METRIC):
+            continue
+        name, value = line.rsplit(" ", 1)
+        if name.startswith(LAG_METRIC + "_bucket"):
+            le = re.search(r'le="([^"]+)"', name).group(1)
+            buckets[float("inf") if le == "+Inf" else float(le)] = float(value)
+        elif name == LAG_METRIC + "_sum":
+            total = float(value)
+        elif name == LAG_METRIC + "_count":
+            count = float(value)
+    return {"buckets": buckets, "sum": total, "count": count}
+
+
+def histogram_quantile(q: float, buckets: list[tuple[float, float]]):
+    """Same linear interpolation as Prometheus' histogram_quantile, over cumulative (bound, count) pairs."""
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower, below = 0.0, 0.0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(cumulative - below, 1e-9)
+        lower, below = bound, cumulative
+    return lower
+
+
+def lag_summary(before: dict, after: dict) -> dict:
+    buckets = sorted((bound, count - before["buckets"].get(bound, 0)) for bound, count in after["buckets"].items())
+    count = after["count"] - before["count"]
+    if not count:
+        return {"samples": 0}
+    p50, p99 = histogram_quantile(0.5, buckets), histogram_quantile(0.99, buckets)
+    return {
+        "samples": int(count),
+        "mean_ms": round((after["sum"] - before["sum"]) / count * 1000, 2),
+        "p50_ms": round(p50 * 1000, 2),
+        "p99_ms": round(p99 * 1000, 2),
+    }
+
+
+async def read_lag(client: httpx.AsyncClient) -> dict:
+    return lag_histogram((await client.get("/metrics")).text)
+
+
+# --- Requests ---
+
+class Rejected(Exception):
+    """429/503 from admission control, with the server's Retry-After."""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+def check_admission(response: httpx.Response):
+    if response.status_code in (429, 503):
+        raise Rejected(float(response.headers.get("Retry-After", 1)))
+
+
+def make_question(rng: random.Random, services: list[str], pool: int, n: int) -> tuple[str, str]:
+    if pool:
+        n = rng.randrange(pool)
+    service = services[n % len(services)]
+    topic = TOPICS[n % len(TOPICS)]
+    return service, f"How do I configure {topic} in {service}? (question {n})"
+
+
+async def request_search(client, service, question):
+    response = await client.post("/search", json={"query": question, "service_name": service})
+    check_admission(response)
+    return response.status_code == 200, None
+
+
+async def request_ask(client, service, question):
+    response = await client.post("/ask", json={"question": question, "service_name": service})
+    check_admission(response)
+    ok = response.status_code == 200 and not response.json()["answer"].startswith("Error")
+    return ok, None
+
+
+async def request_ask_stream(client, service, question):
+    start = time.perf_counter()
+    ttft = None
+    ok = True
+    async with client.stream("POST", "/ask", json={"question": question, "service_name": service, "stream": True}) as response:
+        check_admission(response)
+        if response.status_code != 200:
+            return False, None
+        async for line in response.aiter_lines():
+            if line == "event: token" and ttft is None:
+                ttft = time.perf_counter() - start
+            elif line == "event: error":
+                ok = False
+    return ok and ttft is not None, ttft
+
+
+async def request_agent_stream(client, service, question):
+    start = time.perf_counter()
+    ttft = None
+    async with client.stream("POST", "/agent", json={"query": question, "stream": True}) as response:
+        check_admission(response)
+        if response.status_code != 200:
+            return False, None
+        async for line in response.aiter_lines():
+            if ttft is None and line.startswith('{"type": "answer"'):
+                ttft = time.perf_counter() - start
+    return ttft is not None, ttft
+
+
+REQUESTS = {
+    "search": request_search,
+    "ask": request_ask,
+    "ask_stream": request_ask_stream,
+    "agent_stream": request_agent_stream,
+}
+
+
+async def run_scenario(client, scenario: str, concurrency: int, args, services: list[str]) -> dict:
+    """
+    Closed loop: `concurrency` users each send their next request as soon as the previous one
+    finishes. A user turned away by admission control (429/503) waits for its Retry-After.
+    """
+    issue = REQUESTS[scenario]
+    rng = random.Random(f"{scenario}-{concurrency}")
+    counter = iter(range(10 ** 9))
+    latencies, ttfts, errors, rejected = [], [], 0, 0
+
+    async def user(deadline: float):
+        nonlocal errors, rejected
+        while time.perf_counter() < deadline:
+            service, question = make_question(rng, services, args.question_pool, next(counter))
+            start = time.perf_counter()
+            try:
+                ok, ttft = await issue(client, service, question)
+            except Rejected as e:
+                rejected += 1
+                await asyncio.sleep(max(0.0, min(e.retry_after, deadline - time.perf_counter())))
+                continue
+            except httpx.HTTPError:
+                ok, ttft = False, None
+            if not ok:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if ttft is not None:
+                ttfts.append(ttft)
+
+    lag_before = await read_lag(client)
+    start = time.perf_counter()
+    await asyncio.gather(*(user(start + args.duration) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    lag_after = await read_lag(client)
+
+    completed = len(latencies)
+    ms = lambda values, q: round(percentile(values, q) * 1000, 1) if values else None
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "completed": completed,
+        "errors": errors,
+        "error_rate": round(errors / max(completed + errors, 1), 4),
+        "rejected": rejected,
+        "throughput_rps": round(completed / elapsed, 2),
+        "latency_ms": {"p50": ms(latencies, 50), "p95": ms(latencies, 95), "p99": ms(latencies, 99)},
+        "ttft_ms": {"p50": ms(ttfts, 50), "p95": ms(ttfts, 95), "p99": ms(ttfts, 99)} if ttfts else None,
+        "event_loop_lag": lag_summary(lag_before, lag_after),
+    }
+
+
+async def run_scrape(client, services: list[str], args) -> dict:
+    """Scrapes and indexes every service of the docs site through POST /scrape (streamed job events)."""
+    lag_before = await read_lag(client)
+    start = time.perf_counter()
+    finished = {}
+    async with client.stream("POST", "/scrape", json={"services": services, "limit": args.pages}) as response:
+        async for line in response.aiter_lines():
+            event = json.loads(line) if line else {}
+            if event.get("type") == "job_finished":
+                finished[event["service"]] = event["status"]
+    elapsed = time.perf_counter() - start
+    failed = {s: status for s, status in finished.items() if status != "succeeded"}
+    if failed or len(finished) != len(services):
+        raise RuntimeError(f"Scrape jobs did not succeed: {finished}")
+    pages = len(services) * args.pages
+    return {
+        "services": len(services),
+        "pages": pages,
+        "seconds": round(elapsed, 2),
+        "pages_per_second": round(pages / elapsed, 1),
+        "event_loop_lag": lag_summary(lag_before, await read_lag(client)),
+    }
+
+
+# --- Baseline targets ---
+
+def check_targets(results: dict, baseline: dict) -> list[str]:
+    failures = []
+    runs = {(run["scenario"], run["concurrency"]): run for run in results["runs"]}
+    for target in baseline.get("targets", []):
+        run = runs.get((target["scenario"], target["concurrency"]))
+        if run is None:
+            continue
+        label = f"{target['scenario']} x{target['concurrency']}"
+        checks = [
+            ("throughput_rps", run["throughput_rps"], target.get("min_throughput_rps"), False),
+            ("latency p95 ms", run["latency_ms"]["p95"], target.get("max_p95_ms"), True),
+            ("ttft p95 ms", (run["ttft_ms"] or {}).get("p95"), target.get("max_ttft_p95_ms"), True),
+            ("loop lag p99 ms", run["event_loop_lag"].get("p99_ms"), target.get("max_loop_lag_p99_ms"), True),
+            ("error rate", run["error_rate"], target.get("max_error_rate"), True),
+        ]
+        for name, value, limit, is_max in checks:
+            if limit is None or value is None:
+                continue
+            if (value > limit) if is_max else (value < limit):
+                failures.append(f"{label}: {name} {value} {'>' if is_max else '<'} target {limit}")
+    return failures
+
+
+def print_run(run: dict):
+    ttft = run["ttft_ms"] or {}
+    lag = run["event_loop_lag"]
+    print(
+        f"{run['scenario']:13} x{run['concurrency']:<4} {run['throughput_rps']:>7} req/s  "
+        f"p50 {run['latency_ms']['p50']} p95 {run['latency_ms']['p95']} p99 {run['latency_ms']['p99']} ms  "
+        f"ttft p95 {ttft.get('p95', '-')} ms  loop lag p99 {lag.get('p99_ms', '-')} ms  errors {run['errors']}  rejected {run['rejected']}"
+    )
+
+
+async def main_async(args) -> dict:
+    services = [f"LoadTestService{i + 1}" for i in range(args.services)]
+    docs = DocsSite(services, args.pages, args.docs_latency_ms).start()
+    port = args.port or free_port()
+
+    with tempfile.TemporaryDirectory(prefix="aws-docs-loadtest-") as workdir:
+        log_path = os.path.join(workdir, "api.log")
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "api.main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", "1", "--log-level", "warning"],
+                cwd=PROJECT_ROOT, env=server_environment(args, workdir, docs), stdout=log, stderr=subprocess.STDOUT,
+            )
+        limits = httpx.Limits(max_connections=max(args.concurrency) + 10, max_keepalive_connections=max(args.concurrency) + 10)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300, limits=limits) as client:
+                await wait_ready(client, process)
+                scrape = await run_scrape(client, services, args)
+                print(f"Scraped and indexed {scrape['pages']} pages in {scrape['seconds']}s ({scrape['pages_per_second']} pages/s)")
+                runs = []
+                for scenario in args.scenarios:
+                    for concurrency in args.concurrency:
+                        run = await run_scenario(client, scenario, concurrency, args, services)
+                        print_run(run)
+                        runs.append(run)
+        except Exception:
+            with open(log_path) as log:
+                print("".join(log.readlines()[-30:]), file=sys.stderr)
+            raise
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            docs.stop()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "check", "port")}
+    return {"config": config, "scrape": scrape, "runs": runs}
+
+
+def main():
+    args = parse_args()
+    results = asyncio.run(main_async(args))
+
+    output = args.output or os.path.join(os.getcwd(), "data", "loadtest", f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.check:
+        with open(args.check, "r", encoding="utf-8") as f:
+            failures = check_targets(results, json.load(f))
+        for failure in failures:
+            print(f"MISSED {failure}")
+        if failures:
+            sys.exit(1)
+        print("All baseline targets met.")
+
+
+if __name__ == "__main__":
+    main()
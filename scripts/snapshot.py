@@ -0,0 +1,37 @@
+import argparse
+import json
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from api.services.snapshot import export_service_snapshot, import_service_snapshot
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import service snapshots (raw pages, chunks and vectors).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export a service collection to a snapshot directory.")
+    export_parser.add_argument("service", help="Service name, e.g. AmazonS3")
+    export_parser.add_argument("--output", help="Snapshot directory (default: data/snapshots/<service>)")
+    export_parser.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="Vector storage type")
+
+    import_parser = subparsers.add_parser("import", help="Bulk-load a snapshot directory into the vector DB.")
+    import_parser.add_argument("path", help="Snapshot directory")
+    import_parser.add_argument("--service", help="Import under a different service name")
+    import_parser.add_argument("--force", action="store_true", help="Import even if the embedding model differs")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        result = export_service_snapshot(args.service, output_dir=args.output, dtype=args.dtype)
+    else:
+        result = import_service_snapshot(args.path, service_name=args.service, force=args.force)
+
+    print(json.dumps(result, indent=2))
+    if result.get("status") != "success":
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
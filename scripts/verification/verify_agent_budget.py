@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import asyncio
+sys.path.append(os.getcwd())
+
+# No Qdrant or Gemini: the discovery tool returns an empty list and the catalog is not injected
+os.environ["QDRANT_HOST"] = ""
+os.environ["AGENT_INJECT_CATALOG"] = "false"
+os.environ["AGENT_MAX_TOOL_ITERATIONS"] = "2"
+
+from strands.models import Model
+from api.services import agent as agent_service
+
+# Checks that a run which uses up AGENT_MAX_TOOL_ITERATIONS still answers: the model's next
+# call reads the refused tool call and answers. A model that keeps asking for tools after the
+# refusal is stopped.
+
+REFUSAL = "Tool call limit reached"
+ANSWER = "Here is what I found."
+
+
+def _tool_refused(messages: list) -> bool:
+    last = messages[-1] if messages else {}
+    return any(
+        REFUSAL in item.get("text", "")
+        for block in last.get("content", []) if "toolResult" in block
+        for item in block["toolResult"].get("content", [])
+    )
+
+
+class ToolHungryModel(Model):
+    """Calls `list_available_services` every turn; with `answers_when_refused`, answers once a call is refused."""
+
+    def __init__(self, answers_when_refused: bool):
+        self.config = {"model_id": "tool-hungry"}
+        self.answers_when_refused = answers_when_refused
+        self.calls = 0
+
+    def update_config(self, **model_config):
+        self.config.update(model_config)
+
+    def get_config(self):
+        return self.config
+
+    async def structured_output(self, output_model, prompt, system_prompt=None, **kwargs):
+        yield {"output": output_model()}
+
+    async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+        self.calls += 1
+        yield {"messageStart": {"role": "assistant"}}
+        if self.answers_when_refused and _tool_refused(messages):
+            yield {"contentBlockDelta": {"delta": {"text": ANSWER}}}
+            yield {"contentBlockStop": {}}
+            yield {"messageStop": {"stopReason": "end_turn"}}
+            return
+        yield {"contentBlockStart": {"start": {"toolUse": {"toolUseId": f"tool-{self.calls}", "name": "list_available_services"}}}}
+        yield {"contentBlockDelta": {"delta": {"toolUse": {"input": "{}"}}}}
+        yield {"contentBlockStop": {}}
+        yield {"messageStop": {"stopReason": "tool_use"}}
+
+
+async def run(model: Model) -> tuple[str, dict]:
+    agent_service.get_gemini_model = lambda *args, **kwargs: model
+    events = [json.loads(line) async for line in agent_service.run_agent_stream("Which services are indexed?")]
+    answer = "".join(event["content"] for event in events if event["type"] == "answer")
+    return answer, events[-1]["content"]
+
+
+async def main_async() -> bool:
+    answer, stats = await run(ToolHungryModel(answers_when_refused=True))
+    answered = ANSWER in answer and not stats["stopped_early"] and stats["tool_calls"] == 2 and stats["tool_calls_refused"] == 1
+    print(f"answers after refusal: answer={answer.strip()!r}, tool_calls={stats['tool_calls']}, refused={stats['tool_calls_refused']} -> {'OK' if answered else 'FAIL'}")
+
+    answer, stats = await run(ToolHungryModel(answers_when_refused=False))
+    stopped = stats["stopped_early"] and "step limit" in answer and stats["tool_calls"] == 2
+    print(f"keeps calling tools: answer={answer.strip()!r}, model_calls={stats['model_calls']}, refused={stats['tool_calls_refused']} -> {'OK' if stopped else 'FAIL'}")
+    return answered and stopped
+
+
+def main():
+    sys.exit(0 if asyncio.run(main_async()) else 1)
+
+
+if __name__ == "__main__":
+    main()
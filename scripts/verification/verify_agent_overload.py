@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import asyncio
+sys.path.append(os.getcwd())
+
+# No Qdrant or Gemini: the discovery tool returns an empty list and the catalog is not injected
+os.environ["QDRANT_HOST"] = ""
+os.environ["AGENT_INJECT_CATALOG"] = "false"
+
+from strands.models import Model
+from api.services import agent as agent_service
+from api.services.admission import Overloaded
+
+# Checks that an Overloaded raised by the model after a tool call (which Strands wraps in an
+# EventLoopException) still ends /agent/stream with the stop note and stats event, and makes
+# the non-streamed run raise Overloaded for the API's 429/503 handler.
+
+
+class OverloadedOnSecondTurnModel(Model):
+    """Calls `list_available_services` on its first turn and is turned away on the second."""
+
+    def __init__(self):
+        self.config = {"model_id": "overloaded-on-second-turn"}
+        self.calls = 0
+
+    def update_config(self, **model_config):
+        self.config.update(model_config)
+
+    def get_config(self):
+        return self.config
+
+    async def structured_output(self, output_model, prompt, system_prompt=None, **kwargs):
+        raise NotImplementedError
+
+    async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+        self.calls += 1
+        if self.calls > 1:
+            raise Overloaded("llm", "queue_full", 3)
+        yield {"messageStart": {"role": "assistant"}}
+        yield {"contentBlockStart": {"start": {"toolUse": {"toolUseId": "tool-1", "name": "list_available_services"}}}}
+        yield {"contentBlockDelta": {"delta": {"toolUse": {"input": "{}"}}}}
+        yield {"contentBlockStop": {}}
+        yield {"messageStop": {"stopReason": "tool_use"}}
+
+
+def use_model(model: Model):
+    agent_service.get_gemini_model = lambda *args, **kwargs: model
+
+
+async def check_stream() -> bool:
+    model = OverloadedOnSecondTurnModel()
+    use_model(model)
+    events = [json.loads(line) async for line in agent_service.run_agent_stream("Which services are indexed?")]
+    answer = "".join(event["content"] for event in events if event["type"] == "answer")
+    stats = events[-1]["content"] if events and events[-1]["type"] == "stats" else {}
+    ok = model.calls == 2 and "_Stopped: llm is overloaded" in answer and "overloaded" in stats
+    print(f"stream: model calls={model.calls}, answer={answer.strip()!r}, stats overloaded={stats.get('overloaded')!r} -> {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+def check_sync() -> bool:
+    model = OverloadedOnSecondTurnModel()
+    use_model(model)
+    try:
+        agent_service.run_agent("Which services are indexed?")
+    except Overloaded as error:
+        ok = model.calls == 2 and error.retry_after == 3
+        print(f"sync: raised Overloaded ({error}, retry_after={error.retry_after}) -> {'OK' if ok else 'FAIL'}")
+        return ok
+    except Exception as error:
+        print(f"sync: raised {type(error).__name__} instead of Overloaded: {error} -> FAIL")
+        return False
+    print("sync: no error raised -> FAIL")
+    return False
+
+
+def main():
+    ok = asyncio.run(check_stream())
+    ok = check_sync() and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Modules that must stay out of `import api.main`: they are loaded on first use or by the
+# background warm-up, and together they made API startup take several seconds
+DEFERRED_MODULES = ["strands", "qdrant_client", "google.genai", "langfuse", "bs4", "markdownify"]
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import api.main
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({"elapsed_ms": elapsed_ms, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+def measure(runs: int) -> tuple[list[float], list[str]]:
+    # A fresh interpreter per run, so nothing is already imported
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=os.getcwd(), capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        timings.append(result["elapsed_ms"])
+        loaded.update(result["loaded"])
+    return timings, sorted(loaded)
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that `import api.main` stays within its time budget.")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", 1500)))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    timings, loaded = measure(args.runs)
+    # The fastest run is the least affected by a cold disk cache or a busy machine
+    best = min(timings)
+    print(f"import api.main: best {best:.0f} ms, runs {', '.join(f'{t:.0f}' for t in timings)} ms (budget {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if best > args.budget_ms:
+        print(f"FAIL: import time exceeds the budget by {best - args.budget_ms:.0f} ms")
+        failed = True
+    if loaded:
+        print(f"FAIL: modules that should be deferred were imported: {', '.join(loaded)}")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
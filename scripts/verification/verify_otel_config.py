@@ -11,9 +11,16 @@ print("--- Verifying OpenTelemetry Configuration ---")
 print(f"OTEL_EXPORTER_OTLP_ENDPOINT: {settings.OTEL_EXPORTER_OTLP_ENDPOINT}")
 print(f"OTEL_SERVICE_NAME: {settings.OTEL_SERVICE_NAME}")
 print(f"OTEL_TRACE_SAMPLING_RATIO: {settings.OTEL_TRACE_SAMPLING_RATIO}")
+print(f"TRACE_KEEP_SLOW_MS: {settings.TRACE_KEEP_SLOW_MS}")
+print(f"TRACE_KEEP_ERRORS: {settings.TRACE_KEEP_ERRORS}")
+print(f"TRACE_PAYLOADS: {settings.TRACE_PAYLOADS}")
 
 # Verify types
 if not isinstance(settings.OTEL_TRACE_SAMPLING_RATIO, float):
     print("Error: OTEL_TRACE_SAMPLING_RATIO should be a float.")
+elif not 0.0 <= settings.OTEL_TRACE_SAMPLING_RATIO <= 1.0:
+    print("Error: OTEL_TRACE_SAMPLING_RATIO should be between 0 and 1.")
+elif settings.TRACE_PAYLOADS not in ("full", "truncated", "none"):
+    print("Error: TRACE_PAYLOADS should be one of full, truncated, none.")
 else:
     print("Type check passed.")